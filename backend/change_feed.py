@@ -0,0 +1,140 @@
+"""
+设备变更版本模块
+devices表的每一行带有单调递增的变更版本号：新增设备、状态或配置字段变化时由触发器分配新版本，
+删除设备时写入删除记录。客户端记住已同步到的版本，之后只拉取该版本之后变化的设备，
+不再反复下载整个设备列表；状态未变化的检查结果只更新检查时间，不产生新版本
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEEPALIVE_INTERVAL = 15.0  # 变更推送流无变化时发送保活注释的间隔（秒）
+
+# 变化时分配新版本的设备字段（last_seen/last_check/check_count等检查信息不计入）
+VERSIONED_FIELDS = ("region", "store", "ip", "port", "user", "pwd", "chs", "name", "status", "protocol")
+
+_schema_ready = False
+
+
+def ensure_change_feed_schema(conn):
+    """创建变更版本所需的列、表、索引和触发器（重复调用无副作用），需要在devices表创建之后调用"""
+    global _schema_ready
+    if _schema_ready:
+        return
+
+    cursor = conn.cursor()
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(devices)").fetchall()}
+    if "version" not in columns:
+        # 已有设备按ID分配初始版本，保证都大于0
+        cursor.execute("ALTER TABLE devices ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+        cursor.execute("UPDATE devices SET version = id")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_change_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute(
+        "INSERT OR IGNORE INTO device_change_seq (id, version) VALUES (1, (SELECT COALESCE(MAX(version), 0) FROM devices))"
+    )
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_tombstones (
+            device_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_version ON devices (version)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_device_tombstones_version ON device_tombstones (version)")
+
+    next_version = "UPDATE device_change_seq SET version = version + 1 WHERE id = 1;"
+    current_version = "(SELECT version FROM device_change_seq WHERE id = 1)"
+    changed = " OR ".join(f"OLD.{field} IS NOT NEW.{field}" for field in VERSIONED_FIELDS)
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_devices_version_insert AFTER INSERT ON devices
+        BEGIN
+            {next_version}
+            UPDATE devices SET version = {current_version} WHERE id = NEW.id;
+            DELETE FROM device_tombstones WHERE device_id = NEW.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_devices_version_update AFTER UPDATE OF {", ".join(VERSIONED_FIELDS)} ON devices
+        WHEN {changed}
+        BEGIN
+            {next_version}
+            UPDATE devices SET version = {current_version} WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_devices_version_delete AFTER DELETE ON devices
+        BEGIN
+            {next_version}
+            INSERT OR REPLACE INTO device_tombstones (device_id, version) VALUES (OLD.id, {current_version});
+        END
+    ''')
+    _schema_ready = True
+
+
+class ChangeNotifier:
+    """
+    设备变化通知
+    写回线程或API处理函数调用notify()，等待中的变更推送流被唤醒后各自查询新版本之后的变化
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+
+        # 统计信息
+        self.notifications = 0
+        self.subscribers = 0
+
+    def snapshot(self) -> asyncio.Event:
+        """
+        返回当前的通知事件，在查询变化之前调用：
+        查询期间发生的变化会设置该事件，之后的wait()立即返回，不会漏掉通知
+        """
+        if self._event is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+        return self._event
+
+    def _wake(self):
+        event, self._event = self._event, asyncio.Event()
+        if event is not None:
+            event.set()
+
+    def notify(self, *_: Any):
+        """通知设备有变化（可在任意线程调用，也可直接注册为状态写回的监听函数）"""
+        self.notifications += 1
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # 还没有订阅者
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._wake()
+        else:
+            loop.call_soon_threadsafe(self._wake)
+
+    @staticmethod
+    async def wait(event: asyncio.Event, timeout: float) -> bool:
+        """等待snapshot()返回的事件，有变化返回True，超时返回False"""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "subscribers": self.subscribers,
+            "notifications": self.notifications
+        }
@@ -0,0 +1,214 @@
+"""
+通道状态模块
+NVR的每个通道（主码流、子码流）在channels表中单独记录状态和SDP信息：
+通道巡检对每台NVR只建立一个RTSP控制连接，依次DESCRIBE所有通道，多台NVR之间并发，
+单个摄像头掉线时设备仍在线，但对应通道显示离线
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.rtsp_probe import HEALTHY, channel_path
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+STREAM_TYPES = ("main", "sub")
+DEFAULT_STREAM_TYPES = ("main", "sub")  # 通道巡检默认检查的码流
+
+CHANNEL_COLUMNS = ("c.device_id, c.channel, c.stream_type, c.status, c.probe_status, c.codec, c.width, c.height, "
+                   "c.framerate, c.audio_codec, c.rtsp_status, c.error, c.last_check, c.last_online")
+
+# 通道：(通道号, 码流类型)
+ChannelKey = Tuple[int, str]
+# 一台设备的巡检结果：(通道数, {(通道号, 码流类型): 探测结果})
+DeviceSweep = Tuple[int, Dict[ChannelKey, Dict[str, Any]]]
+
+_schema_ready = False
+
+
+def ensure_channel_schema(conn):
+    """创建通道状态表"""
+    global _schema_ready
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS channels (
+            device_id INTEGER NOT NULL,
+            channel INTEGER NOT NULL,
+            stream_type TEXT NOT NULL DEFAULT 'main',
+            status TEXT NOT NULL DEFAULT 'offline',
+            probe_status TEXT,
+            codec TEXT,
+            width INTEGER,
+            height INTEGER,
+            framerate REAL,
+            audio_codec TEXT,
+            rtsp_status INTEGER,
+            error TEXT,
+            last_check TIMESTAMP,
+            last_online TIMESTAMP,
+            PRIMARY KEY (device_id, channel, stream_type)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_channels_status ON channels (status, device_id)")
+    _schema_ready = True
+
+
+def channel_paths(channels: int, stream_types=DEFAULT_STREAM_TYPES) -> Dict[str, ChannelKey]:
+    """设备所有通道的RTSP路径，返回 路径 -> (通道号, 码流类型)"""
+    return {
+        channel_path(channel, stream_type): (channel, stream_type)
+        for channel in range(1, max(int(channels or 1), 1) + 1)
+        for stream_type in stream_types
+    }
+
+
+async def sweep_devices(probe_engine, devices: Iterable[Tuple[int, str, int, Optional[str], Optional[str], int]],
+                        stream_types=DEFAULT_STREAM_TYPES) -> Dict[int, DeviceSweep]:
+    """
+    巡检多台设备的所有通道，每台设备一个RTSP控制连接，设备之间并发
+    devices为(设备ID, IP, 端口, 用户名, 密码, 通道数)序列，返回 设备ID -> (通道数, {(通道号, 码流类型): 探测结果})
+    """
+    targets, paths_by_device, channel_counts = [], {}, {}
+    for device_id, ip, port, username, password, channels in devices:
+        paths = channel_paths(channels, stream_types)
+        paths_by_device[device_id] = paths
+        channel_counts[device_id] = max(int(channels or 1), 1)
+        targets.append((device_id, ip, port, username, password, list(paths)))
+
+    results = await probe_engine.sweep_channels(targets)
+    return {
+        device_id: (channel_counts[device_id],
+                    {paths_by_device[device_id][path]: result for path, result in by_path.items()})
+        for device_id, by_path in results.items()
+    }
+
+
+def record_channel_results(conn, sweeps: Dict[int, DeviceSweep], checked_at: Optional[str] = None):
+    """
+    在一个事务中写入通道巡检结果
+    sweeps为 设备ID -> (通道数, {(通道号, 码流类型): 探测结果})；超出当前通道数的旧通道记录一并删除
+    """
+    if not sweeps:
+        return
+    if not _schema_ready:
+        ensure_channel_schema(conn)
+    checked_at = checked_at or datetime.now().isoformat()
+
+    rows = []
+    for device_id, (_, results) in sweeps.items():
+        for (channel, stream_type), result in results.items():
+            video = result.get("video") or {}
+            audio = result.get("audio") or {}
+            healthy = result["status"] == HEALTHY
+            rows.append((
+                device_id, channel, stream_type, "online" if healthy else "offline", result["status"],
+                video.get("codec"), video.get("width"), video.get("height"), video.get("framerate"),
+                audio.get("codec"), result.get("rtsp_status"), result.get("error"), checked_at,
+                checked_at if healthy else None
+            ))
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            '''
+            INSERT INTO channels (device_id, channel, stream_type, status, probe_status, codec, width, height,
+                                  framerate, audio_codec, rtsp_status, error, last_check, last_online)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, channel, stream_type) DO UPDATE SET
+                status = excluded.status, probe_status = excluded.probe_status,
+                codec = COALESCE(excluded.codec, codec), width = COALESCE(excluded.width, width),
+                height = COALESCE(excluded.height, height), framerate = COALESCE(excluded.framerate, framerate),
+                audio_codec = CASE WHEN excluded.status = 'online' THEN excluded.audio_codec ELSE audio_codec END,
+                rtsp_status = excluded.rtsp_status, error = excluded.error, last_check = excluded.last_check,
+                last_online = COALESCE(excluded.last_online, last_online)
+            ''',
+            rows
+        )
+        cursor.executemany(
+            "DELETE FROM channels WHERE device_id = ? AND channel > ?",
+            [(device_id, channels) for device_id, (channels, _) in sweeps.items()]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def prune_channels(conn) -> int:
+    """删除已删除设备的通道记录"""
+    if not _schema_ready:
+        ensure_channel_schema(conn)
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM channels WHERE device_id NOT IN (SELECT id FROM devices)")
+    conn.commit()
+    return cursor.rowcount
+
+
+def _channel_row(row) -> Dict[str, Any]:
+    (device_id, channel, stream_type, status, probe_status, codec, width, height, framerate, audio_codec,
+     rtsp_status, error, last_check, last_online) = row[:14]
+    return {
+        "device_id": device_id,
+        "channel": channel,
+        "stream_type": stream_type,
+        "status": status,
+        "probe_status": probe_status,
+        "codec": codec,
+        "width": width,
+        "height": height,
+        "framerate": framerate,
+        "audio_codec": audio_codec,
+        "rtsp_status": rtsp_status,
+        "error": error,
+        "last_check": last_check,
+        "last_online": last_online
+    }
+
+
+def query_channels(conn, device_id: Optional[int] = None, status: Optional[str] = None,
+                   probe_status: Optional[str] = None, stream_type: Optional[str] = None,
+                   region: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """查询通道状态（附带设备的区域、门店和名称），可按设备、状态、探测结果、码流类型和区域筛选"""
+    conditions, params = [], []
+    for column, value in (("c.device_id", device_id), ("c.status", status), ("c.probe_status", probe_status),
+                          ("c.stream_type", stream_type), ("d.region", region)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    sql = f"SELECT {CHANNEL_COLUMNS}, d.region, d.store, d.name FROM channels c JOIN devices d ON d.id = c.device_id"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY c.device_id, c.channel, c.stream_type LIMIT ?"
+
+    cursor = conn.cursor()
+    cursor.execute(sql, (*params, limit))
+    items = []
+    for row in cursor.fetchall():
+        item = _channel_row(row)
+        item.update(region=row[14], store=row[15], name=row[16])
+        items.append(item)
+    return items
+
+
+def summarize_channels(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """按码流类型汇总通道在线数"""
+    summary: Dict[str, Dict[str, int]] = {}
+    for item in items:
+        counts = summary.setdefault(item["stream_type"], {"total": 0, "online": 0, "offline": 0})
+        counts["total"] += 1
+        counts["online" if item["status"] == "online" else "offline"] += 1
+    return summary
+
+
+def channel_detail(item: Dict[str, Any]) -> Dict[str, Any]:
+    """通道记录转换为分级健康检查（handshake级别）的详情格式"""
+    video = {"codec": item["codec"], "width": item["width"], "height": item["height"], "framerate": item["framerate"]}
+    return {
+        "stream_type": item["stream_type"],
+        "rtsp_status": item["rtsp_status"],
+        "video": video if item["codec"] else None,
+        "audio": {"codec": item["audio_codec"]} if item["audio_codec"] else None,
+        "error": item["error"]
+    }
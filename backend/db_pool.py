@@ -0,0 +1,198 @@
+"""
+SQLite连接池模块
+复用已打开的连接，避免每个请求重新建立连接和解析语句：
+连接统一启用WAL日志（读写互不阻塞）、synchronous=NORMAL和较大的页缓存，
+每个连接保留编译后语句的缓存，归还连接池后下一个请求直接复用
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认连接参数
+DEFAULT_POOL_SIZE = 8  # 空闲连接保留数量，超出部分归还时直接关闭
+DEFAULT_TIMEOUT = 10.0  # 等待写锁的超时时间（秒）
+DEFAULT_CACHE_SIZE_KB = 20000  # 每个连接的页缓存大小（KB）
+DEFAULT_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取的大小（字节）
+DEFAULT_CACHED_STATEMENTS = 256  # 每个连接缓存的编译后语句数量
+
+
+def connection_pragmas(synchronous: str = "NORMAL", cache_size_kb: int = DEFAULT_CACHE_SIZE_KB,
+                       mmap_size: int = DEFAULT_MMAP_SIZE) -> List[str]:
+    """每个新连接需要执行的PRAGMA（同步连接池和异步连接池共用）"""
+    return [
+        f"PRAGMA synchronous={synchronous}",
+        f"PRAGMA cache_size=-{int(cache_size_kb)}",
+        f"PRAGMA mmap_size={int(mmap_size)}",
+        "PRAGMA temp_store=MEMORY"
+    ]
+
+
+class PooledConnection:
+    """
+    连接池中的连接
+    接口与sqlite3.Connection一致，close()时回滚未提交的事务并把连接归还连接池
+    """
+
+    __slots__ = ("_conn", "_pool")
+
+    def __init__(self, conn: sqlite3.Connection, pool: "SQLitePool"):
+        object.__setattr__(self, "_conn", conn)
+        object.__setattr__(self, "_pool", pool)
+
+    def _raw(self) -> sqlite3.Connection:
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("连接已归还连接池")
+        return self._conn
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._raw(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._raw(), name, value)
+
+    def __enter__(self):
+        self._raw().__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw().__exit__(exc_type, exc, tb)
+
+    def close(self):
+        """归还连接池（重复调用无副作用）"""
+        conn = self._conn
+        if conn is None:
+            return
+        object.__setattr__(self, "_conn", None)
+        self._pool.release(conn)
+
+    def __del__(self):
+        # 异常路径上未调用close()的连接在回收时归还
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class SQLitePool:
+    """SQLite连接池，连接在各线程间独占借用，可在线程池中使用"""
+
+    def __init__(self, path: str, pool_size: int = DEFAULT_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT,
+                 cache_size_kb: int = DEFAULT_CACHE_SIZE_KB, mmap_size: int = DEFAULT_MMAP_SIZE,
+                 journal_mode: str = "WAL", synchronous: str = "NORMAL",
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS, row_factory: Optional[Any] = sqlite3.Row):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.cached_statements = cached_statements
+        self.row_factory = row_factory
+
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._journal_mode_active: Optional[str] = None
+
+        # 统计信息
+        self.created = 0
+        self.reused = 0
+        self.in_use = 0
+        self.discarded = 0
+
+    @classmethod
+    def from_config(cls, path: str, sqlite_config: Optional[Dict[str, Any]] = None) -> "SQLitePool":
+        """从后端配置的database.sqlite段创建连接池"""
+        sqlite_config = sqlite_config or {}
+        return cls(
+            path,
+            pool_size=sqlite_config.get("pool_size", DEFAULT_POOL_SIZE),
+            timeout=sqlite_config.get("timeout", DEFAULT_TIMEOUT),
+            cache_size_kb=sqlite_config.get("cache_size_kb", DEFAULT_CACHE_SIZE_KB),
+            mmap_size=sqlite_config.get("mmap_size", DEFAULT_MMAP_SIZE),
+            journal_mode=sqlite_config.get("journal_mode", "WAL"),
+            synchronous=sqlite_config.get("synchronous", "NORMAL"),
+            cached_statements=sqlite_config.get("cached_statements", DEFAULT_CACHED_STATEMENTS)
+        )
+
+    def _create(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        if self.row_factory is not None:
+            conn.row_factory = self.row_factory
+        # journal_mode写入数据库文件后对所有连接生效，其余PRAGMA按连接设置
+        mode = conn.execute(f"PRAGMA journal_mode={self.journal_mode}").fetchone()[0]
+        if mode != self._journal_mode_active:
+            self._journal_mode_active = mode
+            if mode.lower() != self.journal_mode.lower():
+                logger.warning(f"数据库日志模式设置为 {self.journal_mode} 失败，当前为 {mode}")
+        for pragma in connection_pragmas(self.synchronous, self.cache_size_kb, self.mmap_size):
+            conn.execute(pragma)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def connection(self) -> PooledConnection:
+        """借出一个连接，空闲连接不足时新建"""
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._create()
+            reused = False
+        with self._lock:
+            self.in_use += 1
+            if reused:
+                self.reused += 1
+        return PooledConnection(conn, self)
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接：回滚未提交的事务，空闲连接超过上限时关闭"""
+        with self._lock:
+            self.in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"归还数据库连接时回滚失败，关闭该连接: {e}")
+            self._discard(conn)
+            return
+
+        if self._idle.qsize() < self.pool_size:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self.discarded += 1
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接归还时按需重新入池）"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "journal_mode": self._journal_mode_active,
+            "pool_size": self.pool_size,
+            "idle": self._idle.qsize(),
+            "in_use": self.in_use,
+            "created": self.created,
+            "reused": self.reused,
+            "discarded": self.discarded
+        }
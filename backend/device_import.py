@@ -0,0 +1,111 @@
+"""
+设备批量导入模块
+校验批量导入的设备数据：每行单独校验，格式错误的行只影响该行的结果，
+校验通过的设备由DeviceRepository.bulk_upsert在一个事务中按IP新增或更新
+"""
+
+import ipaddress
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+MAX_BULK_DEVICES = 5000  # 单次批量导入的设备数上限
+MAX_CHANNELS = 256
+
+PROTOCOLS = ("rtsp", "http", "https")
+REQUIRED_FIELDS = ("region", "store", "ip", "user", "pwd")
+STRING_FIELDS = ("region", "store", "ip", "user", "pwd", "name", "protocol")
+
+# 行的处理结果
+CREATED = "created"
+UPDATED = "updated"
+SKIPPED = "skipped"  # IP已存在且不更新已有设备
+INVALID = "error"
+
+
+def _to_int(value: Any, field: str, low: int, high: int, errors: List[str]) -> Optional[int]:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        errors.append(f"无效的{field}: {value}")
+        return None
+    if number < low or number > high:
+        errors.append(f"{field}必须在{low}-{high}之间: {value}")
+        return None
+    return number
+
+
+def validate_device(row: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    校验并规范化一行设备数据，返回 (设备字段, 错误列表)，有错误时设备字段为None
+    未填写的端口、通道数和协议使用默认值；未填写名称时为None（新增时使用默认名称，更新时保留原名称）
+    """
+    if not isinstance(row, dict):
+        return None, ["设备数据必须是对象"]
+
+    errors: List[str] = []
+    values = {
+        field: str(row[field]).strip() if row.get(field) is not None else ""
+        for field in STRING_FIELDS
+    }
+    for field in REQUIRED_FIELDS:
+        if not values[field]:
+            errors.append(f"缺少必需字段: {field}")
+
+    if values["ip"]:
+        try:
+            values["ip"] = str(ipaddress.ip_address(values["ip"]))
+        except ValueError:
+            errors.append(f"无效的IP地址: {values['ip']}")
+
+    port = row.get("port")
+    port = _to_int(port, "端口号", 1, 65535, errors) if port not in (None, "") else 554
+    chs = row.get("chs")
+    chs = _to_int(chs, "通道数", 1, MAX_CHANNELS, errors) if chs not in (None, "") else 1
+
+    protocol = (values["protocol"] or "rtsp").lower()
+    if protocol not in PROTOCOLS:
+        errors.append(f"不支持的协议: {values['protocol']}")
+
+    if errors:
+        return None, errors
+    return {
+        "region": values["region"],
+        "store": values["store"],
+        "ip": values["ip"],
+        "port": port,
+        "user": values["user"],
+        "pwd": values["pwd"],
+        "chs": chs,
+        "name": values["name"] or None,
+        "protocol": protocol
+    }, []
+
+
+def validate_devices(rows: Iterable[Dict[str, Any]]) -> Tuple[List[Tuple[int, Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    校验一批设备，返回 (通过校验的 (序号, 设备字段) 列表, 未通过校验的行结果列表)
+    同一批次中IP重复时只保留第一行，后面的行报错
+    """
+    valid: List[Tuple[int, Dict[str, Any]]] = []
+    invalid: List[Dict[str, Any]] = []
+    seen: Dict[str, int] = {}
+    for index, row in enumerate(rows):
+        values, errors = validate_device(row)
+        if values is not None and values["ip"] in seen:
+            errors = [f"IP地址与序号{seen[values['ip']]}的设备重复: {values['ip']}"]
+            values = None
+        if values is None:
+            invalid.append({
+                "index": index,
+                "status": INVALID,
+                "ip": row.get("ip") if isinstance(row, dict) else None,
+                "device_id": None,
+                "errors": errors
+            })
+            continue
+        seen[values["ip"]] = index
+        valid.append((index, values))
+    return valid, invalid
@@ -0,0 +1,175 @@
+"""
+设备在线状态探测模块
+基于asyncio的并发探测引擎：同一设备的多个探测方式错峰竞速（Happy Eyeballs），任一成功即判定在线，
+批量探测通过信号量限制并发数，全程不阻塞事件循环
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from backend.icmp_ping import ICMPPinger
+from backend.rtsp_probe import (
+    DEFAULT_RTSP_CONCURRENCY,
+    DEFAULT_RTSP_TIMEOUT,
+    channel_path,
+    probe_channels_many,
+    probe_rtsp,
+    probe_rtsp_many
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认探测参数
+DEFAULT_TIMEOUT = 3.0  # 单个探测的超时时间（秒）
+DEFAULT_STAGGER = 0.25  # 竞速时相邻探测的启动间隔（秒）
+DEFAULT_CONCURRENCY = 256  # 批量探测时同时探测的设备数上限
+
+# 默认共享的ICMP探测器，所有ping共用一个套接字
+_default_pinger = ICMPPinger()
+
+
+async def probe_port(ip: str, port: int, timeout: float = DEFAULT_TIMEOUT) -> bool:
+    """异步检查TCP端口连通性"""
+    writer = None
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+        return True
+    except (asyncio.TimeoutError, OSError) as e:
+        logger.debug(f"端口不可达 {ip}:{port}: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"检查端口 {ip}:{port} 时出错: {e}")
+        return False
+    finally:
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+async def ping_host(ip: str, timeout: float = DEFAULT_TIMEOUT, pinger: Optional[ICMPPinger] = None) -> bool:
+    """进程内ICMP回显检测设备是否可达；系统不支持非特权ICMP时视为失败，由端口探测兜底"""
+    pinger = pinger or _default_pinger
+    result = await pinger.ping(ip, timeout)
+    return bool(result)
+
+
+async def race(attempts: List[Callable[[], Awaitable[bool]]], stagger: float = DEFAULT_STAGGER) -> bool:
+    """
+    错峰竞速执行多个探测
+    按顺序启动探测，前一个在stagger秒内未出结果或已失败时启动下一个；任一返回True立即取消其余探测
+    """
+    remaining = list(attempts)
+    pending = set()
+    try:
+        while remaining or pending:
+            if remaining:
+                pending.add(asyncio.ensure_future(remaining.pop(0)()))
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=stagger if remaining else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    return True
+        return False
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def probe_device(ip: str, port: int = 554, protocol: str = 'rtsp',
+                       timeout: float = DEFAULT_TIMEOUT, stagger: float = DEFAULT_STAGGER,
+                       pinger: Optional[ICMPPinger] = None) -> bool:
+    """
+    综合检查设备在线状态
+    依次竞速ping、设备端口、HTTP(80)和HTTPS(443)，任一成功即认为在线；
+    ICMP开销最小，在线设备通常无需建立TCP连接
+    """
+    pinger = pinger or _default_pinger
+    attempts: List[Callable[[], Awaitable[bool]]] = []
+    if pinger.available:
+        attempts.append(lambda: ping_host(ip, timeout, pinger))
+
+    ports = [port or 554]
+    for extra_port in (80, 443):
+        if extra_port not in ports:
+            ports.append(extra_port)
+    attempts.extend((lambda p=p: probe_port(ip, p, timeout)) for p in ports)
+
+    try:
+        return await race(attempts, stagger)
+    except Exception as e:
+        logger.error(f"检查设备 {ip} 状态时出错: {e}")
+        return False
+
+
+class DeviceProbeEngine:
+    """批量设备探测引擎，信号量限制同时探测的设备数"""
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                 stagger: float = DEFAULT_STAGGER, rtsp_timeout: float = DEFAULT_RTSP_TIMEOUT,
+                 rtsp_concurrency: int = DEFAULT_RTSP_CONCURRENCY):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.stagger = stagger
+        self.rtsp_timeout = rtsp_timeout
+        self.rtsp_concurrency = rtsp_concurrency
+        self.pinger = ICMPPinger()
+
+    @classmethod
+    def from_config(cls, monitoring_config: Optional[Dict[str, Any]] = None) -> "DeviceProbeEngine":
+        """从后端配置的monitoring段创建引擎"""
+        monitoring_config = monitoring_config or {}
+        return cls(
+            concurrency=monitoring_config.get("probe_concurrency", DEFAULT_CONCURRENCY),
+            timeout=monitoring_config.get("probe_timeout", DEFAULT_TIMEOUT),
+            stagger=monitoring_config.get("probe_stagger", DEFAULT_STAGGER),
+            rtsp_timeout=monitoring_config.get("rtsp_timeout", DEFAULT_RTSP_TIMEOUT),
+            rtsp_concurrency=monitoring_config.get("rtsp_concurrency", DEFAULT_RTSP_CONCURRENCY)
+        )
+
+    async def probe(self, ip: str, port: int = 554, protocol: str = 'rtsp') -> bool:
+        return await probe_device(ip, port, protocol, self.timeout, self.stagger, self.pinger)
+
+    async def probe_many(self, devices: Iterable[Tuple[Hashable, str, int, str]]) -> Dict[Hashable, bool]:
+        """
+        并发探测多个设备
+        devices为(键, IP, 端口, 协议)序列，返回 键 -> 是否在线
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def probe_one(key: Hashable, ip: str, port: int, protocol: str) -> Tuple[Hashable, bool]:
+            async with semaphore:
+                return key, await self.probe(ip, port or 554, protocol or 'rtsp')
+
+        results = await asyncio.gather(*(probe_one(*device) for device in devices))
+        return dict(results)
+
+    async def probe_stream(self, ip: str, port: int = 554, username: Optional[str] = None,
+                           password: Optional[str] = None, path: str = channel_path()) -> Dict[str, Any]:
+        """RTSP OPTIONS/DESCRIBE握手，返回流状态和SDP信息（见rtsp_probe.probe_rtsp）"""
+        return await probe_rtsp(ip, port or 554, username, password, path, self.rtsp_timeout)
+
+    async def probe_streams(self, devices: Iterable[Tuple[Hashable, str, int, Optional[str], Optional[str]]],
+                            path: str = channel_path()) -> Dict[Hashable, Dict[str, Any]]:
+        """
+        并发对多个设备执行RTSP握手
+        devices为(键, IP, 端口, 用户名, 密码)序列，返回 键 -> 握手结果
+        """
+        return await probe_rtsp_many(devices, path, self.rtsp_timeout, self.rtsp_concurrency)
+
+    async def sweep_channels(self, devices: Iterable[Tuple[Hashable, str, int, Optional[str], Optional[str], List[str]]]
+                             ) -> Dict[Hashable, Dict[str, Dict[str, Any]]]:
+        """
+        并发巡检多台NVR的通道，每台设备一个RTSP控制连接依次DESCRIBE各通道路径
+        devices为(键, IP, 端口, 用户名, 密码, 通道路径列表)序列，返回 键 -> {路径: 握手结果}
+        """
+        return await probe_channels_many(devices, self.rtsp_timeout, self.rtsp_concurrency)
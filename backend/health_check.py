@@ -1,48 +1,31 @@
 #!/usr/bin/env python3
 """
 自定义端口健康检查脚本
-支持端口映射后的设备状态检测
+支持端口映射后的设备状态检测：并发对所有设备执行RTSP OPTIONS/DESCRIBE握手，
+区分流可用、认证失败、通道不存在和不可达，不再为每台设备启动ffmpeg解码
 """
 
 import sqlite3
-import socket
 import os
 import sys
-import subprocess
+import asyncio
+from collections import Counter
 from datetime import datetime
 
-DB_PATH = "./data/devices.db"
+# 添加项目根目录到Python路径（backend包位于项目根目录下）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-def test_port_with_timeout(ip, port, timeout=3):
-    """测试端口连通性"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return result == 0
-    except Exception:
-        return False
+from backend.rtsp_probe import HEALTHY, channel_path, probe_rtsp, probe_rtsp_many
+from backend.status_writer import write_statuses
+
+DB_PATH = "./data/devices.db"
 
 def test_rtsp_connection(ip, port, username, password):
-    """测试RTSP连接"""
+    """测试RTSP连接（DESCRIBE成功且有视频轨）"""
     try:
-        rtsp_url = f"rtsp://{username}:{password}@{ip}:{port}/Streaming/Channels/101"
-        
-        # 使用ffmpeg测试RTSP连接
-        cmd = [
-            "ffmpeg",
-            "-rtsp_transport", "tcp",
-            "-i", rtsp_url,
-            "-vframes", "1",
-            "-f", "null",
-            "-",
-            "-t", "3"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=8)
-        return result.returncode == 0
-    except:
+        result = asyncio.run(probe_rtsp(ip, port, username, password, channel_path()))
+        return result["status"] == HEALTHY
+    except Exception:
         return False
 
 def update_device_health_status():
@@ -52,18 +35,19 @@ def update_device_health_status():
         cursor = conn.cursor()
         cursor.execute("SELECT id, ip, port, user, pwd FROM devices")
         devices = cursor.fetchall()
-        
-        for device_id, ip, port, username, password in devices:
-            # 测试端口和RTSP连接
-            port_ok = test_port_with_timeout(ip, port)
-            rtsp_ok = test_rtsp_connection(ip, port, username, password)
-            
-            # 更新状态
-            new_status = "online" if (port_ok and rtsp_ok) else "offline"
-            cursor.execute("UPDATE devices SET status=? WHERE id=?", (new_status, device_id))
-        
-        conn.commit()
+
+        # 所有设备并发握手
+        results = asyncio.run(probe_rtsp_many(devices))
+
+        checked_at = datetime.now().isoformat()
+        write_statuses(conn, {device_id: (result["healthy"], checked_at) for device_id, result in results.items()})
         conn.close()
+
+        for device_id, result in results.items():
+            if not result["healthy"]:
+                print(f"设备 {device_id} {result['url']}: {result['status']} {result['error'] or ''}")
+        summary = Counter(result["status"] for result in results.values())
+        print(f"健康检查完成: {len(results)} 台设备, " + ", ".join(f"{status} {count}" for status, count in summary.items()))
         return True
     except Exception as e:
         print(f"健康检查失败: {e}")
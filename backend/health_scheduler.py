@@ -0,0 +1,496 @@
+"""
+后台设备健康检查调度模块
+在FastAPI生命周期内运行，为每台设备维护下次检查时间的优先队列：
+检查时间在整个周期内均匀错开并加入随机抖动，离线设备按退避间隔更频繁地复查，
+避免每个周期所有设备同时检查带来的瞬时负载；检查结果进入写回缓冲区，按写回间隔合并为一个事务写入数据库。
+存活探测之外按分级健康检查（backend/health_tiers.py）对在线设备定期巡检所有通道（RTSP握手，结果写入通道表），
+并轮转抽样少量通道解码关键帧
+"""
+
+import asyncio
+import heapq
+import logging
+import random
+import time
+import traceback
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from backend.channels import DEFAULT_STREAM_TYPES, prune_channels, record_channel_results, sweep_devices
+from backend.device_probe import DeviceProbeEngine
+from backend.health_tiers import (
+    DECODE_UNAVAILABLE,
+    DEFAULT_DECODE_CONCURRENCY,
+    DEFAULT_DECODE_INTERVAL,
+    DEFAULT_DECODE_SAMPLE_SIZE,
+    DEFAULT_DECODE_TIMEOUT,
+    DEFAULT_FFMPEG_PATH,
+    DEFAULT_HANDSHAKE_INTERVAL,
+    TIER_DECODE,
+    TIER_HANDSHAKE,
+    ChannelKey,
+    TierResult,
+    decode_keyframe,
+    next_sample,
+    prune_tier_results,
+    record_tier_results,
+    stream_url
+)
+from backend.rtsp_probe import HEALTHY
+from backend.status_history import DEFAULT_HOUR_RETENTION_DAYS, DEFAULT_MINUTE_RETENTION_DAYS, prune_history
+from backend.status_writer import StatusWriteBuffer
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认调度参数
+DEFAULT_CHECK_INTERVAL = 600.0  # 在线设备检查间隔（秒）
+DEFAULT_OFFLINE_INTERVAL = 30.0  # 离线设备首次复查间隔（秒），之后按2倍退避直至检查间隔
+DEFAULT_JITTER = 0.1  # 检查间隔的随机抖动比例
+DEFAULT_REFRESH_INTERVAL = 60.0  # 从数据库同步设备列表的间隔（秒）
+DEFAULT_FLUSH_INTERVAL = 2.0  # 检查结果写回数据库的间隔（秒）
+PRUNE_INTERVAL = 3600.0  # 清理过期状态汇总的间隔（秒）
+
+
+class HealthScheduler:
+    """设备健康检查调度器"""
+
+    def __init__(self, probe_engine: DeviceProbeEngine, get_connection: Callable,
+                 interval: float = DEFAULT_CHECK_INTERVAL, offline_interval: float = DEFAULT_OFFLINE_INTERVAL,
+                 jitter: float = DEFAULT_JITTER, refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, status_buffer: Optional[StatusWriteBuffer] = None,
+                 minute_retention_days: int = DEFAULT_MINUTE_RETENTION_DAYS,
+                 hour_retention_days: int = DEFAULT_HOUR_RETENTION_DAYS,
+                 handshake_interval: float = DEFAULT_HANDSHAKE_INTERVAL, decode_interval: float = DEFAULT_DECODE_INTERVAL,
+                 decode_sample_size: int = DEFAULT_DECODE_SAMPLE_SIZE,
+                 decode_concurrency: int = DEFAULT_DECODE_CONCURRENCY, decode_timeout: float = DEFAULT_DECODE_TIMEOUT,
+                 ffmpeg_path: str = DEFAULT_FFMPEG_PATH, channel_stream_types=DEFAULT_STREAM_TYPES):
+        self.probe_engine = probe_engine
+        self.get_connection = get_connection
+        self.status_buffer = status_buffer or StatusWriteBuffer(get_connection)
+        self.flush_interval = flush_interval
+        self.minute_retention_days = minute_retention_days
+        self.hour_retention_days = hour_retention_days
+        self.interval = interval
+        self.offline_interval = offline_interval
+        self.jitter = jitter
+        self.refresh_interval = refresh_interval
+        # 分级健康检查，间隔为0时关闭对应级别
+        self.handshake_interval = handshake_interval
+        self.decode_interval = decode_interval
+        self.decode_sample_size = decode_sample_size
+        self.decode_concurrency = decode_concurrency
+        self.decode_timeout = decode_timeout
+        self.ffmpeg_path = ffmpeg_path
+        self.channel_stream_types = tuple(channel_stream_types)
+
+        self._queue: List[Tuple[float, int]] = []  # (下次检查时间, 设备ID) 小顶堆
+        self._devices: Dict[int, Dict[str, Any]] = {}  # 设备ID -> 设备信息和调度状态
+        self._in_flight: Set[int] = set()  # 正在做存活探测的设备
+        self._handshaking: Set[int] = set()  # 正在做通道巡检的设备
+        self._batches: Set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._next_refresh = 0.0
+        self._next_flush = 0.0
+        self._next_prune = 0.0
+        self._next_decode = time.time() + decode_interval
+        self._decode_cursor: Optional[ChannelKey] = None
+
+        # 统计信息
+        self.checks_total = 0
+        self.started_at: Optional[float] = None
+        self.last_lag = 0.0  # 最近一批检查相对计划时间的延迟（秒）
+        self.handshakes_total = 0
+        self.handshake_failures = 0
+        self.decodes_total = 0
+        self.decode_failures = 0
+
+    @classmethod
+    def from_config(cls, probe_engine: DeviceProbeEngine, get_connection: Callable,
+                    monitoring_config: Optional[Dict[str, Any]] = None,
+                    status_buffer: Optional[StatusWriteBuffer] = None) -> "HealthScheduler":
+        """从后端配置的monitoring段创建调度器"""
+        monitoring_config = monitoring_config or {}
+        return cls(
+            probe_engine,
+            get_connection,
+            interval=monitoring_config.get("device_check_interval", DEFAULT_CHECK_INTERVAL),
+            offline_interval=monitoring_config.get("offline_check_interval", DEFAULT_OFFLINE_INTERVAL),
+            jitter=monitoring_config.get("check_jitter", DEFAULT_JITTER),
+            refresh_interval=monitoring_config.get("device_refresh_interval", DEFAULT_REFRESH_INTERVAL),
+            flush_interval=monitoring_config.get("status_flush_interval", DEFAULT_FLUSH_INTERVAL),
+            status_buffer=status_buffer,
+            minute_retention_days=monitoring_config.get("history_minute_retention_days", DEFAULT_MINUTE_RETENTION_DAYS),
+            hour_retention_days=monitoring_config.get("history_hour_retention_days", DEFAULT_HOUR_RETENTION_DAYS),
+            handshake_interval=monitoring_config.get("handshake_interval", DEFAULT_HANDSHAKE_INTERVAL),
+            decode_interval=monitoring_config.get("decode_interval", DEFAULT_DECODE_INTERVAL),
+            decode_sample_size=monitoring_config.get("decode_sample_size", DEFAULT_DECODE_SAMPLE_SIZE),
+            decode_concurrency=monitoring_config.get("decode_concurrency", DEFAULT_DECODE_CONCURRENCY),
+            decode_timeout=monitoring_config.get("decode_timeout", DEFAULT_DECODE_TIMEOUT),
+            ffmpeg_path=monitoring_config.get("ffmpeg_path", DEFAULT_FFMPEG_PATH),
+            channel_stream_types=monitoring_config.get("channel_stream_types", DEFAULT_STREAM_TYPES)
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        """启动调度循环"""
+        if self.running:
+            return
+        self._wake = asyncio.Event()
+        self.started_at = time.time()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"设备健康检查调度器已启动，检查间隔: {self.interval}秒，离线复查间隔: {self.offline_interval}秒")
+
+    async def stop(self):
+        """停止调度循环并等待进行中的检查结束，写回缓冲区中剩余的结果"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        for batch in list(self._batches):
+            batch.cancel()
+        await asyncio.gather(self._task, *self._batches, return_exceptions=True)
+        self._task = None
+        await self.flush()
+        logger.info("设备健康检查调度器已停止")
+
+    def _load_devices(self) -> List[Tuple]:
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, ip, port, protocol, status, user, pwd, chs FROM devices")
+            return [tuple(row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    async def refresh(self):
+        """同步设备列表：新设备在一个检查周期内均匀错开排队，已删除的设备移出调度"""
+        rows = await asyncio.to_thread(self._load_devices)
+        now = time.time()
+        current_ids = set()
+        new_ids = []
+
+        for device_id, ip, port, protocol, status, user, pwd, chs in rows:
+            current_ids.add(device_id)
+            device = self._devices.get(device_id)
+            if device is None:
+                self._devices[device_id] = {
+                    "ip": ip,
+                    "port": port or 554,
+                    "protocol": protocol or 'rtsp',
+                    "status": status,
+                    "user": user,
+                    "pwd": pwd,
+                    "chs": chs or 1,
+                    "failures": 0,
+                    "next_check": None,
+                    "next_handshake": 0.0  # 首次存活探测在线后立即握手（存活探测已在周期内错开）
+                }
+                new_ids.append(device_id)
+            else:
+                device.update(ip=ip, port=port or 554, protocol=protocol or 'rtsp', user=user, pwd=pwd, chs=chs or 1)
+
+        for device_id in set(self._devices) - current_ids:
+            del self._devices[device_id]  # 队列中的旧条目在出队时跳过
+
+        # 首次加载时把所有设备均匀分布到整个周期内，避免同时检查
+        spread = self.interval if self.checks_total == 0 else min(self.interval, self.refresh_interval)
+        for index, device_id in enumerate(new_ids):
+            offset = spread * (index + random.random()) / len(new_ids)
+            self._schedule(device_id, now + offset)
+
+        if new_ids:
+            logger.info(f"健康检查调度器新增 {len(new_ids)} 台设备，当前共 {len(self._devices)} 台")
+        self._next_refresh = now + self.refresh_interval
+
+    def _schedule(self, device_id: int, at: float):
+        device = self._devices.get(device_id)
+        if device is None:
+            return
+        device["next_check"] = at
+        heapq.heappush(self._queue, (at, device_id))
+        if self._wake is not None:
+            self._wake.set()
+
+    def _next_delay(self, device: Dict[str, Any]) -> float:
+        """在线设备按检查间隔复查；离线设备从离线复查间隔开始按2倍退避，不超过检查间隔"""
+        if device["status"] == "online":
+            base = self.interval
+        else:
+            base = min(self.offline_interval * (2 ** max(device["failures"] - 1, 0)), self.interval)
+        return base * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _pop_due(self, now: float) -> List[int]:
+        """
+        取出所有到期的设备，跳过已删除或已重新排队的旧条目
+        正在检查的设备的条目也直接丢弃：所在批次在结束检查（移出_in_flight）前会为其重新排队
+        """
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            at, device_id = heapq.heappop(self._queue)
+            device = self._devices.get(device_id)
+            if device is None or device["next_check"] != at or device_id in self._in_flight:
+                continue
+            self.last_lag = now - at
+            due.append(device_id)
+        return due
+
+    async def _run(self):
+        while True:
+            try:
+                now = time.time()
+                if now >= self._next_refresh:
+                    await self.refresh()
+                if now >= self._next_prune:
+                    await self.prune()
+
+                due = self._pop_due(time.time())
+                if due:
+                    self._in_flight.update(due)
+                    self._spawn(self._check_batch(due))
+
+                if self.decode_interval > 0 and time.time() >= self._next_decode:
+                    self._next_decode = time.time() + self.decode_interval
+                    self._spawn(self.sample_decode())
+
+                if len(self.status_buffer) and time.time() >= self._next_flush:
+                    await self.flush()
+
+                # 等待到下一个到期时间、下一次写回或下一次同步设备列表
+                next_due = self._queue[0][0] if self._queue else self._next_refresh
+                wake_at = min(next_due, self._next_refresh)
+                if self.decode_interval > 0:
+                    wake_at = min(wake_at, self._next_decode)
+                if len(self.status_buffer):
+                    wake_at = min(wake_at, self._next_flush)
+                wait = max(0.0, wake_at - time.time())
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"健康检查调度出错: {e}")
+                logger.debug(f"详细错误信息: {traceback.format_exc()}")
+                await asyncio.sleep(1.0)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """启动后台检查任务，停止调度器时统一取消"""
+        task = asyncio.create_task(coro)
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+        return task
+
+    async def _check_batch(self, device_ids: List[int]):
+        """
+        并发检查一批到期设备，结果放入写回缓冲区后重新排队
+        到期的通道巡检另起任务执行：大型NVR的巡检可能比离线复查间隔更长，不能占着这批设备的检查名额
+        """
+        try:
+            devices = [
+                (device_id, self._devices[device_id]["ip"], self._devices[device_id]["port"],
+                 self._devices[device_id]["protocol"])
+                for device_id in device_ids if device_id in self._devices
+            ]
+            results = await self.probe_engine.probe_many(devices)
+            self.status_buffer.add_many(results)
+
+            for device_id, is_online in results.items():
+                self.record_result(device_id, is_online)
+            if self._wake is not None:
+                self._wake.set()
+
+            # 在线且到期的RTSP设备接着做握手检查，上一次巡检还没结束的设备跳过
+            now = time.time()
+            due_handshake = [
+                device_id for device_id, is_online in results.items()
+                if is_online and device_id in self._devices and self._devices[device_id]["protocol"] == 'rtsp'
+                and self._devices[device_id]["next_handshake"] <= now and device_id not in self._handshaking
+            ]
+            if self.handshake_interval > 0 and due_handshake:
+                self._handshaking.update(due_handshake)
+                self._spawn(self.handshake(due_handshake))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"批量健康检查失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+            # 检查失败时按离线复查间隔重试
+            for device_id in device_ids:
+                self._schedule(device_id, time.time() + self.offline_interval)
+        finally:
+            self._in_flight.difference_update(device_ids)
+
+    def _store_tier(self, tier: str, results: List[TierResult]):
+        conn = self.get_connection()
+        try:
+            record_tier_results(conn, tier, results)
+        finally:
+            conn.close()
+
+    def _store_channels(self, sweeps):
+        conn = self.get_connection()
+        try:
+            record_channel_results(conn, sweeps)
+        finally:
+            conn.close()
+
+    async def handshake(self, device_ids: List[int]):
+        """通道巡检：每台设备一个RTSP控制连接依次DESCRIBE所有通道，结果写入通道表"""
+        try:
+            sweeps = await sweep_devices(
+                self.probe_engine,
+                [
+                    (device_id, device["ip"], device["port"], device["user"], device["pwd"], device["chs"])
+                    for device_id, device in ((device_id, self._devices.get(device_id)) for device_id in device_ids)
+                    if device is not None
+                ],
+                self.channel_stream_types
+            )
+
+            now = time.time()
+            for device_id, (_, results) in sweeps.items():
+                failed = sorted(key for key, result in results.items() if not result["healthy"])
+                self.handshakes_total += len(results)
+                self.handshake_failures += len(failed)
+                device = self._devices.get(device_id)
+                if device is None:
+                    continue
+                if failed:
+                    reasons = {results[key]["status"] for key in failed}
+                    logger.warning(
+                        f"设备 {device['ip']} {len(failed)}/{len(results)} 个通道异常（{', '.join(sorted(reasons))}）: "
+                        + ", ".join(f"{channel}-{stream_type}" for channel, stream_type in failed[:16])
+                    )
+                device["next_handshake"] = now + self.handshake_interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            await asyncio.to_thread(self._store_channels, sweeps)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"通道巡检失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+        finally:
+            self._handshaking.difference_update(device_ids)
+
+    async def sample_decode(self):
+        """从在线RTSP设备的所有通道中轮转抽样少量通道解码一个关键帧，结果按解码级别保存"""
+        try:
+            channels = [
+                (device_id, channel)
+                for device_id, device in self._devices.items()
+                if device["status"] == "online" and device["protocol"] == 'rtsp'
+                for channel in range(1, device["chs"] + 1)
+            ]
+            sample = next_sample(channels, self._decode_cursor, self.decode_sample_size)
+            if not sample:
+                return
+            self._decode_cursor = sample[-1]
+            semaphore = asyncio.Semaphore(self.decode_concurrency)
+
+            async def decode_one(device_id: int, channel: int) -> TierResult:
+                device = self._devices[device_id]
+                url = stream_url(device["ip"], device["port"], device["user"], device["pwd"], channel)
+                async with semaphore:
+                    status, detail = await decode_keyframe(url, self.decode_timeout, self.ffmpeg_path)
+                return device_id, channel, status, detail
+
+            rows = await asyncio.gather(*(decode_one(*key) for key in sample if key[0] in self._devices))
+            if any(status == DECODE_UNAVAILABLE for _, _, status, _ in rows):
+                logger.warning(f"未找到ffmpeg（{self.ffmpeg_path}），关闭抽样解码检查")
+                self.decode_interval = 0
+                return
+
+            for device_id, channel, status, detail in rows:
+                self.decodes_total += 1
+                if status != HEALTHY:
+                    self.decode_failures += 1
+                    logger.warning(f"设备 {device_id} 通道{channel} 解码检查失败: {status} {detail.get('error', '')}")
+            await asyncio.to_thread(self._store_tier, TIER_DECODE, list(rows))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"抽样解码检查失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+
+    async def flush(self):
+        """把缓冲区内的检查结果在一个事务中写回数据库"""
+        self._next_flush = time.time() + self.flush_interval
+        try:
+            changes = await asyncio.to_thread(self.status_buffer.flush)
+            if changes:
+                logger.info(f"写回设备状态，{len(changes)} 台设备状态变化")
+        except Exception as e:
+            logger.error(f"写回设备状态失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+
+    def _prune_history(self) -> int:
+        conn = self.get_connection()
+        try:
+            return (prune_history(conn, self.minute_retention_days, self.hour_retention_days)
+                    + prune_tier_results(conn) + prune_channels(conn))
+        finally:
+            conn.close()
+
+    async def prune(self):
+        """清理超过保留期的分钟和小时状态汇总"""
+        self._next_prune = time.time() + PRUNE_INTERVAL
+        try:
+            deleted = await asyncio.to_thread(self._prune_history)
+            if deleted:
+                logger.info(f"清理过期设备状态汇总 {deleted} 条")
+        except Exception as e:
+            logger.error(f"清理设备状态汇总失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+
+    def record_result(self, device_id: int, is_online: bool):
+        """记录检查结果并安排下次检查（手动检查的结果也通过这里重新排队）"""
+        device = self._devices.get(device_id)
+        if device is None:
+            return
+        previous = device["status"]
+        device["status"] = "online" if is_online else "offline"
+        device["failures"] = 0 if is_online else device["failures"] + 1
+        self.checks_total += 1
+        if previous != device["status"]:
+            logger.info(f"设备 {device['ip']} 状态变化: {previous} -> {device['status']}")
+        self._schedule(device_id, time.time() + self._next_delay(device))
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        scheduled = [device for device in self._devices.values() if device["next_check"] is not None]
+        return {
+            "running": self.running,
+            "devices": len(self._devices),
+            "queue_depth": len(scheduled),
+            "due_now": sum(1 for device in scheduled if device["next_check"] <= now),
+            "in_flight": len(self._in_flight),
+            "handshaking": len(self._handshaking),
+            "online_devices": sum(1 for device in self._devices.values() if device["status"] == "online"),
+            "offline_devices": sum(1 for device in self._devices.values() if device["status"] != "online"),
+            "next_check_in": max(0.0, min(device["next_check"] for device in scheduled) - now) if scheduled else None,
+            "last_lag": self.last_lag,
+            "checks_total": self.checks_total,
+            "interval": self.interval,
+            "offline_interval": self.offline_interval,
+            "status_writes": self.status_buffer.stats(),
+            "tiers": {
+                "handshake": {
+                    "interval": self.handshake_interval,
+                    "stream_types": list(self.channel_stream_types),
+                    "checks_total": self.handshakes_total,
+                    "failures": self.handshake_failures
+                },
+                "decode": {
+                    "interval": self.decode_interval,
+                    "sample_size": self.decode_sample_size,
+                    "checks_total": self.decodes_total,
+                    "failures": self.decode_failures,
+                    "cursor": list(self._decode_cursor) if self._decode_cursor else None
+                }
+            },
+            "uptime": now - self.started_at if self.started_at else 0
+        }
@@ -0,0 +1,242 @@
+"""
+分级健康检查模块
+健康检查分为三级，开销逐级增加、频率逐级降低：
+- liveness：ICMP/TCP存活探测，每个检查周期执行，结果即devices.status
+- handshake：RTSP DESCRIBE通道巡检，在线设备按较长间隔执行，结果保存在channels表（backend/channels.py）
+- decode：拉流解码一个关键帧，每轮只抽样少量通道，按 (设备ID, 通道) 轮转，长期覆盖所有通道
+decode级别保留每个通道最近一次的结果，查询时与设备表关联
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+
+from backend.channels import channel_detail, query_channels
+from backend.rtsp_probe import HEALTHY, PROTOCOL_ERROR, UNREACHABLE, channel_path
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 检查级别
+TIER_LIVENESS = "liveness"
+TIER_HANDSHAKE = "handshake"
+TIER_DECODE = "decode"
+TIERS = (TIER_LIVENESS, TIER_HANDSHAKE, TIER_DECODE)
+
+# 默认参数
+DEFAULT_HANDSHAKE_INTERVAL = 1800.0  # 在线设备RTSP握手间隔（秒）
+DEFAULT_DECODE_INTERVAL = 300.0  # 抽样解码的间隔（秒）
+DEFAULT_DECODE_SAMPLE_SIZE = 4  # 每轮抽样解码的通道数
+DEFAULT_DECODE_CONCURRENCY = 2  # 同时运行的解码进程数
+DEFAULT_DECODE_TIMEOUT = 15.0  # 单个通道解码的超时时间（秒）
+DEFAULT_FFMPEG_PATH = "ffmpeg"
+
+DECODE_UNAVAILABLE = "unavailable"  # 系统中没有ffmpeg
+
+# 抽样解码的通道：(设备ID, 通道号)
+ChannelKey = Tuple[int, int]
+# 一条分级检查结果：(设备ID, 通道号, 状态, 详情)
+TierResult = Tuple[int, int, str, Optional[Dict[str, Any]]]
+
+_schema_ready = False
+
+
+def ensure_tier_schema(conn):
+    """创建分级检查结果表（每个设备、级别、通道保留最近一次结果，目前只有decode级别使用）"""
+    global _schema_ready
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_health_checks (
+            device_id INTEGER NOT NULL,
+            tier TEXT NOT NULL,
+            channel INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL,
+            detail TEXT,
+            checked_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (device_id, tier, channel)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_device_health_checks_status ON device_health_checks (tier, status)")
+    _schema_ready = True
+
+
+def record_tier_results(conn, tier: str, results: List[TierResult], checked_at: Optional[str] = None):
+    """在一个事务中写入一批分级检查结果（覆盖同一通道的上一次结果）"""
+    if not results:
+        return
+    if not _schema_ready:
+        ensure_tier_schema(conn)
+    checked_at = checked_at or datetime.now().isoformat()
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            '''
+            INSERT INTO device_health_checks (device_id, tier, channel, status, detail, checked_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, tier, channel) DO UPDATE SET
+                status = excluded.status, detail = excluded.detail, checked_at = excluded.checked_at
+            ''',
+            [
+                (device_id, tier, channel, status,
+                 json.dumps(detail, ensure_ascii=False) if detail is not None else None, checked_at)
+                for device_id, channel, status, detail in results
+            ]
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def prune_tier_results(conn) -> int:
+    """删除已删除设备的分级检查结果（以及改由channels表保存之前的握手结果）"""
+    if not _schema_ready:
+        ensure_tier_schema(conn)
+    cursor = conn.cursor()
+    cursor.execute(
+        "DELETE FROM device_health_checks WHERE device_id NOT IN (SELECT id FROM devices) OR tier = ?",
+        (TIER_HANDSHAKE,)
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def query_tier_results(conn, device_id: Optional[int] = None, tier: Optional[str] = None,
+                       status: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+    """
+    查询分级检查结果，可按设备、级别、状态筛选
+    liveness级别取设备表的状态和检查时间，handshake级别取通道表的探测结果
+    """
+    items: List[Dict[str, Any]] = []
+    cursor = conn.cursor()
+
+    if tier in (None, TIER_LIVENESS):
+        sql = "SELECT id, status, last_check, last_seen FROM devices"
+        conditions, params = [], []
+        if device_id is not None:
+            conditions.append("id = ?")
+            params.append(device_id)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        cursor.execute(sql + " ORDER BY id LIMIT ?", (*params, limit))
+        for row_id, row_status, last_check, last_seen in cursor.fetchall():
+            items.append({
+                "device_id": row_id,
+                "tier": TIER_LIVENESS,
+                "channel": None,
+                "status": row_status,
+                "detail": {"last_seen": last_seen},
+                "checked_at": last_check
+            })
+
+    if tier in (None, TIER_HANDSHAKE):
+        try:
+            channels = query_channels(conn, device_id=device_id, probe_status=status, limit=limit)
+        except Exception as e:
+            # 通道表尚未创建（还没有执行过通道巡检）
+            logger.debug(f"查询通道状态失败: {e}")
+            channels = []
+        for item in channels:
+            items.append({
+                "device_id": item["device_id"],
+                "tier": TIER_HANDSHAKE,
+                "channel": item["channel"],
+                "status": item["probe_status"],
+                "detail": channel_detail(item),
+                "checked_at": item["last_check"]
+            })
+
+    if tier in (None, TIER_DECODE):
+        sql = "SELECT device_id, tier, channel, status, detail, checked_at FROM device_health_checks"
+        conditions, params = ["device_id IN (SELECT id FROM devices)", "tier = ?"], [TIER_DECODE]
+        for column, value in (("device_id", device_id), ("status", status)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        sql += " WHERE " + " AND ".join(conditions) + " ORDER BY device_id, tier, channel LIMIT ?"
+        try:
+            cursor.execute(sql, (*params, limit))
+        except Exception as e:
+            # 结果表尚未创建（调度器还没有执行过握手或解码）
+            logger.debug(f"查询分级检查结果失败: {e}")
+            return items
+        for row_device_id, row_tier, channel, row_status, detail, checked_at in cursor.fetchall():
+            items.append({
+                "device_id": row_device_id,
+                "tier": row_tier,
+                "channel": channel,
+                "status": row_status,
+                "detail": json.loads(detail) if detail else None,
+                "checked_at": checked_at
+            })
+    return items
+
+
+def stream_url(ip: str, port: int, username: Optional[str], password: Optional[str], channel: int,
+               stream_type: str = "main") -> str:
+    """带认证信息的通道拉流地址"""
+    credentials = f"{quote(username or '', safe='')}:{quote(password or '', safe='')}@" if username else ""
+    return f"rtsp://{credentials}{ip}:{port or 554}{channel_path(channel, stream_type)}"
+
+
+async def decode_keyframe(url: str, timeout: float = DEFAULT_DECODE_TIMEOUT,
+                          ffmpeg_path: str = DEFAULT_FFMPEG_PATH) -> Tuple[str, Dict[str, Any]]:
+    """
+    拉流并只解码第一个关键帧（-skip_frame nokey），返回 (状态, 详情)
+    成功为healthy；超时或解码失败为error；系统中没有ffmpeg时为unavailable
+    """
+    started = time.monotonic()
+    cmd = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error", "-nostdin",
+        "-rtsp_transport", "tcp",
+        "-skip_frame", "nokey",
+        "-i", url,
+        "-an", "-frames:v", "1",
+        "-f", "null", "-"
+    ]
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+    except FileNotFoundError:
+        return DECODE_UNAVAILABLE, {"error": f"未找到ffmpeg: {ffmpeg_path}"}
+
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return PROTOCOL_ERROR, {"error": "解码超时", "latency_ms": round(timeout * 1000, 1)}
+    except asyncio.CancelledError:
+        process.kill()
+        await process.wait()
+        raise
+
+    detail: Dict[str, Any] = {"latency_ms": round((time.monotonic() - started) * 1000, 1)}
+    if process.returncode == 0:
+        return HEALTHY, detail
+    message = stderr.decode("utf-8", "replace").strip().splitlines()
+    detail["error"] = message[-1][:200] if message else f"ffmpeg退出码 {process.returncode}"
+    status = UNREACHABLE if any(word in detail["error"] for word in ("Connection refused", "No route")) else PROTOCOL_ERROR
+    return status, detail
+
+
+def next_sample(channels: Iterable[ChannelKey], after: Optional[ChannelKey], size: int) -> List[ChannelKey]:
+    """
+    从 (设备ID, 通道号) 排序后的列表中取after之后的size个通道，不足时从头轮转
+    以上次抽样的最后一个通道作为游标，设备增删不影响轮转顺序
+    """
+    ordered = sorted(set(channels))
+    if not ordered or size <= 0:
+        return []
+    start = 0
+    if after is not None:
+        start = next((index for index, key in enumerate(ordered) if key > after), 0)
+    return [ordered[(start + offset) % len(ordered)] for offset in range(min(size, len(ordered)))]
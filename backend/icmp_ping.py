@@ -0,0 +1,241 @@
+"""
+进程内ICMP回显探测模块
+使用单个非特权ICMP套接字（Linux的SOCK_DGRAM ICMP，需net.ipv4.ping_group_range包含当前用户组）
+批量向大量主机发送回显请求，按序号和源地址匹配回复，不再为每台设备启动ping子进程；
+当前系统不支持非特权ICMP套接字时返回None，由调用方退回TCP端口探测
+"""
+
+import asyncio
+import logging
+import os
+import select
+import socket
+import struct
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+PAYLOAD = b"monitor-heartbeat"
+MAX_IN_FLIGHT = 8192  # 同时等待回复的请求数上限（序号空间为65536）
+
+_icmp_available: Optional[bool] = None  # 首次创建套接字后缓存结果
+
+
+def _checksum(data: bytes) -> int:
+    """ICMP校验和（Linux的ping套接字会由内核重新计算，其他系统需要自行填写）"""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(ident: int, seq: int) -> bytes:
+    """构造ICMP回显请求报文"""
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    checksum = _checksum(header + PAYLOAD)
+    return struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, ident, seq) + PAYLOAD
+
+
+def parse_echo_reply(data: bytes) -> Optional[int]:
+    """解析ICMP回显回复，返回序号；非回显回复返回None"""
+    # Linux的SOCK_DGRAM只返回ICMP报文，部分系统会带上IP头
+    if len(data) >= 20 and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0f) * 4:]
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, _, seq = struct.unpack("!BBHHH", data[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return seq
+
+
+def open_icmp_socket() -> Optional[socket.socket]:
+    """创建非阻塞的非特权ICMP套接字，不支持时返回None"""
+    global _icmp_available
+    if _icmp_available is False:
+        return None
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        _icmp_available = True
+        return sock
+    except (OSError, AttributeError) as e:
+        _icmp_available = False
+        logger.warning(f"当前系统不支持非特权ICMP套接字，ping检测将退回TCP端口探测: {e}")
+        return None
+
+
+def _send_echo(sock: socket.socket, ip: str, ident: int, seq: int) -> bool:
+    """发送一个回显请求，发送缓冲区满时短暂等待后重试；目标不可达时返回False"""
+    packet = build_echo_request(ident, seq)
+    while True:
+        try:
+            sock.sendto(packet, (ip, 0))
+            return True
+        except BlockingIOError:
+            select.select([], [sock], [], 0.01)
+        except OSError as e:
+            logger.debug(f"发送ICMP请求失败 {ip}: {e}")
+            return False
+
+
+def _chunks(ips: List[str], size: int) -> Iterable[List[str]]:
+    for index in range(0, len(ips), size):
+        yield ips[index:index + size]
+
+
+def ping_hosts(ips: Iterable[str], timeout: float = 3.0) -> Optional[Dict[str, bool]]:
+    """
+    同步批量ping：所有请求从同一个套接字发出，统一等待回复
+    返回 IP -> 是否可达；不支持非特权ICMP套接字时返回None
+    """
+    sock = open_icmp_socket()
+    if sock is None:
+        return None
+
+    ident = os.getpid() & 0xffff
+    results = {ip: False for ip in ips}
+    try:
+        for chunk in _chunks(list(results), MAX_IN_FLIGHT):
+            waiting: Dict[int, str] = {}
+            for seq, ip in enumerate(chunk):
+                if _send_echo(sock, ip, ident, seq):
+                    waiting[seq] = ip
+
+            deadline = time.monotonic() + timeout
+            while waiting:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+                while True:
+                    try:
+                        data, address = sock.recvfrom(1024)
+                    except BlockingIOError:
+                        break
+                    seq = parse_echo_reply(data)
+                    if seq is not None and waiting.get(seq) == address[0]:
+                        results[waiting.pop(seq)] = True
+        return results
+    finally:
+        sock.close()
+
+
+class ICMPPinger:
+    """
+    异步ICMP回显探测器
+    所有ping共用一个套接字，由事件循环的读回调接收回复并按序号唤醒等待者
+    """
+
+    def __init__(self):
+        self.sock: Optional[socket.socket] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ident = os.getpid() & 0xffff
+        self._next_seq = 0
+        self._waiters: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def available(self) -> bool:
+        return _icmp_available is not False
+
+    def _ensure_socket(self) -> bool:
+        """在当前事件循环中打开套接字并注册读回调"""
+        loop = asyncio.get_running_loop()
+        if self.sock is not None and self._loop is loop:
+            return True
+        self.close()
+
+        sock = open_icmp_socket()
+        if sock is None:
+            return False
+        try:
+            loop.add_reader(sock.fileno(), self._on_readable)
+        except NotImplementedError:
+            # Windows的Proactor事件循环不支持add_reader
+            sock.close()
+            logger.warning("当前事件循环不支持套接字读回调，ping检测将退回TCP端口探测")
+            return False
+
+        self.sock = sock
+        self._loop = loop
+        self._slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+        return True
+
+    def _allocate_seq(self) -> int:
+        while self._next_seq in self._waiters:
+            self._next_seq = (self._next_seq + 1) & 0xffff
+        seq = self._next_seq
+        self._next_seq = (seq + 1) & 0xffff
+        return seq
+
+    def _on_readable(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.debug(f"接收ICMP回复失败: {e}")
+                return
+            seq = parse_echo_reply(data)
+            waiter = self._waiters.get(seq) if seq is not None else None
+            if waiter is not None and waiter[0] == address[0] and not waiter[1].done():
+                waiter[1].set_result(True)
+
+    async def ping(self, ip: str, timeout: float = 3.0) -> Optional[bool]:
+        """发送一次回显请求并等待回复；不支持ICMP时返回None"""
+        if not self._ensure_socket():
+            return None
+
+        async with self._slots:
+            seq = self._allocate_seq()
+            future = self._loop.create_future()
+            self._waiters[seq] = (ip, future)
+            try:
+                while True:
+                    try:
+                        self.sock.sendto(build_echo_request(self._ident, seq), (ip, 0))
+                        break
+                    except BlockingIOError:
+                        await asyncio.sleep(0.01)
+                return await asyncio.wait_for(future, timeout=timeout)
+            except asyncio.TimeoutError:
+                return False
+            except OSError as e:
+                logger.debug(f"发送ICMP请求失败 {ip}: {e}")
+                return False
+            finally:
+                self._waiters.pop(seq, None)
+
+    async def ping_many(self, ips: Iterable[str], timeout: float = 3.0) -> Optional[Dict[str, bool]]:
+        """并发ping多个主机；不支持ICMP时返回None"""
+        ips = list(ips)
+        if not self._ensure_socket():
+            return None
+        results = await asyncio.gather(*(self.ping(ip, timeout) for ip in ips))
+        return {ip: bool(result) for ip, result in zip(ips, results)}
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.remove_reader(self.sock.fileno())
+        except Exception:
+            pass
+        self.sock.close()
+        self.sock = None
+        self._loop = None
+        for _, future in self._waiters.values():
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
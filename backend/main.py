@@ -43,11 +43,12 @@ class BulkDeviceStatusResponse(BaseModel):
 from fastapi import FastAPI, HTTPException, Depends, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 import sqlite3
 import hashlib
+import json
 import jwt
 from datetime import datetime, timedelta
 import os
@@ -56,6 +57,8 @@ import threading
 import time
 import logging
 import traceback
+import asyncio
+from contextlib import asynccontextmanager
 from typing import Any, Dict, List, Union
 
 import sys
@@ -63,6 +66,16 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config.config_loader import config_manager
 from backend.utils import handle_exceptions, retry_operation
+from backend.device_probe import DeviceProbeEngine
+from backend.rtsp_probe import channel_path
+from backend.health_scheduler import HealthScheduler
+from backend.status_writer import StatusWriteBuffer
+from backend.db_pool import SQLitePool
+from backend.stats_cache import DEFAULT_STATS_TTL, StatsCache
+from backend.change_feed import DEFAULT_KEEPALIVE_INTERVAL, ChangeNotifier, ensure_change_feed_schema
+from backend.repositories import AsyncDatabase, DeviceRepository, MAX_PAGE_SIZE, StatsRepository, UserRepository
+from backend import channels, device_import, health_tiers, status_history
+from backend.icmp_ping import ping_hosts
 from backend.exceptions import (
     AuthenticationException,
     AuthorizationException,
@@ -85,14 +98,50 @@ else:
     logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="海康设备管理API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动和停止后台设备健康检查调度器"""
+    if monitoring_config.get("health_scheduler", True):
+        await health_scheduler.start()
+    yield
+    await health_scheduler.stop()
+    await database.close()
+    db_pool.close_all()
+
+app = FastAPI(title="海康设备管理API", version="1.0.0", lifespan=lifespan)
 
 # 获取配置
 backend_config: Dict[str, Any] = backend_app_config.get("server", {})
 jwt_config: Dict[str, Any] = backend_app_config.get("auth", {})
+monitoring_config: Dict[str, Any] = backend_app_config.get("monitoring", {})
+
+# 设备在线状态并发探测引擎
+probe_engine = DeviceProbeEngine.from_config(monitoring_config)
 # 使用绝对路径指向根目录下的data/devices.db
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "devices.db")
 
+# 数据库连接池（WAL模式，连接和编译后的语句在请求间复用）
+sqlite_config: Dict[str, Any] = backend_app_config.get("database", {}).get("sqlite", {})
+db_pool = SQLitePool.from_config(DB_PATH, sqlite_config)  # 同步连接，供后台线程中的批量写回和历史查询使用
+
+# API处理函数使用的异步数据访问层，数据库调用不阻塞事件循环
+database = AsyncDatabase.from_config(DB_PATH, sqlite_config)
+device_repo = DeviceRepository(database)
+user_repo = UserRepository(database)
+stats_repo = StatsRepository(database)
+
+# 设备统计缓存，状态变化或设备增删改时失效
+stats_cache = StatsCache(stats_repo.status_breakdown, monitoring_config.get("stats_cache_ttl", DEFAULT_STATS_TTL))
+
+# 设备变更通知，唤醒等待中的变更推送流
+change_notifier = ChangeNotifier()
+CHANGE_STREAM_KEEPALIVE = monitoring_config.get("change_stream_keepalive", DEFAULT_KEEPALIVE_INTERVAL)
+
+def devices_changed():
+    """设备增删改或状态变化后调用：统计缓存失效并通知变更推送流"""
+    stats_cache.invalidate()
+    change_notifier.notify()
+
 # CORS配置 - 使用配置文件中的CORS设置
 cors_origins = backend_config.get("cors_origins", [])
 if not isinstance(cors_origins, list):
@@ -113,6 +162,8 @@ ACCESS_TOKEN_EXPIRE_MINUTES = jwt_config.get("access_token_expire_minutes", 30)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+DEFAULT_PAGE_SIZE = 100  # 设备列表分页的默认每页数量
+
 # 数据模型
 class Device(BaseModel):
     region: str
@@ -136,6 +187,11 @@ class DeviceUpdate(BaseModel):
     name: Optional[str] = None
     protocol: Optional[str] = None
 
+class BulkDevices(BaseModel):
+    devices: List[Dict[str, Any]]
+    update_existing: bool = True  # IP已存在时更新设备，False时跳过
+    dry_run: bool = False  # 只校验不写入
+
 class User(BaseModel):
     username: str
     password: str
@@ -152,11 +208,9 @@ class DatabaseException(Exception):
 
 # 数据库连接管理
 def get_db_connection():
-    """获取数据库连接"""
+    """从连接池借出数据库连接（结果可以通过列名访问），close()时归还连接池"""
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10.0)
-        conn.row_factory = sqlite3.Row  # 使结果可以通过列名访问
-        return conn
+        return db_pool.connection()
     except sqlite3.Error as e:
         logger.error(f"数据库连接失败: {e}")
         raise Exception(f"无法连接到数据库: {str(e)}")
@@ -164,6 +218,17 @@ def get_db_connection():
         logger.error(f"数据库连接异常: {e}")
         raise Exception(f"数据库连接出现未知错误: {str(e)}")
 
+# 设备状态写回缓冲区，调度器和手动检查共用，每次写回为一个事务
+status_buffer = StatusWriteBuffer(
+    get_db_connection, monitoring_config.get("history_max_gap", status_history.DEFAULT_MAX_GAP)
+)
+
+status_buffer.add_listener(stats_cache.invalidate)
+status_buffer.add_listener(change_notifier.notify)
+
+# 后台设备健康检查调度器（在应用生命周期内运行）
+health_scheduler = HealthScheduler.from_config(probe_engine, get_db_connection, monitoring_config, status_buffer)
+
 # 数据库初始化
 def init_db():
     try:
@@ -209,6 +274,26 @@ def init_db():
             VALUES (?, ?, ?)
         ''', ("admin", admin_hash, "admin"))
         
+        # 设备列表键集分页和筛选使用的索引
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_created ON devices (created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_region ON devices (region, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_region_store ON devices (region, store, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_status ON devices (status, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_protocol ON devices (protocol, created_at, id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_devices_ip ON devices (ip)")
+        
+        # 创建设备状态变化日志和在线时长汇总表
+        status_history.ensure_history_schema(conn)
+        
+        # 设备变更版本号（增量同步接口使用）
+        ensure_change_feed_schema(conn)
+        
+        # 分级健康检查结果表
+        health_tiers.ensure_tier_schema(conn)
+        
+        # 通道状态表
+        channels.ensure_channel_schema(conn)
+        
         conn.commit()
         conn.close()
         logger.info("数据库初始化完成")
@@ -218,17 +303,12 @@ def init_db():
         raise
 
 # 认证函数
-def authenticate_user(username: str, password: str):
+async def authenticate_user(username: str, password: str):
     """验证用户"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # 使用参数化查询防止SQL注入
-        cursor.execute("SELECT username, password_hash, role FROM users WHERE username = ?", (username,))
-        user = cursor.fetchone()
-        conn.close()
+        user = await user_repo.get_by_username(username)
         
-        if user and user[1] == hashlib.sha256(password.encode()).hexdigest():
+        if user and user["password_hash"] == hashlib.sha256(password.encode()).hexdigest():
             return user
         return None
     except Exception as e:
@@ -250,8 +330,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         logger.error(f"令牌创建过程中出现错误: {e}")
         raise AuthenticationException(f"令牌创建失败: {str(e)}")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """获取当前用户"""
+def decode_token(token: str):
+    """解析访问令牌，返回用户信息"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -263,99 +343,77 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except jwt.PyJWTError:
         raise AuthenticationException("令牌无效")
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    """获取当前用户"""
+    return decode_token(token)
+
 # API路由
 @app.post("/token", response_model=Token)
 @handle_exceptions
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise AuthenticationException("用户名或密码错误")
-    access_token = create_access_token(data={"sub": user[0]})
+    access_token = create_access_token(data={"sub": user["username"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/import")
 @handle_exceptions
 async def import_device(device: Device, current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO devices (region, store, ip, port, user, pwd, chs, name, protocol)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (device.region, device.store, device.ip, device.port, device.user, device.pwd, 
-          device.chs, device.name or f"{device.region}-{device.store}", device.protocol))
-    
-    conn.commit()
-    device_id = cursor.lastrowid
-    conn.close()
+    device_id = await device_repo.create({
+        "region": device.region,
+        "store": device.store,
+        "ip": device.ip,
+        "port": device.port,
+        "user": device.user,
+        "pwd": device.pwd,
+        "chs": device.chs,
+        "name": device.name or f"{device.region}-{device.store}",
+        "protocol": device.protocol
+    })
+    devices_changed()
     
     return {"status": "ok", "device_id": device_id}
 
 @app.get("/devices")
 @handle_exceptions
-async def get_devices(current_user: dict = Depends(get_current_user)):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, region, store, ip, port, user, pwd, chs, name, status, protocol, created_at FROM devices ORDER BY created_at DESC")
-    devices = cursor.fetchall()
-    conn.close()
-    
-    result = []
-    for device in devices:
-        result.append({
-            "id": device[0],
-            "region": device[1],
-            "store": device[2],
-            "ip": device[3],
-            "port": device[4],
-            "user": device[5],
-            "pwd": device[6],
-            "chs": device[7],
-            "name": device[8],
-            "status": device[9],
-            "protocol": device[10],
-            "created_at": device[11]
-        })
-    return result
+async def get_devices(region: Optional[str] = None, store: Optional[str] = None, status: Optional[str] = None,
+                      protocol: Optional[str] = None, fields: Optional[str] = None,
+                      limit: Optional[int] = None, cursor: Optional[str] = None,
+                      current_user: dict = Depends(get_current_user)):
+    """
+    获取设备列表，支持按region/store/status/protocol筛选和fields（逗号分隔）选择返回字段，默认不返回密码
+    指定limit或cursor时按 (created_at, id) 键集分页，返回 {items, next_cursor, limit}；否则返回全部设备的数组
+    """
+    field_list = _parse_fields(fields)
+    paginated = limit is not None or cursor is not None
+    if paginated:
+        limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    
+    try:
+        items, next_cursor = await device_repo.list_page(
+            {"region": region, "store": store, "status": status, "protocol": protocol},
+            field_list,
+            limit if paginated else None,
+            cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if not paginated:
+        return items
+    return {"items": items, "next_cursor": next_cursor, "limit": limit}
 
 @app.post("/devices")
 @handle_exceptions
 async def create_device(device: Device, current_user: dict = Depends(get_current_user)):
     """创建新设备"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 检查IP地址是否已存在
-    cursor.execute("SELECT id FROM devices WHERE ip=?", (device.ip,))
-    if cursor.fetchone():
-        conn.close()
+    if await device_repo.ip_exists(device.ip):
         raise ValidationException("IP地址已存在")
     
     # 插入新设备
-    cursor.execute("""
-        INSERT INTO devices (region, store, ip, port, user, pwd, chs, name, status, protocol, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        device.region,
-        device.store,
-        device.ip,
-        device.port,
-        device.user,
-        device.pwd,
-        device.chs,
-        device.name or f"设备_{device.ip}",
-        "offline",  # 默认状态为离线
-        device.protocol or "rtsp",
-        datetime.now().isoformat()
-    ))
-    
-    device_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    # 返回创建的设备
-    return {
-        "id": device_id,
+    values = {
         "region": device.region,
         "store": device.store,
         "ip": device.ip,
@@ -364,84 +422,305 @@ async def create_device(device: Device, current_user: dict = Depends(get_current
         "pwd": device.pwd,
         "chs": device.chs,
         "name": device.name or f"设备_{device.ip}",
-        "status": "offline",
+        "status": "offline",  # 默认状态为离线
         "protocol": device.protocol or "rtsp",
         "created_at": datetime.now().isoformat()
     }
+    device_id = await device_repo.create(values)
+    devices_changed()
+    
+    # 返回创建的设备
+    return {"id": device_id, **values}
+
+@app.post("/devices/bulk")
+@handle_exceptions
+async def bulk_import_devices(request: BulkDevices, current_user: dict = Depends(get_current_user)):
+    """
+    批量导入设备：逐行校验后在一个事务中按IP新增或更新，单次最多MAX_BULK_DEVICES台
+    返回每一行的结果（created/updated/skipped/error）和汇总，某些行校验失败不影响其他行导入
+    """
+    if len(request.devices) > device_import.MAX_BULK_DEVICES:
+        raise HTTPException(status_code=400, detail=f"单次最多导入{device_import.MAX_BULK_DEVICES}台设备")
+    
+    valid, results = device_import.validate_devices(request.devices)
+    outcomes = await device_repo.bulk_upsert(
+        [values for _, values in valid], request.update_existing, request.dry_run
+    ) if valid else []
+    for (index, values), (outcome, device_id) in zip(valid, outcomes):
+        results.append({"index": index, "status": outcome, "ip": values["ip"], "device_id": device_id, "errors": []})
+    results.sort(key=lambda result: result["index"])
+    
+    summary = {key: 0 for key in (device_import.CREATED, device_import.UPDATED, device_import.SKIPPED,
+                                  device_import.INVALID)}
+    for result in results:
+        summary[result["status"]] += 1
+    if not request.dry_run and (summary[device_import.CREATED] or summary[device_import.UPDATED]):
+        devices_changed()
+    logger.info(f"批量导入设备 {len(results)} 行{'（模拟）' if request.dry_run else ''}: {summary}")
+    
+    return {"total": len(results), "dry_run": request.dry_run, "summary": summary, "results": results}
 
 @app.get("/devices/stats")
 @handle_exceptions
 async def get_device_stats(current_user: dict = Depends(get_current_user)):
-    """获取设备统计信息"""
+    """获取设备统计信息：总数、在线/离线数、在线率，以及按区域和门店的分组统计（结果短时缓存）"""
+    return await stats_cache.get()
+
+def _parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """解析逗号分隔的fields查询参数"""
+    return [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+
+@app.get("/devices/changes")
+@handle_exceptions
+async def get_device_changes(since: Optional[int] = None, fields: Optional[str] = None,
+                             limit: int = MAX_PAGE_SIZE, current_user: dict = Depends(get_current_user)):
+    """
+    增量同步：返回变更版本since之后新增或变化的设备（按版本顺序）和被删除的设备ID
+    不传since时只返回当前版本，客户端在全量加载设备列表之前调用一次作为同步起点；
+    has_more为True时用next_since继续查询
+    """
+    if since is None:
+        latest = await device_repo.current_version()
+        return {"latest_version": latest, "next_since": latest, "changes": [], "deleted": [], "has_more": False}
+    
+    try:
+        return await device_repo.changes_since(since, _parse_fields(fields), max(1, min(limit, MAX_PAGE_SIZE)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/devices/changes/stream")
+async def stream_device_changes(request: Request, since: Optional[int] = None, fields: Optional[str] = None,
+                                token: Optional[str] = None):
+    """
+    设备变更推送（Server-Sent Events）：设备新增、删除、状态或配置变化时推送changes事件，
+    数据格式与 /devices/changes 相同，事件ID为next_since，断线重连时按Last-Event-ID续传；
+    EventSource无法设置请求头，令牌通过token查询参数传递
+    """
+    if not token:
+        authorization = request.headers.get("authorization", "")
+        token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+    if not token:
+        raise AuthenticationException("缺少访问令牌")
+    decode_token(token)
+    
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    field_list = _parse_fields(fields)
+    if since is None:
+        since = await device_repo.current_version()
+    try:
+        # 提前校验字段，错误在建立推送流之前返回
+        await device_repo.changes_since(since, field_list, 1)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def events():
+        nonlocal since
+        change_notifier.subscribers += 1
+        try:
+            yield f"retry: 5000\nid: {since}\nevent: ready\ndata: {json.dumps({'version': since})}\n\n"
+            while not await request.is_disconnected():
+                event = change_notifier.snapshot()
+                batch = await device_repo.changes_since(since, field_list)
+                since = batch["next_since"]
+                if batch["changes"] or batch["deleted"]:
+                    yield f"id: {since}\nevent: changes\ndata: {json.dumps(batch, default=str, ensure_ascii=False)}\n\n"
+                    if batch["has_more"]:
+                        continue
+                if not await change_notifier.wait(event, CHANGE_STREAM_KEEPALIVE):
+                    yield ": keepalive\n\n"
+        except Exception as e:
+            logger.error(f"设备变更推送失败: {e}")
+            logger.debug(f"详细错误信息: {traceback.format_exc()}")
+        finally:
+            change_notifier.subscribers -= 1
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # 关闭nginx代理缓冲，事件立即送达
+    })
+
+def _history_range(start: Optional[datetime], end: Optional[datetime]):
+    """解析状态历史查询的时间范围，默认最近7天，统一转换为本地时间"""
+    end = end or datetime.now()
+    start = start or end - timedelta(days=7)
+    if start.tzinfo is not None:
+        start = start.astimezone().replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone().replace(tzinfo=None)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="开始时间必须早于结束时间")
+    return start, end
+
+def _run_history_query(query, *args):
+    """在线程池中用同步连接执行状态历史查询（汇总计算较多，不占用事件循环）"""
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        return query(conn, *args)
+    finally:
+        conn.close()
+
+@app.get("/devices/uptime")
+@handle_exceptions
+async def get_devices_uptime(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                             group_by: str = "region", current_user: dict = Depends(get_current_user)):
+    """按区域（group_by=region）或设备（group_by=device）统计时间范围内的在线率，数据来自状态汇总表"""
+    if group_by not in ("region", "device"):
+        raise HTTPException(status_code=400, detail="group_by仅支持region或device")
+    start, end = _history_range(start, end)
     
-    # 获取设备总数
-    cursor.execute("SELECT COUNT(*) FROM devices")
-    total_devices = cursor.fetchone()[0]
+    devices = await device_repo.list_locations()
+    totals = await asyncio.to_thread(_run_history_query, status_history.query_uptime, start, end)
     
-    # 获取在线设备数
-    cursor.execute("SELECT COUNT(*) FROM devices WHERE status = 'online'")
-    online_devices = cursor.fetchone()[0]
+    if group_by == "device":
+        items = []
+        for device in devices:
+            items.append({
+                "device_id": device["id"],
+                "region": device["region"],
+                "store": device["store"],
+                "name": device["name"],
+                **status_history.summarize(totals.get(device["id"], {}), start, end)
+            })
+    else:
+        regions: Dict[str, Dict[str, float]] = {}
+        counts: Dict[str, int] = {}
+        for device in devices:
+            region = regions.setdefault(device["region"], {"online_seconds": 0.0, "offline_seconds": 0.0, "checks": 0})
+            counts[device["region"]] = counts.get(device["region"], 0) + 1
+            for key, value in totals.get(device["id"], {}).items():
+                region[key] += value
+        items = [
+            {"region": name, "devices": counts[name], **status_history.summarize(total, start, end, counts[name])}
+            for name, total in sorted(regions.items())
+        ]
     
-    # 获取离线设备数
-    cursor.execute("SELECT COUNT(*) FROM devices WHERE status = 'offline'")
-    offline_devices = cursor.fetchone()[0]
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "items": items
+    }
+
+@app.get("/devices/health")
+@handle_exceptions
+async def get_devices_health(tier: Optional[str] = None, status: Optional[str] = None, limit: int = 1000,
+                             current_user: dict = Depends(get_current_user)):
+    """
+    分级健康检查结果：liveness（存活探测）、handshake（RTSP握手）、decode（抽样解码）
+    可按级别和状态筛选，例如 tier=handshake&status=auth_failed 列出认证失败的设备
+    """
+    if tier is not None and tier not in health_tiers.TIERS:
+        raise HTTPException(status_code=400, detail=f"tier仅支持{'/'.join(health_tiers.TIERS)}")
+    items = await asyncio.to_thread(
+        _run_history_query, health_tiers.query_tier_results, None, tier, status, max(1, min(limit, MAX_PAGE_SIZE))
+    )
+    return {"items": items, "scheduler": health_scheduler.stats()["tiers"]}
+
+@app.get("/devices/{device_id}/health")
+@handle_exceptions
+async def get_device_health(device_id: int, current_user: dict = Depends(get_current_user)):
+    """单个设备各级健康检查的最近结果，按级别分组"""
+    if not await device_repo.exists(device_id):
+        raise HTTPException(status_code=404, detail="设备未找到")
+    items = await asyncio.to_thread(_run_history_query, health_tiers.query_tier_results, device_id)
+    tiers: Dict[str, List[Dict[str, Any]]] = {tier: [] for tier in health_tiers.TIERS}
+    for item in items:
+        tiers[item["tier"]].append({key: value for key, value in item.items() if key not in ("device_id", "tier")})
+    return {"device_id": device_id, "tiers": tiers}
+
+@app.get("/channels")
+@handle_exceptions
+async def get_channels(status: Optional[str] = None, probe_status: Optional[str] = None,
+                       stream_type: Optional[str] = None, region: Optional[str] = None, limit: int = 1000,
+                       current_user: dict = Depends(get_current_user)):
+    """
+    全部设备的通道状态，数据来自通道巡检
+    例如 status=offline 列出所有离线通道，probe_status=auth_failed 列出认证失败的通道
+    """
+    items = await asyncio.to_thread(
+        _run_history_query, channels.query_channels, None, status, probe_status, stream_type, region,
+        max(1, min(limit, MAX_PAGE_SIZE))
+    )
+    return {"items": items, "summary": channels.summarize_channels(items)}
+
+@app.get("/devices/{device_id}/channels")
+@handle_exceptions
+async def get_device_channels(device_id: int, current_user: dict = Depends(get_current_user)):
+    """单个设备各通道（主码流、子码流）的状态和编码信息"""
+    if not await device_repo.exists(device_id):
+        raise HTTPException(status_code=404, detail="设备未找到")
+    items = await asyncio.to_thread(_run_history_query, channels.query_channels, device_id)
+    return {"device_id": device_id, "channels": items, "summary": channels.summarize_channels(items)}
+
+@app.get("/devices/{device_id}/uptime")
+@handle_exceptions
+async def get_device_uptime(device_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                            granularity: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    """单台设备在时间范围内的在线率；指定granularity（minute/hour/day）时附带按时间桶的明细"""
+    if granularity is not None and granularity not in status_history.ROLLUP_TABLES:
+        raise HTTPException(status_code=400, detail="granularity仅支持minute、hour或day")
+    start, end = _history_range(start, end)
     
-    conn.close()
+    if not await device_repo.exists(device_id):
+        raise HTTPException(status_code=404, detail="设备未找到")
+    totals = await asyncio.to_thread(_run_history_query, status_history.query_uptime, start, end, device_id)
+    series = None
+    if granularity:
+        series = await asyncio.to_thread(
+            _run_history_query, status_history.query_series, device_id, start, end, granularity
+        )
     
+    result = {
+        "device_id": device_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        **status_history.summarize(totals.get(device_id, {}), start, end)
+    }
+    if series is not None:
+        result["granularity"] = granularity
+        result["series"] = series
+    return result
+
+@app.get("/devices/{device_id}/status-history")
+@handle_exceptions
+async def get_device_status_history(device_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                    limit: int = 500, current_user: dict = Depends(get_current_user)):
+    """单台设备在时间范围内的状态变化记录（按时间倒序）"""
+    start, end = _history_range(start, end)
+    if not await device_repo.exists(device_id):
+        raise HTTPException(status_code=404, detail="设备未找到")
+    transitions = await asyncio.to_thread(
+        _run_history_query, status_history.query_transitions, device_id, start, end, max(1, min(limit, 5000))
+    )
     return {
-        "total": total_devices,
-        "online": online_devices,
-        "offline": offline_devices
+        "device_id": device_id,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "transitions": transitions
     }
 
 @app.get("/devices/{device_id}")
 @handle_exceptions
 async def get_device(device_id: int, current_user: dict = Depends(get_current_user)):
     """获取单个设备信息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, region, store, ip, port, user, pwd, chs, name, status, protocol, created_at FROM devices WHERE id=?", (device_id,))
-    device = cursor.fetchone()
-    conn.close()
+    device = await device_repo.get(device_id)
     
     if not device:
         raise DeviceException("设备不存在")
     
-    return {
-        "id": device[0],
-        "region": device[1],
-        "store": device[2],
-        "ip": device[3],
-        "port": device[4],
-        "user": device[5],
-        "pwd": device[6],
-        "chs": device[7],
-        "name": device[8],
-        "status": device[9],
-        "protocol": device[10],
-        "created_at": device[11]
-    }
+    return device
 
 @app.put("/devices/{device_id}")
 @handle_exceptions
 async def update_device(device_id: int, device: DeviceUpdate, 
                        current_user: dict = Depends(get_current_user)):
     """更新设备信息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # 检查设备是否存在
-    cursor.execute("SELECT id FROM devices WHERE id=?", (device_id,))
-    if not cursor.fetchone():
-        conn.close()
+    if not await device_repo.exists(device_id):
         raise DeviceException("设备不存在")
     
-    # 构建更新语句
-    update_fields = []
-    values = []
-    
     field_mapping = {
         "region": device.region,
         "store": device.store,
@@ -454,21 +733,14 @@ async def update_device(device_id: int, device: DeviceUpdate,
         "protocol": device.protocol
     }
     
-    for field, value in field_mapping.items():
-        if value is not None:
-            update_fields.append(f"{field}=?")
-            values.append(value)
+    update_fields = {field: value for field, value in field_mapping.items() if value is not None}
     
     if not update_fields:
-        conn.close()
         raise ValidationException("没有提供要更新的字段")
     
-    values.append(device_id)
-    update_query = f"UPDATE devices SET {', '.join(update_fields)} WHERE id=?"
-    
-    cursor.execute(update_query, values)
-    conn.commit()
-    conn.close()
+    if not await device_repo.update(device_id, update_fields):
+        raise DeviceException("设备不存在")
+    devices_changed()
     
     return {"status": "ok"}
 
@@ -476,19 +748,9 @@ async def update_device(device_id: int, device: DeviceUpdate,
 @handle_exceptions
 async def delete_device(device_id: int, current_user: dict = Depends(get_current_user)):
     """删除设备"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查设备是否存在
-    cursor.execute("SELECT id FROM devices WHERE id=?", (device_id,))
-    if not cursor.fetchone():
-        conn.close()
+    if not await device_repo.delete(device_id):
         raise DeviceException("设备不存在")
-    
-    # 删除设备
-    cursor.execute("DELETE FROM devices WHERE id=?", (device_id,))
-    conn.commit()
-    conn.close()
+    devices_changed()
     
     return {"status": "ok"}
 
@@ -496,22 +758,11 @@ async def delete_device(device_id: int, current_user: dict = Depends(get_current
 @handle_exceptions
 async def connect_device(device_id: int, current_user: dict = Depends(get_current_user)):
     """连接设备"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查设备是否存在
-    cursor.execute("SELECT ip, port, user, pwd FROM devices WHERE id=?", (device_id,))
-    device = cursor.fetchone()
-    
-    if not device:
-        conn.close()
-        raise DeviceException("设备不存在")
-    
     # 这里应该实现实际的设备连接逻辑
     # 目前只是示例，简单地将状态更新为online
-    cursor.execute("UPDATE devices SET status=? WHERE id=?", ("online", device_id))
-    conn.commit()
-    conn.close()
+    if not await device_repo.set_status(device_id, "online"):
+        raise DeviceException("设备不存在")
+    devices_changed()
     
     return {"status": "connected"}
 
@@ -519,50 +770,21 @@ async def connect_device(device_id: int, current_user: dict = Depends(get_curren
 @handle_exceptions
 async def disconnect_device(device_id: int, current_user: dict = Depends(get_current_user)):
     """断开设备连接"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 检查设备是否存在
-    cursor.execute("SELECT id FROM devices WHERE id=?", (device_id,))
-    if not cursor.fetchone():
-        conn.close()
-        raise DeviceException("设备不存在")
-    
     # 更新设备状态为offline
-    cursor.execute("UPDATE devices SET status=? WHERE id=?", ("offline", device_id))
-    conn.commit()
-    conn.close()
+    if not await device_repo.set_status(device_id, "offline"):
+        raise DeviceException("设备不存在")
+    devices_changed()
     
     return {"status": "disconnected"}
 
 def ping_device(ip: str, timeout: int = 3) -> bool:
-    """使用ping命令检测设备是否可达"""
-    import subprocess
-    import platform
-    
+    """使用进程内ICMP回显检测设备是否可达（不再启动ping子进程）"""
     try:
-        system = platform.system().lower()
-        if system == "windows":
-            cmd = ['ping', '-n', '1', '-w', str(timeout * 1000), ip]
-        else:
-            cmd = ['ping', '-c', '1', '-W', str(timeout), ip]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout+2)
-        
-        # 检查返回码和输出
-        if result.returncode == 0:
-            # 检查是否有TTL字段，表示设备响应
-            output = result.stdout.lower()
-            if 'ttl=' in output or 'time=' in output:
-                return True
-        return False
-        
-    except subprocess.TimeoutExpired:
-        logger.debug(f"Ping超时 {ip}")
-        return False
-    except FileNotFoundError:
-        logger.warning(f"Ping命令未找到 {ip}")
-        return False
+        results = ping_hosts([ip], timeout)
+        if results is None:
+            # 不支持非特权ICMP套接字，由端口检查兜底
+            return False
+        return results.get(ip, False)
     except Exception as e:
         logger.error(f"Ping设备 {ip} 时出错: {e}")
         return False
@@ -633,34 +855,22 @@ def check_device_online(ip: str, port: int = 554, protocol: str = 'rtsp') -> boo
 async def check_device_status(device_id: int, current_user: dict = Depends(get_current_user)):
     """检查单个设备状态"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, ip, port, name, protocol FROM devices WHERE id=?", (device_id,))
-        device = cursor.fetchone()
+        device = await device_repo.probe_target(device_id)
         
         if not device:
-            conn.close()
             raise HTTPException(status_code=404, detail="设备未找到")
         
         device_id, ip, port, name, protocol = device
-        is_online = check_device_online(ip, port or 554, protocol or 'rtsp')
+        is_online = await probe_engine.probe(ip, port or 554, protocol or 'rtsp')
         new_status = "online" if is_online else "offline"
         
-        # 更新状态和相关字段
+        # 通过共享的写回缓冲区立即写回（连同调度器尚未写回的结果一起提交）
         now = datetime.now()
-        if is_online:
-            cursor.execute(
-                "UPDATE devices SET status = ?, last_seen = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                (new_status, now.isoformat(), now.isoformat(), device_id)
-            )
-        else:
-            cursor.execute(
-                "UPDATE devices SET status = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                (new_status, now.isoformat(), device_id)
-            )
+        status_buffer.add(device_id, is_online, now.isoformat())
+        await asyncio.to_thread(status_buffer.flush)
         
-        conn.commit()
-        conn.close()
+        # 手动检查结果同步到调度器，按新状态重新排队
+        health_scheduler.record_result(device_id, is_online)
         
         logger.info(f"手动检查设备 {name}({ip}) 状态: {new_status}")
         
@@ -681,37 +891,69 @@ async def check_device_status(device_id: int, current_user: dict = Depends(get_c
         logger.error(f"检查设备状态时出现未知错误: {e}")
         raise HTTPException(status_code=500, detail="设备状态检查失败")
 
+@app.post("/devices/{device_id}/check-stream")
+@handle_exceptions
+async def check_device_stream(device_id: int, channel: int = 1, stream_type: str = "main",
+                              current_user: dict = Depends(get_current_user)):
+    """
+    RTSP握手检查单个通道：OPTIONS/DESCRIBE并解析SDP，不拉流解码
+    返回status（healthy/auth_failed/no_stream/unreachable/error）、编码、分辨率和音频信息
+    """
+    device = await device_repo.get(device_id)
+    if not device:
+        raise HTTPException(status_code=404, detail="设备未找到")
+    if stream_type not in ("main", "sub"):
+        raise HTTPException(status_code=400, detail="stream_type必须为main或sub")
+    
+    result = await probe_engine.probe_stream(
+        device["ip"], device["port"], device["user"], device["pwd"], channel_path(channel, stream_type)
+    )
+    logger.info(f"RTSP握手检查设备 {device['name']}({device['ip']}) 通道{channel}: {result['status']}")
+    return {"device_id": device_id, "channel": channel, "stream_type": stream_type,
+            "checked_at": datetime.now().isoformat(), **result}
+
+@app.post("/devices/{device_id}/channels/sweep")
+@handle_exceptions
+async def sweep_device_channels(device_id: int, current_user: dict = Depends(get_current_user)):
+    """立即巡检设备的所有通道（一个RTSP控制连接依次DESCRIBE），结果写入通道表"""
+    device = await device_repo.get(device_id)
+    if not device:
+        raise HTTPException(status_code=404, detail="设备未找到")
+    
+    sweeps = await channels.sweep_devices(
+        probe_engine,
+        [(device_id, device["ip"], device["port"], device["user"], device["pwd"], device["chs"])],
+        health_scheduler.channel_stream_types
+    )
+    await asyncio.to_thread(_run_history_query, channels.record_channel_results, sweeps)
+    
+    items = await asyncio.to_thread(_run_history_query, channels.query_channels, device_id)
+    summary = channels.summarize_channels(items)
+    logger.info(f"通道巡检设备 {device['name']}({device['ip']}): {summary}")
+    return {"device_id": device_id, "channels": items, "summary": summary}
+
 @app.post("/devices/check-all-status")
 async def check_all_devices_status(current_user: dict = Depends(get_current_user)):
     """检查所有设备状态"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, ip, port, name, protocol FROM devices")
-        devices = cursor.fetchall()
+        devices = await device_repo.probe_targets()
         
         results = []
         online_count = 0
         now = datetime.now()
         
+        # 所有设备并发探测，单个设备的多个端口错峰竞速
+        online_map = await probe_engine.probe_many(
+            (device["id"], device["ip"], device["port"], device["protocol"]) for device in devices
+        )
+        
         for device in devices:
             try:
                 device_id, ip, port, name, protocol = device
-                is_online = check_device_online(ip, port or 554, protocol or 'rtsp')
+                is_online = online_map.get(device_id, False)
                 new_status = "online" if is_online else "offline"
-                
-                # 更新状态和相关字段
                 if is_online:
-                    cursor.execute(
-                        "UPDATE devices SET status = ?, last_seen = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                        (new_status, now.isoformat(), now.isoformat(), device_id)
-                    )
                     online_count += 1
-                else:
-                    cursor.execute(
-                        "UPDATE devices SET status = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                        (new_status, now.isoformat(), device_id)
-                    )
                 
                 results.append({
                     "device_id": device_id,
@@ -728,8 +970,13 @@ async def check_all_devices_status(current_user: dict = Depends(get_current_user
                 # 即使单个设备检查失败，也继续处理其他设备
                 continue
         
-        conn.commit()
-        conn.close()
+        # 所有结果在一个事务中写回，状态未变化的设备只更新检查时间
+        status_buffer.add_many(online_map, now.isoformat())
+        await asyncio.to_thread(status_buffer.flush)
+        
+        # 检查结果同步到调度器，按新状态重新排队
+        for device_id, is_online in online_map.items():
+            health_scheduler.record_result(device_id, is_online)
         
         return {
             "checked_devices": len(results),
@@ -752,16 +999,16 @@ async def health_check():
     """健康检查"""
     try:
         # 检查数据库连接
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        conn.close()
+        await stats_repo.ping()
         
         return {
             "status": "healthy",
             "timestamp": datetime.now().isoformat(),
-            "database": "connected"
+            "database": "connected",
+            "database_pool": db_pool.stats(),
+            "async_database_pool": database.stats(),
+            "stats_cache": stats_cache.stats(),
+            "change_feed": change_notifier.stats()
         }
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
@@ -771,6 +1018,11 @@ async def health_check():
             "error": str(e)
         }
 
+@app.get("/health/scheduler")
+async def health_scheduler_status():
+    """后台健康检查调度器状态（队列深度、到期数量、进行中的检查等）"""
+    return health_scheduler.stats()
+
 # 异常处理器
 # 不需要再为DatabaseException定义单独的异常处理器，使用全局的error_handler即可
 
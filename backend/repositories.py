@@ -0,0 +1,460 @@
+"""
+异步数据访问模块
+基于aiosqlite的连接池和设备、用户、统计仓储：SQL在各连接的后台线程中执行，
+API处理函数await查询结果期间事件循环可以继续处理其他请求，不再被数据库调用阻塞
+"""
+
+import asyncio
+import base64
+import json
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from backend.db_pool import (
+    DEFAULT_CACHE_SIZE_KB,
+    DEFAULT_CACHED_STATEMENTS,
+    DEFAULT_MMAP_SIZE,
+    DEFAULT_TIMEOUT,
+    connection_pragmas
+)
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_ASYNC_POOL_SIZE = 4  # 异步连接数上限（每个连接占用一个后台线程）
+
+# 设备接口返回的字段
+DEVICE_COLUMNS = "id, region, store, ip, port, user, pwd, chs, name, status, protocol, created_at"
+# 允许通过update修改的设备字段
+DEVICE_UPDATABLE_FIELDS = ("region", "store", "ip", "port", "user", "pwd", "chs", "name", "protocol")
+# 设备列表可选择返回的字段，未指定时返回不含密码的默认字段
+DEVICE_SELECTABLE_FIELDS = (
+    "id", "region", "store", "ip", "port", "user", "pwd", "chs", "name", "status", "protocol", "created_at",
+    "last_seen", "last_check", "check_count", "version"
+)
+DEVICE_LIST_DEFAULT_FIELDS = ("id", "region", "store", "ip", "port", "user", "chs", "name", "status", "protocol", "created_at")
+# 设备列表可筛选的字段
+DEVICE_FILTER_FIELDS = ("region", "store", "status", "protocol")
+MAX_PAGE_SIZE = 1000
+# 批量导入时写入的设备字段
+DEVICE_IMPORT_FIELDS = ("region", "store", "ip", "port", "user", "pwd", "chs", "name", "protocol")
+# 按IP查询已有设备时每条语句的参数个数（低于旧版SQLite的999个参数上限）
+IP_LOOKUP_CHUNK = 500
+
+
+def encode_cursor(created_at: Any, device_id: int) -> str:
+    """把分页位置 (created_at, id) 编码为不透明的游标字符串"""
+    raw = json.dumps([created_at, device_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """解析游标，格式错误时抛出ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, device_id = json.loads(raw)
+        return created_at, int(device_id)
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def _device_fields(fields: Optional[List[str]]) -> List[str]:
+    """校验要返回的设备字段，未指定时使用默认字段"""
+    fields = list(fields or DEVICE_LIST_DEFAULT_FIELDS)
+    invalid = [field for field in fields if field not in DEVICE_SELECTABLE_FIELDS]
+    if invalid:
+        raise ValueError(f"不支持的字段: {', '.join(invalid)}")
+    return fields
+
+
+def _insert_values(device: Dict[str, Any], created_at: str) -> Tuple:
+    """批量导入新增设备的参数，未填写名称时使用默认名称"""
+    values = dict(device, name=device["name"] or f"设备_{device['ip']}")
+    return (*(values[field] for field in DEVICE_IMPORT_FIELDS), created_at)
+
+
+class AsyncDatabase:
+    """aiosqlite连接池，连接数达到上限时等待其他请求归还"""
+
+    def __init__(self, path: str, pool_size: int = DEFAULT_ASYNC_POOL_SIZE, timeout: float = DEFAULT_TIMEOUT,
+                 cache_size_kb: int = DEFAULT_CACHE_SIZE_KB, mmap_size: int = DEFAULT_MMAP_SIZE,
+                 synchronous: str = "NORMAL", cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.path = path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = connection_pragmas(synchronous, cache_size_kb, mmap_size)
+
+        self._idle: List[aiosqlite.Connection] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._opened = 0
+
+        # 统计信息
+        self.acquired = 0
+        self.waiting = 0
+
+    @classmethod
+    def from_config(cls, path: str, sqlite_config: Optional[Dict[str, Any]] = None) -> "AsyncDatabase":
+        """从后端配置的database.sqlite段创建连接池"""
+        sqlite_config = sqlite_config or {}
+        return cls(
+            path,
+            pool_size=sqlite_config.get("async_pool_size", DEFAULT_ASYNC_POOL_SIZE),
+            timeout=sqlite_config.get("timeout", DEFAULT_TIMEOUT),
+            cache_size_kb=sqlite_config.get("cache_size_kb", DEFAULT_CACHE_SIZE_KB),
+            mmap_size=sqlite_config.get("mmap_size", DEFAULT_MMAP_SIZE),
+            synchronous=sqlite_config.get("synchronous", "NORMAL"),
+            cached_statements=sqlite_config.get("cached_statements", DEFAULT_CACHED_STATEMENTS)
+        )
+
+    async def _create(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, timeout=self.timeout, cached_statements=self.cached_statements)
+        conn.row_factory = aiosqlite.Row
+        for pragma in self.pragmas:
+            await conn.execute(pragma)
+        self._opened += 1
+        return conn
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """借出一个连接，退出时回滚未提交的事务并归还"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        conn = None
+        try:
+            conn = self._idle.pop() if self._idle else await self._create()
+            self.acquired += 1
+            yield conn
+        finally:
+            if conn is not None:
+                await self._release(conn)
+            self._slots.release()
+
+    async def _release(self, conn: aiosqlite.Connection):
+        try:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._idle.append(conn)
+        except Exception as e:
+            logger.warning(f"归还异步数据库连接失败，关闭该连接: {e}")
+            self._opened -= 1
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    async def fetch_all(self, sql: str, params: Tuple = ()) -> List[aiosqlite.Row]:
+        async with self.connection() as conn:
+            return list(await conn.execute_fetchall(sql, params))
+
+    async def fetch_one(self, sql: str, params: Tuple = ()) -> Optional[aiosqlite.Row]:
+        async with self.connection() as conn:
+            async with conn.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+
+    async def execute(self, sql: str, params: Tuple = ()) -> Tuple[int, Optional[int]]:
+        """执行一条写语句并提交，返回 (影响行数, 最后插入的行ID)"""
+        async with self.connection() as conn:
+            async with conn.execute(sql, params) as cursor:
+                rowcount, lastrowid = cursor.rowcount, cursor.lastrowid
+            await conn.commit()
+            return rowcount, lastrowid
+
+    async def close(self):
+        """关闭所有空闲连接"""
+        while self._idle:
+            conn = self._idle.pop()
+            self._opened -= 1
+            try:
+                await conn.close()
+            except Exception as e:
+                logger.debug(f"关闭异步数据库连接失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pool_size": self.pool_size,
+            "opened": self._opened,
+            "idle": len(self._idle),
+            "waiting": self.waiting,
+            "acquired": self.acquired
+        }
+
+
+class DeviceRepository:
+    """设备表的数据访问"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+
+    async def list_page(self, filters: Optional[Dict[str, Any]] = None, fields: Optional[List[str]] = None,
+                        limit: Optional[int] = None, cursor: Optional[str] = None
+                        ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        按 (created_at, id) 倒序的键集分页查询设备
+        filters为 字段 -> 值 的等值筛选；fields为返回字段；返回 (设备列表, 下一页游标)，没有下一页时游标为None
+        """
+        fields = _device_fields(fields)
+        # 分页位置需要id和created_at，未请求时查询后再去掉
+        columns = fields + [column for column in ("id", "created_at") if column not in fields]
+
+        conditions, params = [], []
+        for field, value in (filters or {}).items():
+            if field not in DEVICE_FILTER_FIELDS:
+                raise ValueError(f"不支持的筛选字段: {field}")
+            if value is not None:
+                conditions.append(f"{field} = ?")
+                params.append(value)
+        if cursor:
+            conditions.append("(created_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = f"SELECT {', '.join(columns)} FROM devices"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC, id DESC"
+        if limit is not None:
+            # 多取一行判断是否还有下一页
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        rows = await self.db.fetch_all(sql, tuple(params))
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        return [{field: row[field] for field in fields} for row in rows], next_cursor
+
+    async def current_version(self) -> int:
+        """设备表当前的变更版本"""
+        row = await self.db.fetch_one("SELECT version FROM device_change_seq WHERE id = 1")
+        return row["version"] if row else 0
+
+    async def changes_since(self, since: int, fields: Optional[List[str]] = None,
+                            limit: int = MAX_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        查询变更版本since之后新增或变化的设备和被删除的设备ID，按版本顺序最多返回limit条
+        返回的next_since作为下一次查询的since；has_more为True时应立即继续查询
+        """
+        fields = _device_fields(fields)
+        columns = fields + [column for column in ("id", "version") if column not in fields]
+
+        async with self.db.connection() as conn:
+            # 先读取当前版本作为本次查询的上限：版本号和设备行在同一事务中写入，
+            # 上限以内的变化此后一定可见，上限以外的变化留给下一次查询
+            async with conn.execute("SELECT version FROM device_change_seq WHERE id = 1") as cursor:
+                row = await cursor.fetchone()
+            latest = row["version"] if row else 0
+            rows = await conn.execute_fetchall(
+                f"SELECT {', '.join(columns)} FROM devices WHERE version > ? AND version <= ? ORDER BY version LIMIT ?",
+                (since, latest, limit + 1)
+            )
+            tombstones = await conn.execute_fetchall(
+                "SELECT device_id, version FROM device_tombstones WHERE version > ? AND version <= ? "
+                "ORDER BY version LIMIT ?",
+                (since, latest, limit + 1)
+            )
+
+        # 按版本合并变化和删除，超出limit的部分留给下一次查询
+        merged = sorted(
+            [(row["version"], False, row) for row in rows] + [(row["version"], True, row) for row in tombstones],
+            key=lambda item: item[0]
+        )
+        has_more = len(merged) > limit
+        merged = merged[:limit]
+        next_since = merged[-1][0] if has_more else latest
+
+        changes, deleted = [], []
+        for version, is_deleted, row in merged:
+            if is_deleted:
+                deleted.append(row["device_id"])
+            else:
+                changes.append({**{field: row[field] for field in fields}, "id": row["id"], "version": version})
+        return {
+            "latest_version": latest,
+            "next_since": next_since,
+            "changes": changes,
+            "deleted": deleted,
+            "has_more": has_more
+        }
+
+    async def get(self, device_id: int) -> Optional[Dict[str, Any]]:
+        row = await self.db.fetch_one(f"SELECT {DEVICE_COLUMNS} FROM devices WHERE id=?", (device_id,))
+        return dict(row) if row else None
+
+    async def exists(self, device_id: int) -> bool:
+        return await self.db.fetch_one("SELECT 1 FROM devices WHERE id=?", (device_id,)) is not None
+
+    async def ip_exists(self, ip: str) -> bool:
+        return await self.db.fetch_one("SELECT 1 FROM devices WHERE ip=?", (ip,)) is not None
+
+    async def create(self, values: Dict[str, Any]) -> int:
+        """插入设备，返回新设备ID"""
+        columns = list(values)
+        _, device_id = await self.db.execute(
+            f"INSERT INTO devices ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            tuple(values[column] for column in columns)
+        )
+        return device_id
+
+    async def update(self, device_id: int, fields: Dict[str, Any]) -> bool:
+        """更新设备字段（仅限允许修改的字段），设备不存在时返回False"""
+        fields = {key: value for key, value in fields.items() if key in DEVICE_UPDATABLE_FIELDS}
+        if not fields:
+            return await self.exists(device_id)
+        assignments = ", ".join(f"{field}=?" for field in fields)
+        rowcount, _ = await self.db.execute(
+            f"UPDATE devices SET {assignments} WHERE id=?", (*fields.values(), device_id)
+        )
+        return rowcount > 0
+
+    @staticmethod
+    async def _ids_by_ip(conn: aiosqlite.Connection, ips: List[str]) -> Dict[str, int]:
+        """按IP查询已有设备ID（同一IP有多台设备时取最早的一台）"""
+        ids: Dict[str, int] = {}
+        for start in range(0, len(ips), IP_LOOKUP_CHUNK):
+            chunk = ips[start:start + IP_LOOKUP_CHUNK]
+            rows = await conn.execute_fetchall(
+                f"SELECT ip, MIN(id) AS id FROM devices WHERE ip IN ({', '.join('?' * len(chunk))}) GROUP BY ip",
+                tuple(chunk)
+            )
+            ids.update((row["ip"], row["id"]) for row in rows)
+        return ids
+
+    async def bulk_upsert(self, devices: List[Dict[str, Any]], update_existing: bool = True,
+                          dry_run: bool = False) -> List[Tuple[str, Optional[int]]]:
+        """
+        在一个事务中按IP批量新增或更新设备（设备字段已校验且IP互不相同），按输入顺序返回每台设备的 (结果, 设备ID)
+        结果为created/updated/skipped：IP不存在时新增；已存在时update_existing为True则更新，否则跳过；
+        名称为None时新增使用默认名称、更新保留原名称；dry_run只查询不写入，新增设备的ID为None
+        """
+        async with self.db.connection() as conn:
+            ids = await self._ids_by_ip(conn, [device["ip"] for device in devices])
+            created = [device for device in devices if device["ip"] not in ids]
+            updated = [device for device in devices if device["ip"] in ids] if update_existing else []
+
+            if not dry_run and (created or updated):
+                if created:
+                    now = datetime.now().isoformat()
+                    await conn.executemany(
+                        f"INSERT INTO devices ({', '.join(DEVICE_IMPORT_FIELDS)}, status, created_at) "
+                        f"VALUES ({', '.join('?' * len(DEVICE_IMPORT_FIELDS))}, 'offline', ?)",
+                        [_insert_values(device, now) for device in created]
+                    )
+                if updated:
+                    assignments = ", ".join(
+                        "name = COALESCE(?, name)" if field == "name" else f"{field} = ?"
+                        for field in DEVICE_IMPORT_FIELDS if field != "ip"
+                    )
+                    await conn.executemany(
+                        f"UPDATE devices SET {assignments} WHERE id = ?",
+                        [
+                            (*(device[field] for field in DEVICE_IMPORT_FIELDS if field != "ip"), ids[device["ip"]])
+                            for device in updated
+                        ]
+                    )
+                await conn.commit()
+                if created:
+                    ids.update(await self._ids_by_ip(conn, [device["ip"] for device in created]))
+
+        results: List[Tuple[str, Optional[int]]] = []
+        new_ips = {device["ip"] for device in created}
+        for device in devices:
+            if device["ip"] in new_ips:
+                results.append(("created", ids.get(device["ip"])))
+            else:
+                results.append(("updated" if update_existing else "skipped", ids[device["ip"]]))
+        return results
+
+    async def delete(self, device_id: int) -> bool:
+        rowcount, _ = await self.db.execute("DELETE FROM devices WHERE id=?", (device_id,))
+        return rowcount > 0
+
+    async def set_status(self, device_id: int, status: str) -> bool:
+        rowcount, _ = await self.db.execute("UPDATE devices SET status=? WHERE id=?", (status, device_id))
+        return rowcount > 0
+
+    async def probe_target(self, device_id: int) -> Optional[aiosqlite.Row]:
+        """设备探测所需的字段：id, ip, port, name, protocol"""
+        return await self.db.fetch_one("SELECT id, ip, port, name, protocol FROM devices WHERE id=?", (device_id,))
+
+    async def probe_targets(self) -> List[aiosqlite.Row]:
+        return await self.db.fetch_all("SELECT id, ip, port, name, protocol FROM devices")
+
+    async def list_locations(self) -> List[aiosqlite.Row]:
+        """设备的区域、门店和名称，用于在线率统计"""
+        return await self.db.fetch_all("SELECT id, region, store, name FROM devices")
+
+
+class UserRepository:
+    """用户表的数据访问"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+
+    async def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        row = await self.db.fetch_one(
+            "SELECT username, password_hash, role FROM users WHERE username = ?", (username,)
+        )
+        return dict(row) if row else None
+
+
+class StatsRepository:
+    """统计查询"""
+
+    def __init__(self, db: AsyncDatabase):
+        self.db = db
+
+    async def status_breakdown(self) -> Dict[str, Any]:
+        """
+        一次GROUP BY查询统计设备状态
+        返回总数、在线数、离线数和在线率，以及按区域、区域内按门店的同样统计
+        """
+        rows = await self.db.fetch_all(
+            "SELECT region, store, status, COUNT(*) AS count FROM devices GROUP BY region, store, status"
+        )
+
+        def new_counts() -> Dict[str, Any]:
+            return {"total": 0, "online": 0, "offline": 0}
+
+        def add(counts: Dict[str, Any], status: str, count: int):
+            counts["total"] += count
+            if status in ("online", "offline"):
+                counts[status] += count
+
+        def finish(counts: Dict[str, Any]) -> Dict[str, Any]:
+            counts["online_rate"] = round(counts["online"] / counts["total"] * 100, 2) if counts["total"] else 0
+            return counts
+
+        totals = new_counts()
+        regions: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            add(totals, row["status"], row["count"])
+            region = regions.setdefault(row["region"], {**new_counts(), "stores": {}})
+            add(region, row["status"], row["count"])
+            add(region["stores"].setdefault(row["store"], new_counts()), row["status"], row["count"])
+
+        return {
+            **finish(totals),
+            "regions": [
+                {
+                    "region": name,
+                    **finish({key: value for key, value in region.items() if key != "stores"}),
+                    "stores": [{"store": store, **finish(counts)} for store, counts in sorted(region["stores"].items())]
+                }
+                for name, region in sorted(regions.items())
+            ]
+        }
+
+    async def ping(self) -> bool:
+        row = await self.db.fetch_one("SELECT 1")
+        return row is not None
@@ -0,0 +1,561 @@
+"""
+RTSP握手探测模块
+基于asyncio的轻量RTSP客户端：只发送OPTIONS和DESCRIBE（支持Digest/Basic认证），解析SDP中的编码、
+分辨率和音频信息，区分认证失败、不可达和流可用，不再为每台设备启动ffmpeg解码一帧；
+同一连接可以连续DESCRIBE多个通道（probe_channels），批量探测通过信号量限制并发数
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 默认探测参数
+DEFAULT_RTSP_TIMEOUT = 5.0  # probe_rtsp单台设备从连接到DESCRIBE完成的总时限（秒）
+CHANNELS_PER_TIMEOUT = 16  # probe_channels每多探测这么多个通道路径，总时限增加一个timeout
+DEFAULT_RTSP_CONCURRENCY = 64  # 批量探测时同时握手的设备数上限
+USER_AGENT = "monitor-rtsp-probe/1.0"
+MAX_HEADER_SIZE = 16 * 1024
+MAX_BODY_SIZE = 64 * 1024
+
+# 探测结果状态
+HEALTHY = "healthy"  # DESCRIBE成功且SDP中有视频轨
+AUTH_FAILED = "auth_failed"  # 用户名或密码错误（或账号被锁定）
+UNREACHABLE = "unreachable"  # 无法建立TCP连接
+NO_STREAM = "no_stream"  # 服务正常但通道不存在或没有视频
+PROTOCOL_ERROR = "error"  # 响应超时或不是合法的RTSP响应
+
+
+class RTSPError(Exception):
+    """RTSP协议错误"""
+    pass
+
+
+def channel_path(channel: int = 1, stream_type: str = "main") -> str:
+    """通道的RTSP路径（与ChannelURLGenerator的brand_a格式一致），stream_type为main或sub"""
+    return f"/Streaming/Channels/{channel}{'02' if stream_type == 'sub' else '01'}"
+
+
+class RTSPResponse:
+    """RTSP响应"""
+
+    def __init__(self, status: int, reason: str, headers: List[Tuple[str, str]], body: bytes):
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+
+    def header(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for key, value in self.headers:
+            if key == name:
+                return value
+        return None
+
+    def header_list(self, name: str) -> List[str]:
+        name = name.lower()
+        return [value for key, value in self.headers if key == name]
+
+
+def _parse_challenge(header: str) -> Tuple[str, Dict[str, str]]:
+    """解析WWW-Authenticate，返回 (认证方式, 参数)"""
+    scheme, _, rest = header.strip().partition(" ")
+    params = {}
+    for match in re.finditer(r'([\w-]+)\s*=\s*(?:"([^"]*)"|([^,\s]*))', rest):
+        params[match.group(1).lower()] = match.group(2) if match.group(2) is not None else match.group(3)
+    return scheme.lower(), params
+
+
+class RTSPClient:
+    """
+    RTSP控制连接
+    收到401后按质询计算认证头重发一次，之后同一连接上的请求直接携带认证头
+    """
+
+    def __init__(self, ip: str, port: int = 554, username: Optional[str] = None, password: Optional[str] = None,
+                 timeout: float = DEFAULT_RTSP_TIMEOUT):
+        self.ip = ip
+        self.port = port or 554
+        self.username = username or ""
+        self.password = password or ""
+        self.timeout = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._cseq = 0
+        self._challenge: Optional[Tuple[str, Dict[str, str]]] = None
+        self._nonce_count = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def url(self, path: str) -> str:
+        """不含认证信息的请求URL"""
+        return f"rtsp://{self.ip}:{self.port}{path}"
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip, self.port), timeout=self.timeout
+        )
+
+    async def close(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def __aenter__(self) -> "RTSPClient":
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _authorization(self, method: str, url: str) -> Optional[str]:
+        if self._challenge is None:
+            return None
+        scheme, params = self._challenge
+        if scheme == "basic":
+            token = base64.b64encode(f"{self.username}:{self.password}".encode()).decode()
+            return f"Basic {token}"
+
+        realm, nonce = params.get("realm", ""), params.get("nonce", "")
+        ha1 = hashlib.md5(f"{self.username}:{realm}:{self.password}".encode()).hexdigest()
+        if params.get("algorithm", "").lower() == "md5-sess":
+            cnonce = os.urandom(8).hex()
+            ha1 = hashlib.md5(f"{ha1}:{nonce}:{cnonce}".encode()).hexdigest()
+        ha2 = hashlib.md5(f"{method}:{url}".encode()).hexdigest()
+        fields = [f'username="{self.username}"', f'realm="{realm}"', f'nonce="{nonce}"', f'uri="{url}"']
+        qop_options = [item.strip() for item in params.get("qop", "").split(",")]
+        if "auth" in qop_options:
+            self._nonce_count += 1
+            nc = f"{self._nonce_count:08x}"
+            cnonce = os.urandom(8).hex()
+            response = hashlib.md5(f"{ha1}:{nonce}:{nc}:{cnonce}:auth:{ha2}".encode()).hexdigest()
+            fields += [f'response="{response}"', "qop=auth", f"nc={nc}", f'cnonce="{cnonce}"']
+        else:
+            response = hashlib.md5(f"{ha1}:{nonce}:{ha2}".encode()).hexdigest()
+            fields.append(f'response="{response}"')
+        if "algorithm" in params:
+            fields.append(f"algorithm={params['algorithm']}")
+        if "opaque" in params:
+            fields.append(f'opaque="{params["opaque"]}"')
+        return "Digest " + ", ".join(fields)
+
+    async def _send(self, method: str, url: str, headers: Dict[str, str]) -> RTSPResponse:
+        if self._writer is None:
+            raise RTSPError("连接未建立")
+        self._cseq += 1
+        lines = [f"{method} {url} RTSP/1.0", f"CSeq: {self._cseq}", f"User-Agent: {USER_AGENT}"]
+        authorization = self._authorization(method, url)
+        if authorization:
+            lines.append(f"Authorization: {authorization}")
+        lines.extend(f"{key}: {value}" for key, value in headers.items())
+        self._writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await self._writer.drain()
+        return await asyncio.wait_for(self._read_response(), timeout=self.timeout)
+
+    async def _read_response(self) -> RTSPResponse:
+        try:
+            head = await self._reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            raise RTSPError("连接被关闭") from e
+        except asyncio.LimitOverrunError as e:
+            raise RTSPError("响应头过长") from e
+        if len(head) > MAX_HEADER_SIZE:
+            raise RTSPError("响应头过长")
+
+        status_line, *header_lines = head.decode("utf-8", "replace").split("\r\n")
+        match = re.match(r"RTSP/\d\.\d\s+(\d{3})\s*(.*)", status_line)
+        if not match:
+            raise RTSPError(f"无效的RTSP响应: {status_line[:80]}")
+        headers = []
+        for line in header_lines:
+            key, sep, value = line.partition(":")
+            if sep:
+                headers.append((key.strip().lower(), value.strip()))
+
+        body = b""
+        length = next((value for key, value in headers if key == "content-length"), None)
+        if length:
+            size = int(length)
+            if size > MAX_BODY_SIZE:
+                raise RTSPError("响应内容过长")
+            try:
+                body = await self._reader.readexactly(size)
+            except asyncio.IncompleteReadError as e:
+                raise RTSPError("响应内容不完整") from e
+        return RTSPResponse(int(match.group(1)), match.group(2), headers, body)
+
+    async def request(self, method: str, path: str, headers: Optional[Dict[str, str]] = None) -> RTSPResponse:
+        """发送请求，需要认证时按质询重发一次"""
+        url = self.url(path)
+        headers = headers or {}
+        response = await self._send(method, url, headers)
+        if response.status == 401 and (self.username or self.password):
+            challenges = [_parse_challenge(value) for value in response.header_list("www-authenticate")]
+            # 优先使用Digest，避免明文发送密码
+            challenges.sort(key=lambda item: item[0] != "digest")
+            if challenges and challenges[0] != self._challenge:
+                self._challenge = challenges[0]
+                self._nonce_count = 0
+                response = await self._send(method, url, headers)
+        return response
+
+    async def options(self, path: str = "/") -> RTSPResponse:
+        return await self.request("OPTIONS", path)
+
+    async def describe(self, path: str) -> RTSPResponse:
+        return await self.request("DESCRIBE", path, {"Accept": "application/sdp"})
+
+
+class _BitReader:
+    """按位读取码流（用于解析SPS中的指数哥伦布编码）"""
+
+    def __init__(self, data: bytes):
+        # 去掉防竞争字节 00 00 03
+        self.data = re.sub(b"\x00\x00\x03", b"\x00\x00", data)
+        self.pos = 0
+
+    def bits(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.pos >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.pos & 7))) & 1)
+            self.pos += 1
+        return value
+
+    def skip(self, count: int):
+        self.pos += count
+
+    def ue(self) -> int:
+        zeros = 0
+        while self.bits(1) == 0:
+            zeros += 1
+            if zeros > 31:
+                raise ValueError("无效的指数哥伦布编码")
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self) -> int:
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def _h264_resolution(sps: bytes) -> Tuple[int, int]:
+    """从H.264 SPS解析分辨率"""
+    reader = _BitReader(sps[1:])
+    profile_idc = reader.bits(8)
+    reader.skip(16)  # constraint_set_flags, level_idc
+    reader.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    if profile_idc in (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3:
+            reader.skip(1)  # separate_colour_plane_flag
+        reader.ue()  # bit_depth_luma_minus8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.skip(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.bits(1):  # seq_scaling_matrix_present_flag
+            for index in range(8 if chroma_format_idc != 3 else 12):
+                if reader.bits(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if index < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.se() + 256) % 256
+                        last_scale = next_scale or last_scale
+    reader.ue()  # log2_max_frame_num_minus4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.skip(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.skip(1)  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = reader.ue() + 1
+    height_map_units = reader.ue() + 1
+    frame_mbs_only = reader.bits(1)
+    if not frame_mbs_only:
+        reader.skip(1)  # mb_adaptive_frame_field_flag
+    reader.skip(1)  # direct_8x8_inference_flag
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_map_units * 16
+    if reader.bits(1):  # frame_cropping_flag
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        crop_x = 1 if chroma_format_idc in (0, 3) else 2
+        crop_y = (1 if chroma_format_idc in (0, 2, 3) else 2) * (2 - frame_mbs_only)
+        width -= (left + right) * crop_x
+        height -= (top + bottom) * crop_y
+    return width, height
+
+
+def _h265_resolution(sps: bytes) -> Tuple[int, int]:
+    """从H.265 SPS解析分辨率"""
+    reader = _BitReader(sps[2:])
+    reader.skip(4)  # sps_video_parameter_set_id
+    max_sub_layers_minus1 = reader.bits(3)
+    reader.skip(1)  # sps_temporal_id_nesting_flag
+    reader.skip(88 + 8)  # general_profile_tier_level, general_level_idc
+    sub_layer_flags = [(reader.bits(1), reader.bits(1)) for _ in range(max_sub_layers_minus1)]
+    if max_sub_layers_minus1 > 0:
+        reader.skip(2 * (8 - max_sub_layers_minus1))
+    for profile_present, level_present in sub_layer_flags:
+        reader.skip((88 if profile_present else 0) + (8 if level_present else 0))
+    reader.ue()  # sps_seq_parameter_set_id
+    chroma_format_idc = reader.ue()
+    if chroma_format_idc == 3:
+        reader.skip(1)  # separate_colour_plane_flag
+    width, height = reader.ue(), reader.ue()
+    if reader.bits(1):  # conformance_window_flag
+        left, right, top, bottom = reader.ue(), reader.ue(), reader.ue(), reader.ue()
+        sub_width = 2 if chroma_format_idc in (1, 2) else 1
+        sub_height = 2 if chroma_format_idc == 1 else 1
+        width -= (left + right) * sub_width
+        height -= (top + bottom) * sub_height
+    return width, height
+
+
+def _resolution_from_fmtp(codec: str, fmtp: Dict[str, str]) -> Optional[Tuple[int, int]]:
+    """从fmtp中的参数集解析分辨率，解析失败返回None"""
+    try:
+        if codec == "H264" and fmtp.get("sprop-parameter-sets"):
+            sps = base64.b64decode(fmtp["sprop-parameter-sets"].split(",")[0] + "==")
+            return _h264_resolution(sps)
+        if codec in ("H265", "HEVC") and fmtp.get("sprop-sps"):
+            return _h265_resolution(base64.b64decode(fmtp["sprop-sps"] + "=="))
+    except (ValueError, IndexError) as e:
+        logger.debug(f"解析{codec}参数集失败: {e}")
+    return None
+
+
+def parse_sdp(sdp: str) -> Dict[str, Any]:
+    """
+    解析SDP中的媒体信息
+    返回 {"video": {codec, width, height, framerate} 或 None, "audio": {codec, clock_rate} 或 None, "tracks": 媒体数}
+    """
+    media: List[Dict[str, Any]] = []
+    for line in sdp.splitlines():
+        line = line.strip()
+        if line.startswith("m="):
+            parts = line[2:].split()
+            media.append({"type": parts[0] if parts else "", "payloads": parts[3:], "rtpmap": {}, "fmtp": {},
+                          "attributes": {}})
+        elif line.startswith("a=") and media:
+            name, _, value = line[2:].partition(":")
+            current = media[-1]
+            if name == "rtpmap":
+                payload, _, encoding = value.partition(" ")
+                current["rtpmap"][payload] = encoding
+            elif name == "fmtp":
+                payload, _, params = value.partition(" ")
+                current["fmtp"][payload] = dict(
+                    (item.partition("=")[0].strip().lower(), item.partition("=")[2].strip())
+                    for item in params.split(";") if item.strip()
+                )
+            else:
+                current["attributes"][name] = value
+
+    video = audio = None
+    for item in media:
+        payload = item["payloads"][0] if item["payloads"] else ""
+        encoding = item["rtpmap"].get(payload, "")
+        codec, _, rate = encoding.partition("/")
+        codec = codec.upper()
+        if item["type"] == "video" and video is None:
+            video = {"codec": codec or None, "width": None, "height": None, "framerate": None}
+            resolution = _resolution_from_fmtp(codec, item["fmtp"].get(payload, {}))
+            dimensions = item["attributes"].get("x-dimensions") or item["attributes"].get("framesize", "").partition(" ")[2]
+            if resolution is None and dimensions:
+                match = re.match(r"(\d+)[,\-x](\d+)", dimensions)
+                if match:
+                    resolution = (int(match.group(1)), int(match.group(2)))
+            if resolution:
+                video["width"], video["height"] = resolution
+            framerate = item["attributes"].get("framerate")
+            if framerate:
+                try:
+                    video["framerate"] = float(framerate)
+                except ValueError:
+                    pass
+        elif item["type"] == "audio" and audio is None:
+            audio = {"codec": codec or None, "clock_rate": int(rate.partition("/")[0]) if rate[:1].isdigit() else None}
+    return {"video": video, "audio": audio, "tracks": len(media)}
+
+
+def describe_result(response: RTSPResponse) -> Dict[str, Any]:
+    """根据DESCRIBE响应判定通道状态，返回 {status, rtsp_status, video, audio, error}"""
+    result: Dict[str, Any] = {"status": PROTOCOL_ERROR, "rtsp_status": response.status, "video": None,
+                              "audio": None, "error": None}
+    if response.status == 200:
+        sdp = parse_sdp(response.body.decode("utf-8", "replace"))
+        result["video"], result["audio"] = sdp["video"], sdp["audio"]
+        result["status"] = HEALTHY if sdp["video"] else NO_STREAM
+        if not sdp["video"]:
+            result["error"] = "SDP中没有视频轨"
+    elif response.status in (401, 403):
+        result["status"] = AUTH_FAILED
+        result["error"] = f"认证失败: {response.status} {response.reason}"
+    elif response.status in (404, 454):
+        result["status"] = NO_STREAM
+        result["error"] = f"通道不存在: {response.status} {response.reason}"
+    else:
+        result["error"] = f"DESCRIBE失败: {response.status} {response.reason}"
+    return result
+
+
+async def probe_rtsp(ip: str, port: int = 554, username: Optional[str] = None, password: Optional[str] = None,
+                     path: str = channel_path(), timeout: float = DEFAULT_RTSP_TIMEOUT) -> Dict[str, Any]:
+    """
+    对设备执行OPTIONS和DESCRIBE握手，连接、认证和DESCRIBE共用timeout一个总时限
+    返回 {status, healthy, url, rtsp_status, video, audio, latency_ms, error}，status为本模块的探测结果状态之一
+    """
+    started = time.monotonic()
+    client = RTSPClient(ip, port, username, password, timeout)
+    result: Dict[str, Any] = {"status": PROTOCOL_ERROR, "rtsp_status": None, "video": None, "audio": None,
+                              "error": None}
+
+    async def handshake():
+        try:
+            await client.connect()
+        except OSError as e:
+            result.update(status=UNREACHABLE, error=f"无法连接: {e}")
+            return
+        # OPTIONS确认对端是RTSP服务，部分设备的OPTIONS也需要认证
+        await client.options(path)
+        result.update(describe_result(await client.describe(path)))
+
+    try:
+        await asyncio.wait_for(handshake(), timeout)
+    except asyncio.TimeoutError:
+        if client.connected:
+            result["error"] = "响应超时"
+        else:
+            result.update(status=UNREACHABLE, error="无法连接: 连接超时")
+    except (RTSPError, OSError, ValueError) as e:
+        result["error"] = str(e)
+    except Exception as e:
+        logger.error(f"RTSP探测 {ip}:{port} 时出错: {e}")
+        result["error"] = str(e)
+    finally:
+        await client.close()
+
+    result["healthy"] = result["status"] == HEALTHY
+    result["url"] = client.url(path)
+    result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+async def probe_rtsp_many(devices: Iterable[Tuple[Hashable, str, int, Optional[str], Optional[str]]],
+                          path: str = channel_path(), timeout: float = DEFAULT_RTSP_TIMEOUT,
+                          concurrency: int = DEFAULT_RTSP_CONCURRENCY) -> Dict[Hashable, Dict[str, Any]]:
+    """
+    并发探测多台设备
+    devices为(键, IP, 端口, 用户名, 密码)序列，返回 键 -> probe_rtsp的结果
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe_one(key: Hashable, ip: str, port: int, username: Optional[str],
+                        password: Optional[str]) -> Tuple[Hashable, Dict[str, Any]]:
+        async with semaphore:
+            return key, await probe_rtsp(ip, port or 554, username, password, path, timeout)
+
+    results = await asyncio.gather(*(probe_one(*device) for device in devices))
+    return dict(results)
+
+
+async def probe_channels(ip: str, port: int = 554, username: Optional[str] = None, password: Optional[str] = None,
+                         paths: Iterable[str] = (channel_path(),),
+                         timeout: float = DEFAULT_RTSP_TIMEOUT) -> Dict[str, Dict[str, Any]]:
+    """
+    在同一个RTSP控制连接上依次DESCRIBE多个通道路径，返回 路径 -> {status, healthy, url, rtsp_status, video, audio, error}
+    认证只协商一次；认证失败后不再请求其余通道（避免触发设备的账号锁定）；
+    部分NVR在错误响应后会关闭连接，此时重连一次后继续
+    整台设备共用一个总时限：timeout，每CHANNELS_PER_TIMEOUT个通道路径再加一个timeout；超时后未完成的通道记为超时
+    """
+    paths = list(paths)
+    client = RTSPClient(ip, port, username, password, timeout)
+    results: Dict[str, Dict[str, Any]] = {}
+    deadline = timeout * (1 + len(paths) / CHANNELS_PER_TIMEOUT)
+
+    def finish(path: str, result: Dict[str, Any]):
+        result["healthy"] = result["status"] == HEALTHY
+        result["url"] = client.url(path)
+        results[path] = result
+
+    def fail_remaining(status: str, error: str):
+        for path in paths:
+            if path not in results:
+                finish(path, {"status": status, "rtsp_status": None, "video": None, "audio": None, "error": error})
+
+    async def sweep():
+        try:
+            await client.connect()
+        except (asyncio.TimeoutError, OSError) as e:
+            fail_remaining(UNREACHABLE, f"无法连接: {e or '连接超时'}")
+            return
+
+        for path in paths:
+            for attempt in (0, 1):
+                try:
+                    result = describe_result(await client.describe(path))
+                    break
+                except (asyncio.TimeoutError, RTSPError, OSError) as e:
+                    if attempt:
+                        result = {"status": PROTOCOL_ERROR, "rtsp_status": None, "video": None, "audio": None,
+                                  "error": str(e) or "响应超时"}
+                    else:
+                        await client.close()
+                        try:
+                            await client.connect()
+                        except (asyncio.TimeoutError, OSError) as e:
+                            fail_remaining(UNREACHABLE, f"重新连接失败: {e or '连接超时'}")
+                            return
+            finish(path, result)
+            if result["status"] == AUTH_FAILED:
+                fail_remaining(AUTH_FAILED, result["error"])
+                break
+
+    try:
+        await asyncio.wait_for(sweep(), deadline)
+    except asyncio.TimeoutError:
+        if results or client.connected:
+            fail_remaining(PROTOCOL_ERROR, "响应超时")
+        else:
+            fail_remaining(UNREACHABLE, "无法连接: 连接超时")
+    except Exception as e:
+        logger.error(f"RTSP通道探测 {ip}:{port} 时出错: {e}")
+        fail_remaining(PROTOCOL_ERROR, str(e))
+    finally:
+        await client.close()
+    return results
+
+
+async def probe_channels_many(devices: Iterable[Tuple[Hashable, str, int, Optional[str], Optional[str], List[str]]],
+                              timeout: float = DEFAULT_RTSP_TIMEOUT,
+                              concurrency: int = DEFAULT_RTSP_CONCURRENCY) -> Dict[Hashable, Dict[str, Dict[str, Any]]]:
+    """
+    并发探测多台NVR的通道，每台设备一个控制连接
+    devices为(键, IP, 端口, 用户名, 密码, 通道路径列表)序列，返回 键 -> {路径: 结果}
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe_one(key: Hashable, ip: str, port: int, username: Optional[str], password: Optional[str],
+                        paths: List[str]) -> Tuple[Hashable, Dict[str, Dict[str, Any]]]:
+        async with semaphore:
+            return key, await probe_channels(ip, port or 554, username, password, paths, timeout)
+
+    results = await asyncio.gather(*(probe_one(*device) for device in devices))
+    return dict(results)
@@ -0,0 +1,71 @@
+"""
+设备统计缓存模块
+设备统计由一次GROUP BY查询生成后缓存一小段时间，仪表盘和页面的轮询直接命中缓存；
+设备状态写回产生变化或设备增删改时立即失效，下一次请求重新查询
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATS_TTL = 5.0  # 统计结果的缓存时间（秒）
+
+
+class StatsCache:
+    """单值TTL缓存，并发未命中只查询一次；加载期间被失效的结果不写入缓存"""
+
+    def __init__(self, loader: Callable[[], Awaitable[Dict[str, Any]]], ttl: float = DEFAULT_STATS_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._expires_at = 0.0
+        self._version = 0
+        self._loading: Optional[asyncio.Future] = None
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self, *_: Any):
+        """使缓存失效（可在任意线程调用，也可直接注册为状态写回的监听函数）"""
+        self._version += 1
+        self._value = None
+        self.invalidations += 1
+
+    async def get(self) -> Dict[str, Any]:
+        """返回缓存的统计结果，过期或失效时重新加载"""
+        if self._value is not None and time.time() < self._expires_at:
+            self.hits += 1
+            return self._value
+
+        if self._loading is not None and not self._loading.done():
+            self.hits += 1
+            return await asyncio.shield(self._loading)
+
+        self.misses += 1
+        version = self._version
+        self._loading = asyncio.ensure_future(self.loader())
+        try:
+            value = await asyncio.shield(self._loading)
+        finally:
+            self._loading = None
+        if version == self._version:
+            self._value = value
+            self._expires_at = time.time() + self.ttl
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "cached": self._value is not None and time.time() < self._expires_at,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0
+        }
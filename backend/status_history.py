@@ -0,0 +1,263 @@
+"""
+设备状态历史模块
+维护只追加的状态变化日志，以及按分钟/小时/天汇总的在线时长表：
+每次写回检查结果时，把设备从上次检查到本次检查之间的时长按上次检查的状态计入对应时间桶，
+在线率查询按时间范围优先使用天表，首尾不足一天的部分用小时表、分钟表补齐，避免扫描原始记录
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 汇总粒度 -> 表名，按从粗到细排列
+ROLLUP_TABLES = {
+    "day": "device_status_daily",
+    "hour": "device_status_hourly",
+    "minute": "device_status_minutely"
+}
+GRANULARITIES = ["day", "hour", "minute"]
+
+DEFAULT_MAX_GAP = 1800.0  # 相邻两次检查间隔超过该值（秒）时不计入时长，视为未监测
+DEFAULT_MINUTE_RETENTION_DAYS = 7  # 分钟汇总保留天数
+DEFAULT_HOUR_RETENTION_DAYS = 90  # 小时汇总保留天数（天汇总和状态变化日志长期保留）
+
+_schema_ready = False
+
+# 一次检查观测：(设备ID, 上次状态, 上次检查时间戳, 本次状态, 本次检查时间戳)
+Observation = Tuple[int, Optional[str], Optional[float], str, float]
+
+
+def ensure_history_schema(conn):
+    """创建状态变化日志和各粒度汇总表"""
+    global _schema_ready
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_status_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id INTEGER NOT NULL,
+            old_status TEXT,
+            new_status TEXT NOT NULL,
+            changed_at TIMESTAMP NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_log_device ON device_status_log (device_id, changed_at)")
+    for table in ROLLUP_TABLES.values():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id INTEGER NOT NULL,
+                bucket_start INTEGER NOT NULL,
+                online_seconds REAL DEFAULT 0,
+                offline_seconds REAL DEFAULT 0,
+                checks INTEGER DEFAULT 0,
+                PRIMARY KEY (device_id, bucket_start)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket_start)")
+    _schema_ready = True
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """把数据库中的ISO时间字符串转换为时间戳，无法解析时返回None"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def bucket_start(ts: float, granularity: str) -> int:
+    """时间戳所在时间桶的起点（按本地时间对齐）"""
+    if granularity == "minute":
+        return int(ts // 60 * 60)
+    dt = datetime.fromtimestamp(ts)
+    if granularity == "hour":
+        dt = dt.replace(minute=0, second=0, microsecond=0)
+    else:
+        dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(dt.timestamp())
+
+
+def bucket_end(start: int, granularity: str) -> int:
+    """时间桶的终点"""
+    if granularity == "minute":
+        return start + 60
+    if granularity == "hour":
+        return start + 3600
+    return int((datetime.fromtimestamp(start) + timedelta(days=1)).timestamp())
+
+
+def split_interval(t0: float, t1: float, granularity: str) -> Iterable[Tuple[int, float]]:
+    """把时间段按时间桶切分，生成 (时间桶起点, 落在该桶内的秒数)"""
+    t = t0
+    while t < t1:
+        start = bucket_start(t, granularity)
+        end = min(bucket_end(start, granularity), t1)
+        yield start, end - t
+        t = end
+
+
+def record_history(cursor, observations: List[Observation], max_gap: float = DEFAULT_MAX_GAP):
+    """
+    在写回检查结果的同一事务中更新状态历史
+    状态变化写入日志；上次检查到本次检查之间的时长按上次状态计入各粒度汇总表，本次检查计入检查次数
+    """
+    if not _schema_ready:
+        ensure_history_schema(cursor.connection)
+
+    log_rows = []
+    rollups: Dict[str, Dict[Tuple[int, int], List[float]]] = {g: {} for g in GRANULARITIES}
+
+    for device_id, old_status, last_ts, new_status, now_ts in observations:
+        if old_status != new_status:
+            log_rows.append((device_id, old_status, new_status, datetime.fromtimestamp(now_ts).isoformat()))
+
+        for granularity in GRANULARITIES:
+            buckets = rollups[granularity]
+            bucket = buckets.setdefault((device_id, bucket_start(now_ts, granularity)), [0.0, 0.0, 0])
+            bucket[2] += 1
+
+            if last_ts is None or now_ts <= last_ts or now_ts - last_ts > max_gap:
+                continue
+            index = 0 if old_status == "online" else 1
+            for start, seconds in split_interval(last_ts, now_ts, granularity):
+                bucket = buckets.setdefault((device_id, start), [0.0, 0.0, 0])
+                bucket[index] += seconds
+
+    if log_rows:
+        cursor.executemany(
+            "INSERT INTO device_status_log (device_id, old_status, new_status, changed_at) VALUES (?, ?, ?, ?)",
+            log_rows
+        )
+    for granularity, buckets in rollups.items():
+        cursor.executemany(
+            f'''
+            INSERT INTO {ROLLUP_TABLES[granularity]} (device_id, bucket_start, online_seconds, offline_seconds, checks)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (device_id, bucket_start) DO UPDATE SET
+                online_seconds = online_seconds + excluded.online_seconds,
+                offline_seconds = offline_seconds + excluded.offline_seconds,
+                checks = checks + excluded.checks
+            ''',
+            [(device_id, start, online, offline, checks) for (device_id, start), (online, offline, checks) in buckets.items()]
+        )
+
+
+def prune_history(conn, minute_retention_days: int = DEFAULT_MINUTE_RETENTION_DAYS,
+                  hour_retention_days: int = DEFAULT_HOUR_RETENTION_DAYS) -> int:
+    """删除超过保留期的分钟和小时汇总，返回删除的行数"""
+    if not _schema_ready:
+        ensure_history_schema(conn)
+    now = datetime.now().timestamp()
+    cursor = conn.cursor()
+    deleted = 0
+    for granularity, days in (("minute", minute_retention_days), ("hour", hour_retention_days)):
+        cursor.execute(f"DELETE FROM {ROLLUP_TABLES[granularity]} WHERE bucket_start < ?", (int(now - days * 86400),))
+        deleted += cursor.rowcount
+    conn.commit()
+    return deleted
+
+
+def cover_range(start: float, end: float, granularities: List[str] = GRANULARITIES) -> List[Tuple[str, int, int]]:
+    """
+    用尽量粗的时间桶覆盖查询范围，返回 (粒度, 起点, 终点) 列表
+    完整的天用天表，首尾剩余部分依次用小时表、分钟表（分钟表按整分钟取整）
+    """
+    if start >= end:
+        return []
+    granularity = granularities[0]
+    if len(granularities) == 1:
+        return [(granularity, bucket_start(start, granularity), int(end))]
+
+    first = bucket_start(start, granularity)
+    if first < start:
+        first = bucket_end(first, granularity)
+    last = bucket_start(end, granularity)
+    if first >= last:
+        return cover_range(start, end, granularities[1:])
+    return (cover_range(start, first, granularities[1:]) + [(granularity, first, last)]
+            + cover_range(last, end, granularities[1:]))
+
+
+def query_uptime(conn, start: datetime, end: datetime, device_id: Optional[int] = None) -> Dict[int, Dict[str, float]]:
+    """查询时间范围内每台设备的在线/离线时长和检查次数，返回 设备ID -> 汇总"""
+    if not _schema_ready:
+        ensure_history_schema(conn)
+    cursor = conn.cursor()
+    totals: Dict[int, Dict[str, float]] = {}
+    for granularity, segment_start, segment_end in cover_range(start.timestamp(), end.timestamp()):
+        sql = f'''
+            SELECT device_id, SUM(online_seconds), SUM(offline_seconds), SUM(checks)
+            FROM {ROLLUP_TABLES[granularity]}
+            WHERE bucket_start >= ? AND bucket_start < ?
+        '''
+        params: List[Any] = [segment_start, segment_end]
+        if device_id is not None:
+            sql += " AND device_id = ?"
+            params.append(device_id)
+        cursor.execute(sql + " GROUP BY device_id", params)
+        for row_device_id, online, offline, checks in cursor.fetchall():
+            total = totals.setdefault(row_device_id, {"online_seconds": 0.0, "offline_seconds": 0.0, "checks": 0})
+            total["online_seconds"] += online or 0
+            total["offline_seconds"] += offline or 0
+            total["checks"] += checks or 0
+    return totals
+
+
+def query_series(conn, device_id: int, start: datetime, end: datetime, granularity: str) -> List[Dict[str, Any]]:
+    """查询单台设备在指定粒度下的时间桶序列"""
+    if not _schema_ready:
+        ensure_history_schema(conn)
+    cursor = conn.cursor()
+    cursor.execute(
+        f'''
+        SELECT bucket_start, online_seconds, offline_seconds, checks FROM {ROLLUP_TABLES[granularity]}
+        WHERE device_id = ? AND bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+        ''',
+        (device_id, bucket_start(start.timestamp(), granularity), int(end.timestamp()))
+    )
+    return [
+        {
+            "bucket_start": datetime.fromtimestamp(row[0]).isoformat(),
+            "online_seconds": round(row[1], 1),
+            "offline_seconds": round(row[2], 1),
+            "checks": row[3]
+        }
+        for row in cursor.fetchall()
+    ]
+
+
+def query_transitions(conn, device_id: int, start: datetime, end: datetime, limit: int = 500) -> List[Dict[str, Any]]:
+    """查询单台设备在时间范围内的状态变化记录"""
+    if not _schema_ready:
+        ensure_history_schema(conn)
+    cursor = conn.cursor()
+    cursor.execute(
+        '''
+        SELECT old_status, new_status, changed_at FROM device_status_log
+        WHERE device_id = ? AND changed_at >= ? AND changed_at < ?
+        ORDER BY changed_at DESC LIMIT ?
+        ''',
+        (device_id, start.isoformat(), end.isoformat(), limit)
+    )
+    return [{"old_status": row[0], "new_status": row[1], "changed_at": row[2]} for row in cursor.fetchall()]
+
+
+def summarize(total: Dict[str, float], start: datetime, end: datetime, devices: int = 1) -> Dict[str, Any]:
+    """计算在线率和未监测时长（多台设备汇总时未监测时长按设备数累计）"""
+    online = total.get("online_seconds", 0.0)
+    offline = total.get("offline_seconds", 0.0)
+    observed = online + offline
+    return {
+        "online_seconds": round(online, 1),
+        "offline_seconds": round(offline, 1),
+        "unknown_seconds": round(max(0.0, (end - start).total_seconds() * devices - observed), 1),
+        "checks": int(total.get("checks", 0)),
+        "uptime_rate": round(online / observed * 100, 2) if observed else None
+    }
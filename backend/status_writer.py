@@ -0,0 +1,174 @@
+"""
+设备状态批量写回模块
+检查结果先进入缓冲区，每个检查周期在同一个连接、同一个事务中用executemany写回：
+先批量读取当前状态做变化检测，状态未变化的设备只更新检查时间和计数，
+避免逐台设备打开连接、逐条提交带来的fsync风暴和对API读请求的写锁争用；
+状态变化日志和在线时长汇总（backend/status_history.py）在同一事务中更新
+"""
+
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.status_history import DEFAULT_MAX_GAP, parse_timestamp, record_history
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+SELECT_CHUNK_SIZE = 500  # 单条IN查询的参数个数上限（SQLite默认限制为999）
+
+# 状态变化：更新状态和检查信息，在线设备同时更新最后在线时间
+CHANGED_ONLINE_SQL = "UPDATE devices SET status = 'online', last_seen = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?"
+CHANGED_OFFLINE_SQL = "UPDATE devices SET status = 'offline', last_check = ?, check_count = check_count + 1 WHERE id = ?"
+# 状态未变化：不改写status列，只更新检查时间和计数
+UNCHANGED_ONLINE_SQL = "UPDATE devices SET last_seen = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?"
+UNCHANGED_OFFLINE_SQL = "UPDATE devices SET last_check = ?, check_count = check_count + 1 WHERE id = ?"
+
+# 状态变化记录：(设备ID, 原状态, 新状态)
+StatusChange = Tuple[int, Optional[str], str]
+
+
+def _current_statuses(cursor, device_ids: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    """分块批量读取设备当前状态和上次检查时间"""
+    statuses: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+    for index in range(0, len(device_ids), SELECT_CHUNK_SIZE):
+        chunk = device_ids[index:index + SELECT_CHUNK_SIZE]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT id, status, last_check FROM devices WHERE id IN ({placeholders})", chunk)
+        for device_id, status, last_check in cursor.fetchall():
+            statuses[device_id] = (status, last_check)
+    return statuses
+
+
+def write_statuses(conn, results: Dict[int, Tuple[bool, str]], max_gap: float = DEFAULT_MAX_GAP) -> List[StatusChange]:
+    """
+    在一个事务中写回一批检查结果并更新状态历史
+    results为 设备ID -> (是否在线, 检查时间ISO字符串)，返回状态发生变化的设备列表；
+    已删除的设备直接忽略
+    """
+    if not results:
+        return []
+
+    cursor = conn.cursor()
+    try:
+        statuses = _current_statuses(cursor, list(results))
+
+        changed_online, changed_offline = [], []
+        unchanged_online, unchanged_offline = [], []
+        changes: List[StatusChange] = []
+        observations = []
+        for device_id, (is_online, checked_at) in results.items():
+            if device_id not in statuses:
+                continue
+            old_status, last_check = statuses[device_id]
+            new_status = "online" if is_online else "offline"
+            observations.append((device_id, old_status, parse_timestamp(last_check), new_status,
+                                 parse_timestamp(checked_at)))
+            if old_status != new_status:
+                changes.append((device_id, old_status, new_status))
+                if is_online:
+                    changed_online.append((checked_at, checked_at, device_id))
+                else:
+                    changed_offline.append((checked_at, device_id))
+            elif is_online:
+                unchanged_online.append((checked_at, checked_at, device_id))
+            else:
+                unchanged_offline.append((checked_at, device_id))
+
+        for sql, rows in ((CHANGED_ONLINE_SQL, changed_online), (CHANGED_OFFLINE_SQL, changed_offline),
+                          (UNCHANGED_ONLINE_SQL, unchanged_online), (UNCHANGED_OFFLINE_SQL, unchanged_offline)):
+            if rows:
+                cursor.executemany(sql, rows)
+        record_history(cursor, observations, max_gap)
+        conn.commit()
+        return changes
+    except Exception:
+        conn.rollback()
+        raise
+
+
+class StatusWriteBuffer:
+    """
+    线程安全的状态写回缓冲区
+    各检查器把结果add进来，由flush统一写回；同一设备在一次flush前多次检查时只保留最新结果
+    """
+
+    def __init__(self, get_connection: Callable, max_gap: float = DEFAULT_MAX_GAP):
+        self.get_connection = get_connection
+        self.max_gap = max_gap
+        self._listeners: List[Callable[[List[StatusChange]], None]] = []
+        self._pending: Dict[int, Tuple[bool, str]] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # 统计信息
+        self.flushes = 0
+        self.rows_written = 0
+        self.status_changes = 0
+        self.last_flush_size = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def add_listener(self, listener: Callable[[List[StatusChange]], None]):
+        """注册状态变化监听函数，写回后有设备状态变化时在写回所在线程中调用"""
+        self._listeners.append(listener)
+
+    def add(self, device_id: int, is_online: bool, checked_at: Optional[str] = None):
+        """加入一条检查结果"""
+        checked_at = checked_at or datetime.now().isoformat()
+        with self._lock:
+            self._pending[device_id] = (bool(is_online), checked_at)
+
+    def add_many(self, results: Dict[int, bool], checked_at: Optional[str] = None):
+        """加入一批检查结果（同一检查时间）"""
+        checked_at = checked_at or datetime.now().isoformat()
+        with self._lock:
+            for device_id, is_online in results.items():
+                self._pending[device_id] = (bool(is_online), checked_at)
+
+    def flush(self) -> List[StatusChange]:
+        """把缓冲区内的结果在一个事务中写回，返回状态发生变化的设备列表；写入失败时结果放回缓冲区"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return []
+
+            try:
+                conn = self.get_connection()
+                try:
+                    changes = write_statuses(conn, pending, self.max_gap)
+                finally:
+                    conn.close()
+            except Exception:
+                with self._lock:
+                    # 写入失败期间产生的更新结果优先
+                    pending.update(self._pending)
+                    self._pending = pending
+                raise
+
+            self.flushes += 1
+            self.rows_written += len(pending)
+            self.status_changes += len(changes)
+            self.last_flush_size = len(pending)
+            for device_id, old_status, new_status in changes:
+                logger.debug(f"设备 {device_id} 状态变化: {old_status} -> {new_status}")
+            if changes:
+                for listener in self._listeners:
+                    try:
+                        listener(changes)
+                    except Exception as e:
+                        logger.error(f"状态变化监听函数执行失败: {e}")
+            return changes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "status_changes": self.status_changes,
+            "last_flush_size": self.last_flush_size
+        }
@@ -1,18 +1,43 @@
 import { defineStore } from 'pinia'
 import { ref } from 'vue'
+import Cookies from 'js-cookie'
 import api from '@/utils/api'
 
+// 设备列表按页拉取的每页数量
+const PAGE_SIZE = 500
+// 本地设备列表需要的字段：接口默认不返回密码，实时监控拼接RTSP地址需要密码，因此显式请求pwd
+const DEVICE_FIELDS = 'id,region,store,ip,port,user,pwd,chs,name,status,protocol,created_at'
+// 变更推送不可用时增量同步的轮询间隔（毫秒）
+const CHANGE_POLL_INTERVAL = 30000
+
 export const useDevicesStore = defineStore('devices', () => {
   const devices = ref([])
   const regions = ref([])
   const loading = ref(false)
+  // 已同步到的设备变更版本，之后只拉取该版本之后变化的设备
+  const version = ref(null)
+
+  // 按服务端筛选条件获取一页设备，返回 { items, next_cursor }
+  const fetchDevicePage = async (params = {}) => {
+    const response = await api.get('/devices', { params: { limit: PAGE_SIZE, ...params } })
+    return response.data
+  }
 
   const fetchDevices = async () => {
   loading.value = true
   try {
-    // 直接获取设备数据，依赖路由守卫的认证检查
-    const response = await api.get('/devices')
-    devices.value = response.data
+    // 直接获取设备数据，依赖路由守卫的认证检查；按游标逐页拉取
+    // 先记录当前变更版本，加载期间发生的变化由之后的增量同步补齐
+    const { data: start } = await api.get('/devices/changes')
+    const items = []
+    let cursor = null
+    do {
+      const page = await fetchDevicePage({ fields: DEVICE_FIELDS, ...(cursor ? { cursor } : {}) })
+      items.push(...page.items)
+      cursor = page.next_cursor
+    } while (cursor)
+    devices.value = items
+    version.value = start.latest_version
     console.log('成功获取设备数据:', devices.value.length, '个设备')
   } catch (error) {
     console.error('获取设备列表失败:', error)
@@ -25,6 +50,107 @@ export const useDevicesStore = defineStore('devices', () => {
   }
 }
 
+  // 把增量同步结果合并到本地列表
+  const applyChanges = ({ changes = [], deleted = [] }) => {
+    if (deleted.length) {
+      const removed = new Set(deleted)
+      devices.value = devices.value.filter(device => !removed.has(device.id))
+    }
+    if (changes.length) {
+      const indexById = new Map(devices.value.map((device, index) => [device.id, index]))
+      for (const change of changes) {
+        const index = indexById.get(change.id)
+        if (index === undefined) {
+          devices.value.unshift(change)
+        } else {
+          devices.value[index] = { ...devices.value[index], ...change }
+        }
+      }
+    }
+  }
+
+  // 拉取上次同步之后变化的设备，返回本次合并的变化 { changes, deleted }
+  const syncChanges = async () => {
+    if (version.value === null) {
+      await fetchDevices()
+      return { changes: [], deleted: [] }
+    }
+    const merged = { changes: [], deleted: [] }
+    let since = version.value
+    let page
+    do {
+      const response = await api.get('/devices/changes', { params: { since, fields: DEVICE_FIELDS } })
+      page = response.data
+      if (page.latest_version < version.value) {
+        // 服务端版本回退（数据库重建），重新全量加载
+        await fetchDevices()
+        return merged
+      }
+      applyChanges(page)
+      merged.changes.push(...page.changes)
+      merged.deleted.push(...page.deleted)
+      since = page.next_since
+    } while (page.has_more)
+    version.value = since
+    return merged
+  }
+
+  // 订阅设备变更推送（Server-Sent Events），推送不可用时退回定时增量同步；返回取消订阅函数
+  const subscribeChanges = (onChanges) => {
+    let source = null
+    let timer = null
+
+    const startPolling = () => {
+      if (timer) return
+      timer = setInterval(async () => {
+        try {
+          const merged = await syncChanges()
+          if (merged.changes.length || merged.deleted.length) {
+            onChanges?.(merged)
+          }
+        } catch (error) {
+          console.error('增量同步设备失败:', error)
+        }
+      }, CHANGE_POLL_INTERVAL)
+    }
+
+    if (typeof EventSource === 'undefined' || version.value === null) {
+      startPolling()
+    } else {
+      const params = new URLSearchParams({
+        since: version.value,
+        fields: DEVICE_FIELDS,
+        token: Cookies.get('token') || ''
+      })
+      source = new EventSource(`/api/devices/changes/stream?${params}`)
+      source.addEventListener('changes', (event) => {
+        const page = JSON.parse(event.data)
+        applyChanges(page)
+        version.value = page.next_since
+        onChanges?.(page)
+      })
+      source.onerror = () => {
+        // 连接被拒绝（如令牌失效）时浏览器不再重连，改为轮询
+        if (source.readyState === EventSource.CLOSED) {
+          console.warn('设备变更推送已断开，改为定时增量同步')
+          source = null
+          startPolling()
+        }
+      }
+    }
+
+    return () => {
+      if (source) {
+        source.close()
+        source = null
+      }
+      if (timer) {
+        clearInterval(timer)
+        timer = null
+      }
+    }
+  }
+
   const fetchRegions = async () => {
     try {
       const response = await api.get('/regions')
@@ -34,10 +160,27 @@ export const useDevicesStore = defineStore('devices', () => {
     }
   }
 
+  // 获取单个设备的完整信息（包含密码）
+  const fetchDevice = async (id) => {
+    const response = await api.get(`/devices/${id}`)
+    return response.data
+  }
+
+  // 用服务端的最新数据替换本地列表中的单个设备，不再重新拉取整个列表
+  const refreshDevice = async (id) => {
+    const device = await fetchDevice(id)
+    const index = devices.value.findIndex(d => d.id === id)
+    if (index === -1) {
+      devices.value.unshift(device)
+    } else {
+      devices.value[index] = device
+    }
+  }
+
   const addDevice = async (device) => {
     try {
       const response = await api.post('/import', device)
-      await fetchDevices()
+      await refreshDevice(response.data.device_id)
       return { success: true, data: response.data }
     } catch (error) {
       return { success: false, message: error.response?.data?.detail || '添加失败' }
@@ -47,7 +190,7 @@ export const useDevicesStore = defineStore('devices', () => {
   const updateDevice = async (id, device) => {
     try {
       await api.put(`/devices/${id}`, device)
-      await fetchDevices()
+      await refreshDevice(id)
       return { success: true }
     } catch (error) {
       return { success: false, message: error.response?.data?.detail || '更新失败' }
@@ -57,7 +200,7 @@ export const useDevicesStore = defineStore('devices', () => {
   const deleteDevice = async (id) => {
     try {
       await api.delete(`/devices/${id}`)
-      await fetchDevices()
+      devices.value = devices.value.filter(device => device.id !== id)
       return { success: true }
     } catch (error) {
       return { success: false, message: error.response?.data?.detail || '删除失败' }
@@ -76,7 +219,12 @@ export const useDevicesStore = defineStore('devices', () => {
     devices,
     regions,
     loading,
+    version,
     fetchDevices,
+    syncChanges,
+    subscribeChanges,
+    fetchDevicePage,
+    fetchDevice,
     fetchRegions,
     addDevice,
     updateDevice,
@@ -2,6 +2,7 @@
 """
 设备状态检测工具
 用于检测监控设备的在线状态
+交互式的一次性检查工具，适合后端未启动时核对设备连通性；持续监控由后端的 backend/health_scheduler.py 负责
 """
 
 import requests
@@ -12,6 +13,13 @@ import logging
 from datetime import datetime
 import subprocess
 import socket
+import os
+import sys
+
+# 添加项目根目录到路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from backend.status_writer import StatusWriteBuffer
 
 # 配置日志
 logging.basicConfig(
@@ -29,6 +37,8 @@ class DeviceStatusChecker:
     def __init__(self):
         self.running = False
         self.check_interval = 30  # 每30秒检查一次
+        # 检查结果先写入缓冲区，每轮检查在一个事务中写回
+        self.status_buffer = StatusWriteBuffer(lambda: sqlite3.connect(DB_PATH))
         
     def check_device_online(self, ip, port=554):
         """检测设备是否在线"""
@@ -59,17 +69,15 @@ class DeviceStatusChecker:
             return False
     
     def update_device_status(self, device_id, status):
-        """更新设备状态到数据库"""
+        """记录设备状态，由flush_status_updates统一写回数据库"""
+        self.status_buffer.add(device_id, status == "online")
+    
+    def flush_status_updates(self):
+        """把本轮检查结果在一个事务中写回数据库"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE devices SET status = ? WHERE id = ?",
-                (status, device_id)
-            )
-            conn.commit()
-            conn.close()
-            logging.info(f"设备 {device_id} 状态更新为: {status}")
+            changes = self.status_buffer.flush()
+            for device_id, old_status, new_status in changes:
+                logging.info(f"设备 {device_id} 状态变化: {old_status} -> {new_status}")
         except Exception as e:
             logging.error(f"更新设备状态失败: {e}")
     
@@ -98,6 +106,8 @@ class DeviceStatusChecker:
             self.update_device_status(device_id, new_status)
             
             logging.info(f"设备 {name}({ip}) 状态: {new_status}")
+        
+        self.flush_status_updates()
     
     def start_monitoring(self):
         """开始监控设备状态"""
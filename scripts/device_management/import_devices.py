@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """
 设备批量导入工具
-支持从CSV文件批量导入监控设备到系统
+支持从CSV文件批量导入监控设备到系统；预检模式边读取CSV/XLSX边校验，
+并发探测设备可达性和RTSP认证，在写入任何数据之前生成机器可读的报告
 """
 
 import csv
@@ -13,9 +14,20 @@ import logging
 import traceback
 import time
 import argparse
-from typing import List, Dict, Optional, Any, Tuple, Type, Callable
+import asyncio
+import tempfile
+from collections import Counter
+from typing import List, Dict, Optional, Any, Tuple, Type, Callable, Iterator, TextIO
 import ipaddress
 
+# Excel读取（可选依赖，仅导入.xlsx文件时需要）
+OPENPYXL_AVAILABLE = False
+try:
+    import openpyxl
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    openpyxl = None
+
 # 设置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -30,6 +42,21 @@ logger = logging.getLogger(__name__)
 # 添加项目根目录到Python路径以便导入自定义模块
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
 
+from backend.rtsp_probe import (
+    DEFAULT_RTSP_CONCURRENCY,
+    DEFAULT_RTSP_TIMEOUT,
+    HEALTHY,
+    NO_STREAM,
+    channel_path,
+    probe_rtsp
+)
+
+DEFAULT_CHUNK_SIZE = 1000  # 批量模式每次提交的设备数
+MAX_CHUNK_SIZE = 5000  # 服务端单次批量导入的设备数上限
+REQUIRED_COLUMNS = ['IP地址', '用户名', '密码']
+# 预检通过的探测结果：设备可达且RTSP认证通过（no_stream表示第1通道主码流不存在，账号密码仍然正确）
+PREFLIGHT_PASS_STATUSES = (HEALTHY, NO_STREAM)
+
 
 class DeviceImportError(Exception):
     """设备导入过程中的基础异常"""
@@ -157,6 +184,256 @@ class DeviceImporter:
         except requests.RequestException as e:
             raise NetworkError(f"网络请求异常: {str(e)}") from e
     
+    def import_bulk(self, devices: List[Dict[str, Any]], update_existing: bool = True,
+                    dry_run: bool = False) -> Dict[str, Any]:
+        """
+        通过批量接口导入一批设备，服务端在一个事务中按IP新增或更新
+        
+        Args:
+            devices: 设备信息字典列表
+            update_existing: IP已存在时是否更新设备（否则跳过）
+            dry_run: 是否仅由服务端校验而不实际写入
+            
+        Returns:
+            Dict: API返回结果，results中每一行对应devices中的一个设备（index为序号）
+            
+        Raises:
+            NetworkError: 网络连接异常
+            APIError: API返回错误
+        """
+        try:
+            logger.info(f"批量导入 {len(devices)} 台设备")
+            response = self.session.post(
+                f'{self.api_url}/devices/bulk',
+                json={'devices': devices, 'update_existing': update_existing, 'dry_run': dry_run},
+                timeout=self.timeout,
+                verify=self.verify_ssl
+            )
+            
+            if response.status_code != 200:
+                raise APIError(f"批量导入失败: HTTP {response.status_code} - {response.text}")
+            
+            try:
+                return response.json()
+            except json.JSONDecodeError as e:
+                raise APIError(f"响应数据不是有效的JSON格式: {str(e)}") from e
+                
+        except requests.RequestException as e:
+            raise NetworkError(f"网络请求异常: {str(e)}") from e
+    
+    @staticmethod
+    def row_to_device(row: Dict[str, str]) -> Dict[str, Any]:
+        """
+        CSV行转换为设备信息字典
+        
+        Raises:
+            ValueError: 端口或通道数不是数字
+            KeyError: 缺少必需列
+        """
+        return {
+            'region': row.get('区域', '默认区域'),
+            'store': row.get('门店', '默认门店'),
+            'ip': row['IP地址'],
+            'port': int(row.get('端口', 554)),
+            'user': row['用户名'],
+            'pwd': row['密码'],
+            'chs': int(row.get('通道数', 1)),
+            'name': row.get('设备名称', f"{row.get('区域', '默认区域')}-{row.get('门店', '默认门店')}-{row['IP地址']}")
+        }
+    
+    def _flush_chunk(self, chunk: List[Tuple[int, Dict[str, Any]]], results: Dict[str, Any],
+                     update_existing: bool, dry_run: bool):
+        """提交一批设备到批量接口，并把每一行的结果合并到导入结果统计"""
+        try:
+            response = self.import_bulk([device for _, device in chunk], update_existing, dry_run)
+        except DeviceImportError as e:
+            # 整批失败（网络或服务端错误），该批所有行记为失败
+            results['failed'] += len(chunk)
+            for row_num, device in chunk:
+                results['details'].append({'row': row_num, 'status': 'error', 'device': device, 'error': str(e)})
+            logger.error(f"第{chunk[0][0]}-{chunk[-1][0]}行: 批量导入失败 - {e}")
+            return
+        
+        for result in response.get('results', []):
+            row_num, device = chunk[result['index']]
+            outcome = result['status']
+            if outcome == 'error':
+                results['failed'] += 1
+                error_msg = '; '.join(result.get('errors') or ['未知错误'])
+                results['details'].append({'row': row_num, 'status': 'error', 'device': device, 'error': error_msg})
+                logger.error(f"第{row_num}行: 导入失败 - {error_msg}")
+            elif outcome == 'skipped':
+                results['skipped'] += 1
+                results['details'].append({'row': row_num, 'status': 'skipped', 'device': device,
+                                           'error': 'IP地址已存在'})
+            else:
+                results['success'] += 1
+                results['details'].append({'row': row_num, 'status': 'dry_run' if dry_run else 'success',
+                                           'device': device, 'result': result})
+        logger.info(f"第{chunk[0][0]}-{chunk[-1][0]}行: {response.get('summary')}")
+    
+    async def _preflight(self, source_file: str, report: TextIO, spool: TextIO, concurrency: int,
+                         timeout: float) -> Counter:
+        """
+        边读取边校验，校验通过的设备交给固定数量的探测协程并发做RTSP握手
+        队列有界，读取速度受探测速度限制，内存占用与文件大小无关；
+        每行的结果立即写入报告，预检通过的设备写入暂存文件供提交阶段使用
+        """
+        counts: Counter = Counter()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        
+        def write_row(record: Dict[str, Any]):
+            report.write(json.dumps({'type': 'row', **record}, ensure_ascii=False) + '\n')
+        
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                row_num, device = item
+                result = await probe_rtsp(device['ip'], device['port'], device['user'], device['pwd'],
+                                          channel_path(), timeout)
+                passed = result['status'] in PREFLIGHT_PASS_STATUSES
+                counts[result['status']] += 1
+                counts['passed' if passed else 'failed'] += 1
+                write_row({
+                    'row': row_num,
+                    'ip': device['ip'],
+                    'port': device['port'],
+                    'name': device['name'],
+                    'status': result['status'],
+                    'passed': passed,
+                    'rtsp_status': result['rtsp_status'],
+                    'latency_ms': result['latency_ms'],
+                    'video': result['video'],
+                    'error': result['error']
+                })
+                if passed:
+                    spool.write(json.dumps([row_num, device], ensure_ascii=False) + '\n')
+                else:
+                    logger.warning(f"第{row_num}行: {device['ip']}:{device['port']} 预检未通过 - "
+                                   f"{result['status']} {result['error'] or ''}")
+        
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        try:
+            for row_num, row in iter_device_rows(source_file):
+                counts['total'] += 1
+                try:
+                    device = self.row_to_device(row)
+                    errors = self.validate_device_data(device)
+                except (ValueError, KeyError) as e:
+                    device, errors = None, [f"数据格式错误: {str(e)}"]
+                
+                if errors:
+                    counts['invalid'] += 1
+                    write_row({'row': row_num, 'ip': row.get('IP地址'), 'status': 'invalid', 'passed': False,
+                               'errors': errors})
+                    logger.warning(f"第{row_num}行: 数据验证失败: {'; '.join(errors)}")
+                    continue
+                await queue.put((row_num, device))
+            
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return counts
+    
+    def _commit_chunk(self, chunk: List[Tuple[int, Dict[str, Any]]], report: TextIO, counts: Counter,
+                      update_existing: bool):
+        """提交一批预检通过的设备，每一行的写入结果追加到报告"""
+        try:
+            response = self.import_bulk([device for _, device in chunk], update_existing)
+            outcomes = response.get('results', [])
+        except DeviceImportError as e:
+            logger.error(f"第{chunk[0][0]}-{chunk[-1][0]}行: 批量导入失败 - {e}")
+            outcomes = [{'index': index, 'status': 'error', 'device_id': None, 'errors': [str(e)]}
+                        for index in range(len(chunk))]
+        
+        for outcome in outcomes:
+            row_num, device = chunk[outcome['index']]
+            counts[outcome['status']] += 1
+            report.write(json.dumps({
+                'type': 'commit',
+                'row': row_num,
+                'ip': device['ip'],
+                'status': outcome['status'],
+                'device_id': outcome.get('device_id'),
+                'errors': outcome.get('errors') or []
+            }, ensure_ascii=False) + '\n')
+    
+    def preflight_import(self, source_file: str, report_file: str, commit: bool = False, strict: bool = False,
+                         concurrency: int = DEFAULT_RTSP_CONCURRENCY, timeout: float = DEFAULT_RTSP_TIMEOUT,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE, update_existing: bool = True) -> Dict[str, Any]:
+        """
+        预检导入：流式读取CSV/XLSX文件，校验每一行并并发探测设备可达性和RTSP认证，
+        把每一行的结果以JSON Lines写入报告文件；预检全部完成后才开始提交
+        
+        Args:
+            source_file: CSV或XLSX文件路径
+            report_file: 报告文件路径（每行一个JSON对象：type为row/commit/summary）
+            commit: 预检完成后是否通过批量接口导入预检通过的设备（需要先登录）
+            strict: 有任何一行未通过预检时不提交
+            concurrency: 同时探测的设备数
+            timeout: 单台设备的探测超时时间（秒）
+            chunk_size: 提交时每批的设备数
+            update_existing: IP已存在时是否更新设备（否则跳过）
+            
+        Returns:
+            Dict: 汇总信息（与报告最后一行相同）
+        
+        Raises:
+            FileNotFoundError: 文件未找到
+            ValidationError: 文件格式验证失败
+        """
+        if not os.path.exists(source_file):
+            raise FileNotFoundError(f"文件未找到: {source_file}")
+        
+        started = time.time()
+        logger.info(f"开始预检设备，文件: {source_file}，并发数: {concurrency}")
+        with open(report_file, 'w', encoding='utf-8') as report, \
+                tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+            counts = asyncio.run(self._preflight(source_file, report, spool, max(1, concurrency), timeout))
+            report.flush()
+            
+            blocked = strict and (counts['invalid'] or counts['failed'])
+            committed = commit and not blocked and counts['passed'] > 0
+            commit_counts: Counter = Counter()
+            if committed:
+                logger.info(f"预检完成，开始提交 {counts['passed']} 台设备")
+                spool.seek(0)
+                chunk: List[Tuple[int, Dict[str, Any]]] = []
+                for line in spool:
+                    row_num, device = json.loads(line)
+                    chunk.append((row_num, device))
+                    if len(chunk) >= chunk_size:
+                        self._commit_chunk(chunk, report, commit_counts, update_existing)
+                        chunk = []
+                if chunk:
+                    self._commit_chunk(chunk, report, commit_counts, update_existing)
+            elif commit and blocked:
+                logger.warning("严格模式下有未通过预检的行，未提交任何设备")
+            
+            summary = {
+                'type': 'summary',
+                'source': source_file,
+                'total': counts['total'],
+                'invalid': counts['invalid'],
+                'passed': counts['passed'],
+                'failed': counts['failed'],
+                'probe_statuses': {status: count for status, count in counts.items()
+                                   if status not in ('total', 'invalid', 'passed', 'failed')},
+                'committed': committed,
+                'commit': dict(commit_counts),
+                'elapsed_seconds': round(time.time() - started, 2)
+            }
+            report.write(json.dumps(summary, ensure_ascii=False) + '\n')
+        
+        logger.info(f"预检完成 - 总计: {summary['total']}, 通过: {summary['passed']}, "
+                    f"未通过: {summary['failed']}, 数据无效: {summary['invalid']}，报告: {report_file}")
+        return summary
+    
     def validate_device_data(self, device: Dict[str, Any]) -> List[str]:
         """
         验证设备数据格式
@@ -202,13 +479,17 @@ class DeviceImporter:
         
         return errors
     
-    def import_from_csv(self, csv_file: str, dry_run: bool = False) -> Dict[str, Any]:
+    def import_from_csv(self, csv_file: str, dry_run: bool = False, bulk: bool = False,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE, update_existing: bool = True) -> Dict[str, Any]:
         """
         从CSV文件导入设备
         
         Args:
             csv_file: CSV文件路径
-            dry_run: 是否仅进行测试而不实际导入
+            dry_run: 是否仅进行测试而不实际导入（批量模式下由服务端校验）
+            bulk: 是否使用批量接口，边读取边按chunk_size分批提交，每批在服务端一个事务中写入
+            chunk_size: 批量模式每批的设备数
+            update_existing: 批量模式下IP已存在时是否更新设备（否则跳过）
             
         Returns:
             Dict: 导入结果统计
@@ -242,23 +523,15 @@ class DeviceImporter:
                 if missing_fields:
                     raise ValidationError(f"CSV文件缺少必需字段: {missing_fields}")
                 
-                logger.info(f"开始从CSV文件导入设备，文件: {csv_file}")
+                logger.info(f"开始从CSV文件导入设备，文件: {csv_file}{'（批量模式）' if bulk else ''}")
+                chunk: List[Tuple[int, Dict[str, Any]]] = []
                 
                 for row_num, row in enumerate(reader, start=2):  # 从第2行开始计数（因为第1行是标题）
                     results['total'] += 1
                     
                     try:
                         # 构建设备信息字典
-                        device = {
-                            'region': row.get('区域', '默认区域'),
-                            'store': row.get('门店', '默认门店'),
-                            'ip': row['IP地址'],
-                            'port': int(row.get('端口', 554)),
-                            'user': row['用户名'],
-                            'pwd': row['密码'],
-                            'chs': int(row.get('通道数', 1)),
-                            'name': row.get('设备名称', f"{row.get('区域', '默认区域')}-{row.get('门店', '默认门店')}-{row['IP地址']}")
-                        }
+                        device = self.row_to_device(row)
                         
                         # 验证设备数据
                         validation_errors = self.validate_device_data(device)
@@ -274,6 +547,14 @@ class DeviceImporter:
                             logger.warning(f"第{row_num}行: {error_msg}")
                             continue
                         
+                        # 批量模式：攒够一批后提交
+                        if bulk:
+                            chunk.append((row_num, device))
+                            if len(chunk) >= chunk_size:
+                                self._flush_chunk(chunk, results, update_existing, dry_run)
+                                chunk = []
+                            continue
+                        
                         # 执行导入或仅模拟
                         if dry_run:
                             results['success'] += 1
@@ -317,6 +598,9 @@ class DeviceImporter:
                         })
                         logger.error(f"第{row_num}行: 导入失败 - {error_msg}")
                         logger.debug(traceback.format_exc())
+                
+                if chunk:
+                    self._flush_chunk(chunk, results, update_existing, dry_run)
                         
         except UnicodeDecodeError as e:
             raise ValidationError(f"文件编码错误，请确保使用UTF-8编码: {str(e)}") from e
@@ -325,6 +609,54 @@ class DeviceImporter:
         return results
 
 
+def iter_device_rows(filename: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """
+    逐行读取CSV或XLSX设备文件（XLSX使用只读模式，不把整个文件载入内存），返回 (行号, 列名 -> 值)
+    
+    Raises:
+        ValidationError: 缺少列标题或必需列、文件编码错误、缺少openpyxl
+    """
+    if filename.lower().endswith('.xlsx'):
+        if not OPENPYXL_AVAILABLE:
+            raise ValidationError("读取XLSX文件需要安装openpyxl: pip install openpyxl")
+        workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows, None)
+            fieldnames = [str(name).strip() if name is not None else '' for name in header or ()]
+            missing_fields = [field for field in REQUIRED_COLUMNS if field not in fieldnames]
+            if not fieldnames or missing_fields:
+                raise ValidationError(f"XLSX文件缺少必需字段: {missing_fields or REQUIRED_COLUMNS}")
+            
+            for row_num, values in enumerate(rows, start=2):
+                if not values or all(value is None for value in values):
+                    continue
+                row = {}
+                for name, value in zip(fieldnames, values):
+                    if isinstance(value, float) and value.is_integer():
+                        value = int(value)  # 端口、通道数在Excel中是数字
+                    if name and value is not None:
+                        row[name] = str(value).strip()
+                yield row_num, row
+        finally:
+            workbook.close()
+        return
+    
+    try:
+        with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            if reader.fieldnames is None:
+                raise ValidationError("CSV文件格式错误：缺少列标题")
+            missing_fields = [field for field in REQUIRED_COLUMNS if field not in reader.fieldnames]
+            if missing_fields:
+                raise ValidationError(f"CSV文件缺少必需字段: {missing_fields}")
+            
+            for row_num, row in enumerate(reader, start=2):
+                yield row_num, {name: value for name, value in row.items() if name and value not in (None, '')}
+    except UnicodeDecodeError as e:
+        raise ValidationError(f"文件编码错误，请确保使用UTF-8编码: {str(e)}") from e
+
+
 def create_sample_csv(filename: str):
     """
     创建示例CSV文件
@@ -382,12 +714,25 @@ def main():
     """主函数"""
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='设备批量导入工具')
-    parser.add_argument('csv_file', nargs='?', help='CSV文件路径')
+    parser.add_argument('csv_file', nargs='?', help='CSV文件路径（预检模式也支持XLSX）')
     parser.add_argument('--api-url', default='http://localhost:8000', help='API服务地址 (默认: http://localhost:8000)')
     parser.add_argument('--username', help='登录用户名')
     parser.add_argument('--password', help='登录密码')
     parser.add_argument('--create-sample', action='store_true', help='创建示例CSV文件')
     parser.add_argument('--dry-run', action='store_true', help='仅进行测试而不实际导入')
+    parser.add_argument('--bulk', action='store_true', help='使用批量接口分批导入（IP已存在时更新设备）')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f'批量模式每批的设备数 (默认: {DEFAULT_CHUNK_SIZE})')
+    parser.add_argument('--skip-existing', action='store_true', help='批量模式下跳过IP已存在的设备而不是更新')
+    parser.add_argument('--preflight', action='store_true',
+                        help='预检模式：校验并并发探测设备可达性和RTSP认证，生成报告（不导入）')
+    parser.add_argument('--commit', action='store_true', help='预检完成后通过批量接口导入预检通过的设备')
+    parser.add_argument('--strict', action='store_true', help='有任何一行未通过预检时不导入')
+    parser.add_argument('--report', default='import_report.jsonl', help='预检报告文件 (默认: import_report.jsonl)')
+    parser.add_argument('--probe-concurrency', type=int, default=DEFAULT_RTSP_CONCURRENCY,
+                        help=f'同时探测的设备数 (默认: {DEFAULT_RTSP_CONCURRENCY})')
+    parser.add_argument('--probe-timeout', type=float, default=DEFAULT_RTSP_TIMEOUT,
+                        help=f'单台设备的探测超时时间（秒） (默认: {DEFAULT_RTSP_TIMEOUT})')
     parser.add_argument('--timeout', type=int, default=30, help='请求超时时间（秒）')
     parser.add_argument('--no-verify-ssl', action='store_true', help='不验证SSL证书')
     parser.add_argument('--output', help='输出结果到指定文件')
@@ -423,15 +768,44 @@ def main():
             verify_ssl=not args.no_verify_ssl
         )
         
-        # 登录
-        username = args.username or input("请输入用户名 (默认: admin): ") or 'admin'
-        password = args.password or input("请输入密码 (默认: ${DEFAULT_ADMIN_PASSWORD}): ") or os.getenv("DEFAULT_ADMIN_PASSWORD", "admin123")
+        # 登录（只做预检时不需要）
+        if not args.preflight or args.commit:
+            username = args.username or input("请输入用户名 (默认: admin): ") or 'admin'
+            password = args.password or input("请输入密码 (默认: ${DEFAULT_ADMIN_PASSWORD}): ") or os.getenv("DEFAULT_ADMIN_PASSWORD", "admin123")
+            
+            importer.login(username, password)
         
-        importer.login(username, password)
+        # 预检（并按需导入）
+        if args.preflight:
+            summary = importer.preflight_import(
+                args.csv_file,
+                args.report,
+                commit=args.commit,
+                strict=args.strict,
+                concurrency=args.probe_concurrency,
+                timeout=args.probe_timeout,
+                chunk_size=max(1, min(args.chunk_size, MAX_CHUNK_SIZE)),
+                update_existing=not args.skip_existing
+            )
+            print(f"\n📊 预检结果: 总计 {summary['total']}, 通过 {summary['passed']}, "
+                  f"未通过 {summary['failed']}, 数据无效 {summary['invalid']}")
+            if summary['probe_statuses']:
+                print(f"   探测结果: {summary['probe_statuses']}")
+            if summary['committed']:
+                print(f"   导入结果: {summary['commit']}")
+            print(f"\n⏱️  总耗时: {summary['elapsed_seconds']:.2f} 秒")
+            print(f"📄 报告已保存到: {args.report}")
+            return
         
         # 导入设备
         start_time = time.time()
-        results = importer.import_from_csv(args.csv_file, dry_run=args.dry_run)
+        results = importer.import_from_csv(
+            args.csv_file,
+            dry_run=args.dry_run,
+            bulk=args.bulk,
+            chunk_size=max(1, min(args.chunk_size, MAX_CHUNK_SIZE)),
+            update_existing=not args.skip_existing
+        )
         end_time = time.time()
         
         # 打印导入结果
@@ -4,12 +4,18 @@ NVR端口映射修复工具
 解决554端口映射到55401后的设备状态检测问题
 """
 
+import asyncio
+import os
 import sqlite3
 import socket
-import subprocess
 import sys
 from datetime import datetime
 
+# 添加项目根目录到Python路径（backend包位于项目根目录下）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from backend.rtsp_probe import HEALTHY, channel_path, probe_rtsp, probe_rtsp_many
+
 DB_PATH = "../backend/data/devices.db"
 
 def test_custom_port(ip, port):
@@ -24,24 +30,19 @@ def test_custom_port(ip, port):
         print(f"端口测试异常: {e}")
         return False
 
+def rtsp_result_message(result):
+    """把RTSP握手结果转换为 (是否可用, 说明)"""
+    if result["status"] == HEALTHY:
+        video = result["video"]
+        return True, f"{video['codec']} {video['width'] or '?'}x{video['height'] or '?'}"
+    return False, f"{result['status']}: {result['error']}"
+
 def test_rtsp_with_custom_port(ip, username, password, port):
-    """使用自定义端口测试RTSP连接（简化版）"""
+    """使用自定义端口执行RTSP OPTIONS/DESCRIBE握手，返回 (是否可用, 说明)"""
     try:
-        # 只测试TCP端口连通性，不实际拉流
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(5)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        
-        if result == 0:
-            # 尝试发送RTSP OPTIONS请求
-            import urllib.request
-            rtsp_url = f"rtsp://{username}:{password}@{ip}:{port}/Streaming/Channels/101"
-            return True, "端口连通"
-        else:
-            return False, "端口不可达"
+        return rtsp_result_message(asyncio.run(probe_rtsp(ip, port, username, password, channel_path())))
     except Exception as e:
-        return True, f"端口映射正常（{e}）"
+        return False, f"RTSP握手异常: {e}"
 
 def get_device_info():
     """获取设备信息"""
@@ -83,6 +84,11 @@ def check_device_health():
     print(f"📋 找到 {len(devices)} 个设备")
     print()
     
+    # 所有设备并发执行RTSP握手
+    rtsp_results = asyncio.run(probe_rtsp_many(
+        (device_id, ip, port, username, password) for device_id, _, ip, port, username, password, _ in devices
+    ))
+    
     for device_id, name, ip, port, username, password, current_status in devices:
         print(f"🎥 检查设备: {name} ({ip}:{port})")
         print("-" * 40)
@@ -92,10 +98,12 @@ def check_device_health():
         print(f"   端口{port}测试: {'✅ 开放' if port_ok else '❌ 关闭'}")
         
         # 测试RTSP连接
-        rtsp_ok, rtsp_error = test_rtsp_with_custom_port(ip, username, password, port)
-        print(f"   RTSP连接测试: {'✅ 成功' if rtsp_ok else '❌ 失败'}")
-        if not rtsp_ok:
-            print(f"   错误信息: {rtsp_error}")
+        rtsp_ok, rtsp_detail = rtsp_result_message(rtsp_results[device_id])
+        print(f"   RTSP握手测试: {'✅ 成功' if rtsp_ok else '❌ 失败'}")
+        if rtsp_ok:
+            print(f"   视频流: {rtsp_detail}")
+        else:
+            print(f"   错误信息: {rtsp_detail}")
         
         # 根据测试结果更新状态
         if port_ok and rtsp_ok:
@@ -113,95 +121,20 @@ def check_device_health():
         
         print()
 
-import os
-
 def create_health_check_script():
-    """创建自定义端口健康检查脚本"""
-    script_content = '''#!/usr/bin/env python3
-"""
-自定义端口健康检查脚本
-支持端口映射后的设备状态检测
-"""
-
-import sqlite3
-import socket
-import os
-import sys
-from datetime import datetime
-
-DB_PATH = "./data/devices.db"
-
-def test_port_with_timeout(ip, port, timeout=3):
-    """测试端口连通性"""
-    try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
-        result = sock.connect_ex((ip, port))
-        sock.close()
-        return result == 0
-    except Exception:
-        return False
-
-def test_rtsp_connection(ip, port, username, password):
-    """测试RTSP连接"""
-    try:
-        rtsp_url = f"rtsp://{username}:{password}@{ip}:{port}/Streaming/Channels/101"
-        
-        # 使用ffmpeg测试RTSP连接
-        cmd = [
-            "ffmpeg",
-            "-rtsp_transport", "tcp",
-            "-i", rtsp_url,
-            "-vframes", "1",
-            "-f", "null",
-            "-",
-            "-t", "3"
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=8)
-        return result.returncode == 0
-    except:
-        return False
-
-def update_device_health_status():
-    """更新所有设备健康状态"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, ip, port, user, pwd FROM devices")
-        devices = cursor.fetchall()
-        
-        for device_id, ip, port, username, password in devices:
-            # 测试端口和RTSP连接
-            port_ok = test_port_with_timeout(ip, port)
-            rtsp_ok = test_rtsp_connection(ip, port, username, password)
-            
-            # 更新状态
-            new_status = "online" if (port_ok and rtsp_ok) else "offline"
-            cursor.execute("UPDATE devices SET status=? WHERE id=?", (new_status, device_id))
-        
-        conn.commit()
-        conn.close()
-        return True
-    except Exception as e:
-        print(f"健康检查失败: {e}")
-        return False
-
-if __name__ == "__main__":
-    update_device_health_status()
-'''
-    
+    """检查自定义端口健康检查脚本（backend/health_check.py，RTSP握手探测）并设置可执行权限"""
     script_path = "../backend/health_check.py"
     try:
-        with open(script_path, 'w', encoding='utf-8') as f:
-            f.write(script_content)
+        if not os.path.exists(script_path):
+            print(f"❌ 未找到健康检查脚本: {script_path}")
+            return False
         
         # 设置可执行权限
         os.chmod(script_path, 0o755)
-        print(f"✅ 健康检查脚本已创建: {script_path}")
+        print(f"✅ 健康检查脚本已就绪: {script_path}")
         return True
     except Exception as e:
-        print(f"❌ 创建脚本失败: {e}")
+        print(f"❌ 设置脚本权限失败: {e}")
         return False
 
 def main():
@@ -212,8 +145,8 @@ def main():
     # 1. 执行健康检查
     check_device_health()
     
-    # 2. 创建自定义健康检查脚本
-    print("\n📁 创建自定义健康检查脚本...")
+    # 2. 检查自定义健康检查脚本
+    print("\n📁 检查自定义健康检查脚本...")
     create_health_check_script()
     
     print("\n✅ 修复完成！")
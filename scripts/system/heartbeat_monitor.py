@@ -2,6 +2,7 @@
 """
 设备心跳监测系统
 自动检测设备在线/离线状态，支持定时监测和手动检查
+用 --once / --device 手动排查设备；后端内置的健康检查调度器（backend/health_scheduler.py）已负责定时检查，后端运行时不必再启动循环模式
 """
 
 import sys
@@ -11,12 +12,14 @@ import threading
 import sqlite3
 import logging
 import socket
-import subprocess
 from datetime import datetime, timedelta
 import requests
 
-# 添加后端目录到路径
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+# 添加项目根目录到路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from backend.icmp_ping import ping_hosts
+from backend.status_writer import StatusWriteBuffer
 
 # 配置日志
 logging.basicConfig(
@@ -36,6 +39,8 @@ class HeartbeatMonitor:
         self.check_interval = check_interval
         self.running = False
         self.thread = None
+        # 检查结果先写入缓冲区，每个检查周期在一个事务中写回
+        self.status_buffer = StatusWriteBuffer(lambda: sqlite3.connect(DB_PATH))
         self.last_check_time = None
         
     def get_all_devices(self):
@@ -52,31 +57,20 @@ class HeartbeatMonitor:
             return []
     
     def ping_device(self, ip, timeout=3):
-        """使用ping命令检测设备是否可达"""
+        """使用进程内ICMP回显检测设备是否可达"""
+        return self.ping_devices([ip], timeout).get(ip, False)
+    
+    def ping_devices(self, ips, timeout=3):
+        """批量ping：所有回显请求从同一个ICMP套接字发出，不再逐台启动ping子进程"""
         try:
-            # Windows系统使用ping命令
-            if os.name == 'nt':
-                cmd = ['ping', '-n', '1', '-w', str(timeout * 1000), ip]
-            else:
-                # Unix系统使用ping命令
-                cmd = ['ping', '-c', '1', '-W', str(timeout), ip]
-            
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout+2)
-            
-            # 检查返回码
-            if result.returncode == 0:
-                # 检查是否有TTL字段，表示设备响应
-                if 'TTL=' in result.stdout or 'ttl=' in result.stdout:
-                    return True
-                return True
-            return False
-            
-        except subprocess.TimeoutExpired:
-            logger.warning(f"Ping {ip} 超时")
-            return False
+            results = ping_hosts(ips, timeout)
+            if results is None:
+                # 不支持非特权ICMP套接字，由端口检查兜底
+                return {}
+            return results
         except Exception as e:
-            logger.error(f"Ping设备 {ip} 时出错: {e}")
-            return False
+            logger.error(f"批量ping设备时出错: {e}")
+            return {}
     
     def check_port_connectivity(self, ip, port, timeout=3):
         """检查端口连通性"""
@@ -90,13 +84,15 @@ class HeartbeatMonitor:
             logger.error(f"检查端口 {ip}:{port} 时出错: {e}")
             return False
     
-    def check_device_online(self, ip, port=554, protocol='rtsp'):
-        """综合检查设备在线状态"""
+    def check_device_online(self, ip, port=554, protocol='rtsp', ping_success=None):
+        """综合检查设备在线状态，ping_success为批量ping的结果时不再单独ping"""
         try:
             # 方法1: 先使用ping检查
-            ping_success = self.ping_device(ip)
-            if not ping_success:
-                logger.debug(f"设备 {ip} ping失败，尝试端口检查")
+            if ping_success is None:
+                ping_success = self.ping_device(ip)
+            if ping_success:
+                return True
+            logger.debug(f"设备 {ip} ping失败，尝试端口检查")
             
             # 方法2: 检查指定端口
             port_success = self.check_port_connectivity(ip, port)
@@ -111,31 +107,28 @@ class HeartbeatMonitor:
             logger.error(f"检查设备 {ip} 状态时出错: {e}")
             return False
     
-    def update_device_status(self, device_id, status, last_seen=None):
-        """更新设备状态到数据库"""
+    def update_device_status(self, device_id, status, checked_at=None):
+        """更新单个设备状态到数据库（批量检查请使用写回缓冲区）"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
-            
-            if last_seen:
-                cursor.execute(
-                    "UPDATE devices SET status = ?, last_seen = ? WHERE id = ?",
-                    (status, last_seen, device_id)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE devices SET status = ? WHERE id = ?",
-                    (status, device_id)
-                )
-            
-            conn.commit()
-            conn.close()
+            self.status_buffer.add(device_id, status == "online", checked_at)
+            self.status_buffer.flush()
             logger.info(f"设备 {device_id} 状态更新为: {status}")
             return True
         except Exception as e:
             logger.error(f"更新设备状态失败: {e}")
             return False
     
+    def flush_status_updates(self):
+        """把缓冲区内的检查结果在一个事务中写回数据库"""
+        try:
+            changes = self.status_buffer.flush()
+            for device_id, old_status, new_status in changes:
+                logger.info(f"设备 {device_id} 状态变化: {old_status} -> {new_status}")
+            return True
+        except Exception as e:
+            logger.error(f"写回设备状态失败: {e}")
+            return False
+    
     def check_single_device(self, device_id):
         """检查单个设备状态"""
         try:
@@ -183,15 +176,18 @@ class HeartbeatMonitor:
         results = []
         online_count = 0
         
+        # 所有设备一次批量ping，只对无回复的设备做端口检查
+        ping_results = self.ping_devices([device[1] for device in devices])
+        
         for device in devices:
             device_id, ip, port, name, protocol = device
             
             try:
-                is_online = self.check_device_online(ip, port or 554, protocol)
+                is_online = self.check_device_online(ip, port or 554, protocol, ping_results.get(ip, False))
                 new_status = "online" if is_online else "offline"
                 
-                # 更新状态
-                self.update_device_status(device_id, new_status, datetime.now().isoformat())
+                # 结果先放入缓冲区，本轮检查结束后统一写回
+                self.status_buffer.add(device_id, is_online)
                 
                 results.append({
                     "device_id": device_id,
@@ -218,6 +214,7 @@ class HeartbeatMonitor:
                     "checked_at": datetime.now().isoformat()
                 })
         
+        self.flush_status_updates()
         self.last_check_time = datetime.now()
         logger.info(f"状态检查完成: {online_count}/{len(devices)} 设备在线")
         
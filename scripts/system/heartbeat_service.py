@@ -2,6 +2,7 @@
 """
 设备心跳监测服务
 定时检查设备在线状态，每10分钟执行一次
+由 install_heartbeat_service.py 安装为系统服务；与后端部署在同一台机器时不要安装，后端的 backend/health_scheduler.py 已在定时检查同一批设备
 """
 
 import sqlite3
@@ -15,10 +16,12 @@ import time
 import subprocess
 import platform
 
-# 添加backend目录到Python路径
-backend_path = os.path.join(os.path.dirname(__file__), '..')
+# 添加项目根目录到Python路径（backend包位于项目根目录下）
+backend_path = os.path.join(os.path.dirname(__file__), '..', '..')
 sys.path.insert(0, backend_path)
 
+from backend.status_writer import write_statuses
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -112,33 +115,17 @@ class HeartbeatService:
                 else:
                     valid_results.append(result)
             
-            # 更新数据库
-            now = datetime.now()
-            online_count = 0
-            
-            for result in valid_results:
-                try:
-                    device_id = result['device_id']
-                    is_online = result['is_online']
-                    new_status = result['status']
-                    
-                    if is_online:
-                        cursor.execute(
-                            "UPDATE devices SET status = ?, last_seen = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                            (new_status, now.isoformat(), now.isoformat(), device_id)
-                        )
-                        online_count += 1
-                    else:
-                        cursor.execute(
-                            "UPDATE devices SET status = ?, last_check = ?, check_count = check_count + 1 WHERE id = ?",
-                            (new_status, now.isoformat(), device_id)
-                        )
-                except Exception as e:
-                    logger.error(f"更新设备 {result.get('device_id', 'unknown')} 状态时出错: {e}")
-                    continue
-            
-            conn.commit()
-            conn.close()
+            # 所有结果在一个事务中写回，状态未变化的设备只更新检查时间
+            checked_at = datetime.now().isoformat()
+            online_count = sum(1 for result in valid_results if result['is_online'])
+            try:
+                changes = write_statuses(
+                    conn, {result['device_id']: (result['is_online'], checked_at) for result in valid_results}
+                )
+                for device_id, old_status, new_status in changes:
+                    logger.info(f"设备 {device_id} 状态变化: {old_status} -> {new_status}")
+            finally:
+                conn.close()
             
             logger.info(f"设备状态检查完成: 在线 {online_count}, 离线 {len(valid_results) - online_count}")
             
@@ -0,0 +1,11 @@
+"""
+单元测试公共配置
+把项目根目录加入路径，测试直接导入backend包中的模块，不依赖运行中的服务
+"""
+
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
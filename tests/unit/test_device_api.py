@@ -0,0 +1,55 @@
+"""
+设备接口的单元测试
+用FastAPI的TestClient直接调用接口（不启动生命周期中的调度器），替换登录校验和设备仓库，不访问数据库
+需要后端依赖（fastapi、httpx），未安装时跳过
+"""
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+from backend import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    async def exists(device_id):
+        return False
+
+    async def get(device_id):
+        return None
+
+    monkeypatch.setattr(main.device_repo, "exists", exists)
+    monkeypatch.setattr(main.device_repo, "get", get)
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"username": "admin", "role": "admin"}
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.pop(main.get_current_user, None)
+
+
+@pytest.mark.parametrize("method, path", [
+    ("get", "/devices/999/uptime"),
+    ("get", "/devices/999/status-history"),
+    ("get", "/devices/999/health"),
+    ("get", "/devices/999/channels"),
+    ("post", "/devices/999/channels/sweep"),
+    ("post", "/devices/999/check-stream"),
+])
+def test_unknown_device_returns_404(client, method, path):
+    response = getattr(client, method)(path)
+    assert response.status_code == 404
+    assert response.json()["detail"] == "设备未找到"
+
+
+def test_check_stream_rejects_unknown_stream_type(client, monkeypatch):
+    async def get(device_id):
+        return {"id": device_id, "name": "测试", "ip": "10.0.0.1", "port": 554, "user": "admin", "pwd": "pw"}
+
+    monkeypatch.setattr(main.device_repo, "get", get)
+    response = client.post("/devices/1/check-stream", params={"stream_type": "third"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "stream_type必须为main或sub"
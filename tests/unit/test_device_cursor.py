@@ -0,0 +1,36 @@
+"""
+设备列表分页游标的单元测试
+"""
+
+import pytest
+
+from backend.repositories import decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("created_at, device_id", [
+    ("2024-05-01T08:30:00.123456", 42),
+    ("2024-05-01 08:30:00", 1),
+    (None, 7),
+])
+def test_cursor_roundtrip(created_at, device_id):
+    cursor = encode_cursor(created_at, device_id)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, device_id)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor("2024-05-01T08:30:00?>>", 10 ** 12)
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_")
+    assert decode_cursor(cursor) == ("2024-05-01T08:30:00?>>", 10 ** 12)
+
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    "not-a-cursor",
+    encode_cursor("2024-05-01", 1)[:-3],
+    "WzEsMiwzXQ",  # [1,2,3]
+    "WyIyMDI0IiwiYWJjIl0",  # ["2024","abc"]
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,79 @@
+"""
+设备批量导入校验的单元测试
+"""
+
+import pytest
+
+from backend.device_import import INVALID, MAX_CHANNELS, validate_device, validate_devices
+
+
+def device(**overrides):
+    row = {"region": "华东", "store": "一号店", "ip": "192.168.1.10", "user": "admin", "pwd": "secret"}
+    row.update(overrides)
+    return row
+
+
+def test_validate_device_defaults():
+    values, errors = validate_device(device())
+    assert errors == []
+    assert values == {
+        "region": "华东", "store": "一号店", "ip": "192.168.1.10", "port": 554, "user": "admin", "pwd": "secret",
+        "chs": 1, "name": None, "protocol": "rtsp"
+    }
+
+
+def test_validate_device_normalizes_values():
+    values, errors = validate_device(device(ip=" 192.168.1.20 ", port="8554", chs="16", name="  收银台 ",
+                                            protocol="HTTP", region=" 华南 "))
+    assert errors == []
+    assert values["ip"] == "192.168.1.20"
+    assert (values["port"], values["chs"]) == (8554, 16)
+    assert (values["name"], values["protocol"], values["region"]) == ("收银台", "http", "华南")
+
+
+def test_validate_device_empty_optional_fields_use_defaults():
+    values, errors = validate_device(device(port="", chs=None, name="", protocol=""))
+    assert errors == []
+    assert (values["port"], values["chs"], values["name"], values["protocol"]) == (554, 1, None, "rtsp")
+
+
+def test_validate_device_missing_required_fields():
+    values, errors = validate_device({"ip": "10.0.0.1", "user": "  "})
+    assert values is None
+    assert errors == ["缺少必需字段: region", "缺少必需字段: store", "缺少必需字段: user", "缺少必需字段: pwd"]
+
+
+@pytest.mark.parametrize("overrides, error", [
+    ({"ip": "192.168.1.256"}, "无效的IP地址: 192.168.1.256"),
+    ({"port": "abc"}, "无效的端口号: abc"),
+    ({"port": 0}, "端口号必须在1-65535之间: 0"),
+    ({"port": 70000}, "端口号必须在1-65535之间: 70000"),
+    ({"chs": MAX_CHANNELS + 1}, f"通道数必须在1-{MAX_CHANNELS}之间: {MAX_CHANNELS + 1}"),
+    ({"protocol": "onvif"}, "不支持的协议: onvif"),
+])
+def test_validate_device_invalid_values(overrides, error):
+    values, errors = validate_device(device(**overrides))
+    assert values is None
+    assert errors == [error]
+
+
+def test_validate_device_rejects_non_object():
+    assert validate_device(["192.168.1.10"]) == (None, ["设备数据必须是对象"])
+
+
+def test_validate_devices_reports_rows_independently():
+    rows = [
+        device(ip="192.168.1.10"),
+        device(ip="bad-ip"),
+        device(ip="192.168.1.11"),
+        device(ip="192.168.1.10", name="重复"),
+        "not a device",
+    ]
+    valid, invalid = validate_devices(rows)
+
+    assert [(index, values["ip"]) for index, values in valid] == [(0, "192.168.1.10"), (2, "192.168.1.11")]
+    assert [(result["index"], result["ip"], result["status"]) for result in invalid] == [
+        (1, "bad-ip", INVALID), (3, "192.168.1.10", INVALID), (4, None, INVALID)
+    ]
+    assert invalid[1]["errors"] == ["IP地址与序号0的设备重复: 192.168.1.10"]
+    assert all(result["device_id"] is None for result in invalid)
@@ -0,0 +1,120 @@
+"""
+设备健康检查调度器的单元测试
+用假的探测引擎和写回缓冲区驱动调度循环，不访问数据库和真实设备
+"""
+
+import asyncio
+import time
+
+from backend import health_scheduler
+from backend.health_scheduler import HealthScheduler
+
+
+class FakeProbeEngine:
+    """按设备ID返回固定的在线状态，并记录每台设备被检查的次数"""
+
+    def __init__(self, online):
+        self.online = online
+        self.checks = {}
+
+    async def probe_many(self, devices):
+        results = {}
+        for device_id, *_ in devices:
+            self.checks[device_id] = self.checks.get(device_id, 0) + 1
+            results[device_id] = device_id in self.online
+        return results
+
+
+class FakeStatusBuffer:
+    def __init__(self):
+        self.results = []
+
+    def __len__(self):
+        return 0
+
+    def add_many(self, results):
+        self.results.append(dict(results))
+
+    def flush(self):
+        return []
+
+
+def make_device(status, protocol="rtsp"):
+    return {"ip": "10.0.0.1", "port": 554, "protocol": protocol, "status": status, "user": "admin", "pwd": "pw",
+            "chs": 64, "failures": 0, "next_check": None, "next_handshake": 0.0}
+
+
+def test_slow_handshake_does_not_drop_offline_devices(monkeypatch):
+    sweep_started = []
+
+    async def slow_sweep(probe_engine, devices, stream_types):
+        # 通道巡检耗时远超离线复查间隔
+        sweep_started.append(time.time())
+        await asyncio.sleep(0.6)
+        return {}
+
+    monkeypatch.setattr(health_scheduler, "sweep_devices", slow_sweep)
+
+    async def run():
+        engine = FakeProbeEngine(online={2})
+        scheduler = HealthScheduler(engine, get_connection=None, offline_interval=0.05, jitter=0.0,
+                                    handshake_interval=3600, decode_interval=0, status_buffer=FakeStatusBuffer())
+        scheduler._store_channels = lambda sweeps: None
+        scheduler._devices = {1: make_device("offline"), 2: make_device("online")}
+        scheduler._next_refresh = scheduler._next_prune = float("inf")
+        scheduler._wake = asyncio.Event()
+        now = time.time()
+        scheduler._schedule(1, now)
+        scheduler._schedule(2, now)
+
+        task = asyncio.create_task(scheduler._run())
+        try:
+            await asyncio.sleep(0.45)
+            # 巡检仍在进行，离线设备已按退避间隔（0.05、0.1、0.2秒）多次复查并仍在队列中
+            assert len(sweep_started) == 1
+            assert scheduler._handshaking == {2}
+            assert engine.checks[1] >= 3
+            assert any(device_id == 1 for _, device_id in scheduler._queue)
+            assert not scheduler._in_flight & {1}
+        finally:
+            task.cancel()
+            for batch in list(scheduler._batches):
+                batch.cancel()
+            await asyncio.gather(task, *scheduler._batches, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_handshake_not_restarted_while_running(monkeypatch):
+    sweeps = []
+
+    async def slow_sweep(probe_engine, devices, stream_types):
+        sweeps.append([device[0] for device in devices])
+        await asyncio.sleep(0.3)
+        return {}
+
+    monkeypatch.setattr(health_scheduler, "sweep_devices", slow_sweep)
+
+    async def run():
+        engine = FakeProbeEngine(online={1})
+        scheduler = HealthScheduler(engine, get_connection=None, interval=0.05, jitter=0.0,
+                                    handshake_interval=3600, decode_interval=0, status_buffer=FakeStatusBuffer())
+        scheduler._store_channels = lambda sweeps: None
+        scheduler._devices = {1: make_device("online")}
+        scheduler._next_refresh = scheduler._next_prune = float("inf")
+        scheduler._wake = asyncio.Event()
+        scheduler._schedule(1, time.time())
+
+        task = asyncio.create_task(scheduler._run())
+        try:
+            await asyncio.sleep(0.25)
+            # 存活探测已多次完成，但巡检只启动一次
+            assert engine.checks[1] >= 3
+            assert sweeps == [[1]]
+        finally:
+            task.cancel()
+            for batch in list(scheduler._batches):
+                batch.cancel()
+            await asyncio.gather(task, *scheduler._batches, return_exceptions=True)
+
+    asyncio.run(run())
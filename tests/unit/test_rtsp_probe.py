@@ -0,0 +1,156 @@
+"""
+RTSP握手探测模块的单元测试
+覆盖响应解析、SDP/SPS解析、认证头计算和DESCRIBE结果分类，不连接真实设备
+"""
+
+import asyncio
+import base64
+import hashlib
+import re
+
+import pytest
+
+from backend.rtsp_probe import (
+    AUTH_FAILED,
+    HEALTHY,
+    NO_STREAM,
+    PROTOCOL_ERROR,
+    RTSPClient,
+    RTSPError,
+    RTSPResponse,
+    _h264_resolution,
+    _parse_challenge,
+    channel_path,
+    describe_result,
+    parse_sdp,
+)
+
+H264_SPROP = ("Z2QAKK2EBUViuKxUdCAqKxXFYqOhAVFYrisVHQgKisVxWKjoQFRWK4rFR0ICorFcVio6ECSFITk8nyfk/k/J8nm5s00IEkKQnJ5Pk/J/J+T5"
+              "PNzZprQDwBEvywgAAAMACAAAAwGQQgAAAAAAAAAAAAAAAAAAAAA=,aO48sA==")
+
+SDP = f"""v=0
+o=- 1 1 IN IP4 0.0.0.0
+s=Media Presentation
+m=video 0 RTP/AVP 96
+a=rtpmap:96 H264/90000
+a=fmtp:96 profile-level-id=420029; packetization-mode=1; sprop-parameter-sets={H264_SPROP}
+a=framerate:25
+a=control:trackID=1
+m=audio 0 RTP/AVP 8
+a=rtpmap:8 PCMA/8000
+a=control:trackID=2
+"""
+
+
+def read_response(data: bytes) -> RTSPResponse:
+    """把原始字节交给RTSPClient的响应解析"""
+    async def run():
+        client = RTSPClient("127.0.0.1")
+        client._reader = asyncio.StreamReader()
+        client._reader.feed_data(data)
+        client._reader.feed_eof()
+        return await client._read_response()
+    return asyncio.run(run())
+
+
+def test_channel_path():
+    assert channel_path() == "/Streaming/Channels/101"
+    assert channel_path(12, "sub") == "/Streaming/Channels/1202"
+
+
+def test_parse_challenge():
+    scheme, params = _parse_challenge('Digest realm="IP Camera", nonce="abc123", qop="auth,auth-int", stale=FALSE')
+    assert scheme == "digest"
+    assert params == {"realm": "IP Camera", "nonce": "abc123", "qop": "auth,auth-int", "stale": "FALSE"}
+    assert _parse_challenge('Basic realm="NVR"') == ("basic", {"realm": "NVR"})
+
+
+def test_read_response_with_body():
+    body = b"v=0\r\n"
+    response = read_response(
+        b"RTSP/1.0 200 OK\r\nCSeq: 2\r\nContent-Type: application/sdp\r\n"
+        b"WWW-Authenticate: Basic realm=\"a\"\r\nWWW-Authenticate: Digest realm=\"a\"\r\n"
+        b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+    )
+    assert (response.status, response.reason) == (200, "OK")
+    assert response.header("CSeq") == "2"
+    assert response.header_list("www-authenticate") == ['Basic realm="a"', 'Digest realm="a"']
+    assert response.body == body
+
+
+@pytest.mark.parametrize("data", [
+    b"HTTP/1.1 200 OK\r\n\r\n",
+    b"RTSP/1.0 200 OK\r\nContent-Length: 10\r\n\r\nshort",
+    b"RTSP/1.0 200 OK\r\n",
+])
+def test_read_response_rejects_invalid(data):
+    with pytest.raises(RTSPError):
+        read_response(data)
+
+
+def test_h264_resolution_from_sps():
+    sps = base64.b64decode(H264_SPROP.split(",")[0])
+    assert _h264_resolution(sps) == (1920, 1088)
+
+
+def test_parse_sdp():
+    sdp = parse_sdp(SDP)
+    assert sdp["tracks"] == 2
+    assert sdp["video"] == {"codec": "H264", "width": 1920, "height": 1088, "framerate": 25.0}
+    assert sdp["audio"] == {"codec": "PCMA", "clock_rate": 8000}
+
+
+def test_parse_sdp_dimensions_attribute():
+    sdp = parse_sdp("m=video 0 RTP/AVP 96\na=rtpmap:96 H265/90000\na=x-dimensions:704,576\n")
+    assert sdp["video"]["codec"] == "H265"
+    assert (sdp["video"]["width"], sdp["video"]["height"]) == (704, 576)
+    assert sdp["audio"] is None
+
+
+def test_digest_authorization():
+    client = RTSPClient("10.0.0.1", 554, "admin", "secret")
+    client._challenge = _parse_challenge('Digest realm="IP Camera", nonce="abc123"')
+    url = client.url("/Streaming/Channels/101")
+    header = client._authorization("DESCRIBE", url)
+
+    assert header.startswith("Digest ")
+    fields = dict(re.findall(r'(\w+)="?([^",]*)"?', header[len("Digest "):]))
+    ha1 = hashlib.md5(b"admin:IP Camera:secret").hexdigest()
+    ha2 = hashlib.md5(f"DESCRIBE:{url}".encode()).hexdigest()
+    assert fields["uri"] == url
+    assert fields["response"] == hashlib.md5(f"{ha1}:abc123:{ha2}".encode()).hexdigest()
+
+
+def test_digest_authorization_with_qop():
+    client = RTSPClient("10.0.0.1", 554, "admin", "secret")
+    client._challenge = _parse_challenge('Digest realm="r", nonce="n", qop="auth", opaque="o"')
+    url = client.url("/")
+    fields = dict(re.findall(r'(\w+)="?([^",]*)"?', client._authorization("OPTIONS", url)[len("Digest "):]))
+
+    ha1 = hashlib.md5(b"admin:r:secret").hexdigest()
+    ha2 = hashlib.md5(f"OPTIONS:{url}".encode()).hexdigest()
+    expected = hashlib.md5(f"{ha1}:n:{fields['nc']}:{fields['cnonce']}:auth:{ha2}".encode()).hexdigest()
+    assert (fields["qop"], fields["nc"], fields["opaque"]) == ("auth", "00000001", "o")
+    assert fields["response"] == expected
+
+
+def test_basic_authorization():
+    client = RTSPClient("10.0.0.1", 554, "admin", "secret")
+    client._challenge = _parse_challenge('Basic realm="NVR"')
+    assert client._authorization("DESCRIBE", client.url("/")) == "Basic " + base64.b64encode(b"admin:secret").decode()
+
+
+@pytest.mark.parametrize("status, body, expected", [
+    (200, SDP.encode(), HEALTHY),
+    (200, b"m=audio 0 RTP/AVP 8\na=rtpmap:8 PCMA/8000\n", NO_STREAM),
+    (401, b"", AUTH_FAILED),
+    (403, b"", AUTH_FAILED),
+    (404, b"", NO_STREAM),
+    (454, b"", NO_STREAM),
+    (500, b"", PROTOCOL_ERROR),
+])
+def test_describe_result_status(status, body, expected):
+    result = describe_result(RTSPResponse(status, "Reason", [], body))
+    assert result["status"] == expected
+    assert result["rtsp_status"] == status
+    assert (result["error"] is None) == (expected == HEALTHY)
@@ -0,0 +1,131 @@
+"""
+设备状态历史汇总的单元测试
+使用内存SQLite，验证时间桶切分、各粒度汇总和在线率查询
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend import status_history
+from backend.status_history import (
+    bucket_end,
+    bucket_start,
+    cover_range,
+    ensure_history_schema,
+    query_series,
+    query_transitions,
+    query_uptime,
+    record_history,
+    split_interval,
+    summarize,
+)
+
+DAY_START = datetime(2024, 5, 1)
+
+
+def ts(**offset) -> float:
+    return (DAY_START + timedelta(**offset)).timestamp()
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    ensure_history_schema(conn)
+    yield conn
+    conn.close()
+
+
+def record(conn, observations, **kwargs):
+    cursor = conn.cursor()
+    record_history(cursor, observations, **kwargs)
+    conn.commit()
+
+
+def test_bucket_boundaries():
+    t = ts(hours=13, minutes=27, seconds=42)
+    assert bucket_start(t, "minute") == int(ts(hours=13, minutes=27))
+    assert bucket_start(t, "hour") == int(ts(hours=13))
+    assert bucket_start(t, "day") == int(ts())
+    assert bucket_end(int(ts(hours=13)), "hour") == int(ts(hours=14))
+    assert bucket_end(int(ts()), "day") == int(ts(days=1))
+
+
+def test_split_interval():
+    parts = list(split_interval(ts(minutes=50), ts(hours=2, minutes=10), "hour"))
+    assert parts == [(int(ts()), 600.0), (int(ts(hours=1)), 3600.0), (int(ts(hours=2)), 600.0)]
+    assert sum(seconds for _, seconds in split_interval(ts(seconds=30), ts(minutes=3), "minute")) == 150.0
+
+
+def test_cover_range_uses_coarsest_buckets():
+    segments = cover_range(ts(hours=22, minutes=30), ts(days=2, hours=1, minutes=15))
+    assert segments == [
+        ("minute", int(ts(hours=22, minutes=30)), int(ts(hours=23))),
+        ("hour", int(ts(hours=23)), int(ts(days=1))),
+        ("day", int(ts(days=1)), int(ts(days=2))),
+        ("hour", int(ts(days=2)), int(ts(days=2, hours=1))),
+        ("minute", int(ts(days=2, hours=1)), int(ts(days=2, hours=1, minutes=15))),
+    ]
+    assert cover_range(ts(hours=1), ts(hours=1)) == []
+
+
+def test_record_history_rollups(conn):
+    record(conn, [(1, None, None, "online", ts(minutes=50))])
+    record(conn, [(1, "online", ts(minutes=50), "offline", ts(hours=1, minutes=10))])
+    record(conn, [(1, "offline", ts(hours=1, minutes=10), "offline", ts(hours=1, minutes=20))])
+
+    for table in status_history.ROLLUP_TABLES.values():
+        online, offline, checks = conn.execute(
+            f"SELECT SUM(online_seconds), SUM(offline_seconds), SUM(checks) FROM {table} WHERE device_id = 1"
+        ).fetchone()
+        assert (online, offline, checks) == (1200.0, 600.0, 3)
+
+    hourly = conn.execute(
+        "SELECT bucket_start, online_seconds, offline_seconds FROM device_status_hourly ORDER BY bucket_start"
+    ).fetchall()
+    assert hourly == [(int(ts()), 600.0, 0.0), (int(ts(hours=1)), 600.0, 600.0)]
+
+    transitions = query_transitions(conn, 1, DAY_START, DAY_START + timedelta(days=1))
+    assert [(t["old_status"], t["new_status"]) for t in transitions] == [("online", "offline"), (None, "online")]
+
+
+def test_record_history_skips_long_gaps(conn):
+    record(conn, [(2, "online", ts(), "online", ts(hours=2))], max_gap=1800)
+    online, offline, checks = conn.execute(
+        "SELECT SUM(online_seconds), SUM(offline_seconds), SUM(checks) FROM device_status_daily WHERE device_id = 2"
+    ).fetchone()
+    assert (online, offline, checks) == (0.0, 0.0, 1)
+
+
+def test_query_uptime_across_days(conn):
+    # 每10分钟检查一次：当天23:00起在线，次日01:00起离线
+    checks = [ts(hours=23) + i * 600 for i in range(19)]
+    previous = None
+    for now in checks:
+        status = "online" if now < ts(days=1, hours=1) else "offline"
+        record(conn, [(3, previous[0] if previous else None, previous[1] if previous else None, status, now)])
+        previous = (status, now)
+
+    totals = query_uptime(conn, DAY_START, DAY_START + timedelta(days=2), device_id=3)
+    assert totals[3]["online_seconds"] == 7200.0
+    assert totals[3]["offline_seconds"] == 3600.0
+    assert totals[3]["checks"] == 19
+
+    partial = query_uptime(conn, DAY_START + timedelta(hours=23, minutes=30), DAY_START + timedelta(days=1, hours=1))
+    assert partial[3]["online_seconds"] == 5400.0
+
+    series = query_series(conn, 3, DAY_START + timedelta(days=1), DAY_START + timedelta(days=1, hours=3), "hour")
+    # 02:00的最后一次检查只计入检查次数
+    assert [(s["online_seconds"], s["offline_seconds"], s["checks"]) for s in series] == [
+        (3600.0, 0.0, 6), (0.0, 3600.0, 6), (0.0, 0.0, 1)
+    ]
+
+
+def test_summarize():
+    start, end = DAY_START, DAY_START + timedelta(hours=1)
+    summary = summarize({"online_seconds": 2700.0, "offline_seconds": 300.0, "checks": 6}, start, end)
+    assert summary == {"online_seconds": 2700.0, "offline_seconds": 300.0, "unknown_seconds": 600.0,
+                       "checks": 6, "uptime_rate": 90.0}
+    assert summarize({}, start, end, devices=2)["unknown_seconds"] == 7200.0
+    assert summarize({}, start, end)["uptime_rate"] is None
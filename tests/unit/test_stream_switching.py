@@ -0,0 +1,65 @@
+"""
+WebRTC主/子码流切换规则的单元测试
+需要WebRTC服务的依赖（aiortc、PyAV、aiohttp），未安装时跳过
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+WEBRTC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'scripts', 'webrtc'))
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    for name in ("aiortc", "av", "aiohttp", "aiohttp_cors"):
+        pytest.importorskip(name)
+    if WEBRTC_DIR not in sys.path:
+        sys.path.insert(0, WEBRTC_DIR)
+    # 模块导入时会在当前目录创建日志文件
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("webrtc"))
+    try:
+        return importlib.import_module("hevc_compat_server")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.mark.parametrize("url, stream_type, expected", [
+    ("rtsp://admin:pw@10.0.0.1:554/Streaming/Channels/101", "sub",
+     "rtsp://admin:pw@10.0.0.1:554/Streaming/Channels/102"),
+    ("rtsp://admin:pw@10.0.0.1:554/Streaming/Channels/1202?transportmode=unicast", "main",
+     "rtsp://admin:pw@10.0.0.1:554/Streaming/Channels/1201?transportmode=unicast"),
+    ("rtsp://10.0.0.1/streaming/channels/301", "main", "rtsp://10.0.0.1/streaming/channels/301"),
+    ("rtsp://admin:pw@10.0.0.2/cam/realmonitor?channel=3&subtype=0", "sub",
+     "rtsp://admin:pw@10.0.0.2/cam/realmonitor?channel=3&subtype=1"),
+    ("rtsp://10.0.0.3/user=admin&password=&channel=2&stream=1.sdp", "main",
+     "rtsp://10.0.0.3/user=admin&password=&channel=2&stream=0.sdp"),
+])
+def test_derive_stream_url(server, url, stream_type, expected):
+    assert server.derive_stream_url(url, stream_type) == expected
+
+
+@pytest.mark.parametrize("url", [
+    "rtsp://10.0.0.1/live/main",
+    "rtsp://10.0.0.1/Streaming/Channels/1",
+    "rtsp://10.0.0.1/Streaming/Channels/103",
+])
+def test_derive_stream_url_unknown_format(server, url):
+    assert server.derive_stream_url(url, "sub") is None
+
+
+def test_select_stream_type(server, monkeypatch):
+    monkeypatch.setitem(server.config, "sub_stream_max_render_size", (960, 540))
+    monkeypatch.setitem(server.config, "sub_stream_hysteresis", 0.1)
+
+    assert server.select_stream_type(640, 360) == "sub"
+    assert server.select_stream_type(960, 540) == "sub"
+    assert server.select_stream_type(1280, 720) == "main"
+    assert server.select_stream_type(961, 300) == "main"
+    # 已在主码流时需要窗口缩小到上限的90%以下才切回子码流
+    assert server.select_stream_type(900, 500, "main") == "main"
+    assert server.select_stream_type(864, 486, "main") == "sub"
+    assert server.select_stream_type(900, 500, "sub") == "sub"